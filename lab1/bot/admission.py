@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Контроль нагрузки на обработчики команд
+У каждой команды есть стоимость: /test_reminders запускает три рассылки и
+стоит дорого, /help — единица. Одновременно выполняются команды общей
+стоимостью не больше capacity, причем дорогие не могут занять последние
+light_reserve единиц — они оставлены дешевым командам, чтобы их задержка не
+росла, пока идут тяжелые. Если места нет, команда ждет в короткой очереди
+(не больше max_waiting команд, из них дорогих — не больше половины, и не
+дольше max_wait секунд); при переполненной очереди или по истечении ожидания
+команда не выполняется, а пользователь получает ответ "бот занят"
+
+Дешевые команды не стоят в очереди за дорогими: освободившееся место
+отдается первой ожидающей команде, которая в него помещается
+
+capacity + max_waiting стоит держать меньше MAX_CONCURRENT_UPDATES
+(update_processor.py): тогда ожидающие команды не занимают все слоты
+обработки обновлений
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Сколько единиц стоимости выполняется одновременно
+DEFAULT_CAPACITY = 16
+
+# Сколько команд может ждать места
+DEFAULT_MAX_WAITING = 8
+
+# Сколько секунд команда может ждать места
+DEFAULT_MAX_WAIT = 5.0
+
+# Стоимость команды, которой нет в таблице стоимостей
+DEFAULT_COST = 1
+
+# Как часто писать в лог сводку об отказах (секунды)
+REJECT_LOG_INTERVAL = 10.0
+
+# Причины отказа (метка reason в метриках)
+QUEUE_FULL = 'queue_full'
+TIMEOUT = 'timeout'
+
+
+class AdmissionController:
+    """
+    Взвешенный ограничитель одновременных команд с короткой очередью
+
+    Args:
+        capacity: Общая стоимость одновременно выполняемых команд
+        max_waiting: Сколько команд может ждать места
+        max_wait: Сколько секунд команда ждет места, прежде чем получить отказ
+        costs: Стоимость команд по имени; остальные стоят DEFAULT_COST
+        light_reserve: Сколько единиц недоступно командам дороже DEFAULT_COST
+            (по умолчанию четверть capacity)
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, max_waiting: int = DEFAULT_MAX_WAITING,
+                 max_wait: float = DEFAULT_MAX_WAIT, costs: Optional[Dict[str, int]] = None,
+                 light_reserve: Optional[int] = None):
+        if capacity < 1:
+            raise ValueError("capacity должна быть положительной")
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.costs = dict(costs or {})
+        self.light_reserve = min(capacity - 1, capacity // 4 if light_reserve is None else light_reserve)
+        self.in_use = 0
+        self._rejected_since_log = 0
+        self._last_reject_log = 0.0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        """Сколько команд ждут места"""
+        return len(self._waiters)
+
+    def cost(self, command: str) -> int:
+        """Стоимость команды; дорогая команда не может стоить больше доступной ей емкости"""
+        cost = self.costs.get(command, DEFAULT_COST)
+        if cost <= DEFAULT_COST:
+            return max(cost, 1)
+        return min(cost, self.capacity - self.light_reserve)
+
+    def _fits(self, cost: int) -> bool:
+        limit = self.capacity if cost <= DEFAULT_COST else self.capacity - self.light_reserve
+        return self.in_use + cost <= limit
+
+    def _queue_limit(self, cost: int) -> int:
+        # Дорогие команды занимают не больше половины очереди: вторая половина — дешевым
+        return self.max_waiting if cost <= DEFAULT_COST else self.max_waiting // 2
+
+    async def acquire(self, command: str) -> Optional[str]:
+        """
+        Занимает место под команду
+
+        Returns:
+            None, если команду можно выполнять (после нее обязателен release()),
+            иначе причина отказа: QUEUE_FULL или TIMEOUT
+        """
+        cost = self.cost(command)
+        # Не обгоняем ожидающие команды той же или меньшей стоимости
+        if self._fits(cost) and not any(waiting_cost <= cost for waiting_cost, _ in self._waiters):
+            self.in_use += cost
+            return None
+        if len(self._waiters) >= self._queue_limit(cost):
+            return QUEUE_FULL
+
+        entry = (cost, asyncio.get_running_loop().create_future())
+        self._waiters.append(entry)
+        try:
+            done, _ = await asyncio.wait((entry[1],), timeout=self.max_wait)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        if not done:
+            self._abandon(entry)
+            return TIMEOUT
+        return None
+
+    def release(self, command: str) -> None:
+        """Освобождает место, занятое acquire()"""
+        self.in_use -= self.cost(command)
+        self._wake()
+
+    def _abandon(self, entry: Tuple[int, asyncio.Future]) -> None:
+        cost, waiter = entry
+        if waiter.done():
+            # Место успели выдать одновременно с отменой: возвращаем его
+            self.in_use -= cost
+        else:
+            self._waiters.remove(entry)
+            waiter.cancel()
+        self._wake()
+
+    def _wake(self) -> None:
+        """Отдает освободившееся место ожидающим командам, которые в него помещаются"""
+        for entry in list(self._waiters):
+            cost, waiter = entry
+            if self._fits(cost):
+                self._waiters.remove(entry)
+                self.in_use += cost
+                waiter.set_result(None)
+
+    def _log_reject(self, command: str, reason: str) -> None:
+        # При перегрузке отказов тысячи: в лог — не чаще раза в REJECT_LOG_INTERVAL, точные числа — в метриках
+        self._rejected_since_log += 1
+        now = time.monotonic()
+        if now - self._last_reject_log < REJECT_LOG_INTERVAL:
+            return
+        logger.warning(f"Перегрузка: отклонено команд: {self._rejected_since_log}, последняя /{command} ({reason}); "
+                       f"занято {self.in_use} из {self.capacity}, ждут {self.waiting}")
+        self._rejected_since_log = 0
+        self._last_reject_log = now
+
+    def guard(self, command: str, handler: Callable[..., Awaitable],
+              on_reject: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        """
+        Оборачивает обработчик команды: он выполняется, только если нашлось место,
+        иначе вызывается on_reject(update, context) — обычно ответ "бот занят"
+        """
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            reason = await self.acquire(command)
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, command=command)
+            if reason is not None:
+                ADMISSION_REJECTED.inc(command=command, reason=reason)
+                self._log_reject(command, reason)
+                await on_reject(update, context)
+                return
+            try:
+                await handler(update, context)
+            finally:
+                self.release(command)
+        return wrapper
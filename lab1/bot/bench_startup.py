@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Замер холодного старта бота
+Каждый прогон — новый интерпретатор во временной папке (своя пустая база),
+поэтому кэш модулей и данные прошлых прогонов не влияют на результат.
+Сеть не используется: приложение собирается, но не запускается
+
+Этапы:
+    storage  импорт storage (путь скриптов проверки)
+    bot      импорт модуля бота
+    build    build_application(): приложение, обработчики, подписчики, планировщик
+    total    от запуска процесса до готового приложения (включая старт Python)
+
+Использование:
+    python bench_startup.py [--runs 10] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Выполняется в дочернем процессе; печатает длительности этапов в мс
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {bot_dir!r})
+t0 = time.perf_counter()
+import storage
+t1 = time.perf_counter()
+import bot
+t2 = time.perf_counter()
+bot.build_application()
+t3 = time.perf_counter()
+print(json.dumps({{'storage': (t1 - t0) * 1000, 'bot': (t2 - t1) * 1000, 'build': (t3 - t2) * 1000}}))
+"""
+
+PHASES = ('storage', 'bot', 'build', 'total')
+
+
+def run_once(workdir: str) -> Dict[str, float]:
+    """Один прогон в новом процессе"""
+    env = dict(os.environ)
+    env.setdefault('BOT_TOKEN', '123456:benchmark')
+    env['BROADCAST_WORKERS'] = '1'
+    env.pop('WEBHOOK_URL', None)
+
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(bot_dir=BOT_DIR)],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True
+    )
+    total = (time.perf_counter() - started) * 1000
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    timings['total'] = total
+    return timings
+
+
+def summarize(runs: List[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Медиана, минимум и максимум по каждому этапу"""
+    return {
+        phase: {
+            'median_ms': round(statistics.median(run[phase] for run in runs), 1),
+            'min_ms': round(min(run[phase] for run in runs), 1),
+            'max_ms': round(max(run[phase] for run in runs), 1),
+        }
+        for phase in PHASES
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер холодного старта бота")
+    parser.add_argument('--runs', type=int, default=10, help="количество прогонов")
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Первый прогон прогревает __pycache__ и файловый кэш ОС и не учитывается
+        run_once(workdir)
+        for _ in range(args.runs):
+            runs.append(run_once(workdir))
+
+    summary = summarize(runs)
+    if args.json:
+        print(json.dumps({'runs': args.runs, 'python': sys.version.split()[0], 'phases': summary}, indent=2))
+        return 0
+
+    print(f"Холодный старт, {args.runs} прогонов (Python {sys.version.split()[0]}):")
+    for phase in PHASES:
+        stats = summary[phase]
+        print(f"  {phase:<8} медиана {stats['median_ms']:7.1f} мс   "
+              f"мин {stats['min_ms']:7.1f}   макс {stats['max_ms']:7.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
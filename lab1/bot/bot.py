@@ -3,35 +3,33 @@
 """
 Telegram-бот для команды Commitly
 Бот-помощник с функциями информации о компании, контактами и напоминаниями
+
+Из тяжелых зависимостей при импорте откладывается только telegram.ext:
+он загружается в build_application(), а рассылки в процессах, вебхук и
+планировщик — когда они включены. Сам telegram (а с ним и httpx) загружается
+сразу: он нужен broadcast (классы ошибок) и messages (ответы собираются
+с MessageEntity при импорте). Скрипты проверки берут данные из storage,
+не импортируя бот
 """
 
+from __future__ import annotations
+
 import logging
-import json
 import os
-import random
 import asyncio
-from datetime import datetime, time, timezone, timedelta
-from typing import Dict, Any
-
-from telegram import Update
-from telegram.ext import (
-    Application, 
-    CommandHandler, 
-    ContextTypes,
-    CallbackContext
-)
-from telegram.constants import ParseMode
+from datetime import datetime, time, timedelta
+import functools
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Union
+
 import pytz
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования: запись в stderr идет из фонового потока, не из event loop
+from logging_setup import setup_logging
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Дополнительное логирование для отладки
@@ -40,51 +38,109 @@ logging.getLogger('httpx').setLevel(logging.WARNING)
 
 # Конфигурация
 BOT_TOKEN = os.getenv('BOT_TOKEN')
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не найден в переменных окружения!")
+
+# Режим вебхука: если задан WEBHOOK_URL, бот принимает обновления через HTTP-сервер
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('PORT', '8080'))
+
+# Адрес Bot API: свой сервер telegram-bot-api или фейковый сервер бенчмарка
+# (fake_telegram.py); по умолчанию — api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# Метрики Prometheus: если задан METRICS_PORT, /metrics отдается на METRICS_HOST:METRICS_PORT
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Сторож event loop (loop_watchdog.py): LOOP_WATCHDOG=1 включает замер задержек и поиск блокирующих вызовов
+LOOP_WATCHDOG = os.getenv('LOOP_WATCHDOG', '0') == '1'
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv('LOOP_WATCHDOG_THRESHOLD', '0.25'))
+
+# Отладка: DEBUG_MOTIVATION_LOOP=1 рассылает цитату всем подписчикам каждые 30 секунд.
+# Каждая такая рассылка сдвигает и сохраняет ротацию цитат, поэтому в работе флаг выключен
+DEBUG_MOTIVATION_LOOP = os.getenv('DEBUG_MOTIVATION_LOOP', '0') == '1'
+
+# Пользователи, которым доступны служебные команды (/loopstats), через запятую
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').replace(',', ' ').split()}
+
+# Сколько чатов обрабатывается одновременно (update_processor.py); обновления одного чата идут по порядку
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+
+# Контроль нагрузки (admission.py): общая стоимость одновременно выполняемых команд,
+# сколько команд может ждать места и сколько секунд; остальным отвечаем, что бот занят
+ADMISSION_CAPACITY = int(os.getenv('ADMISSION_CAPACITY', '16'))
+ADMISSION_QUEUE = int(os.getenv('ADMISSION_QUEUE', '8'))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '5'))
+
+# Стоимость команд для контроля нагрузки; не указанные стоят 1
+COMMAND_COSTS = {
+    'test_reminders': 8,  # три рассылки всем подписчикам
+    'test': 2,            # несколько сообщений с паузой
+}
+
+# Количество процессов для рассылок (1 — рассылка в основном процессе)
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '1'))
 
 # Часовой пояс для МСК
 MSK_TZ = pytz.timezone('Europe/Moscow')
 
-# Файл для хранения данных
-DATA_FILE = 'bot_data.json'
-
 # Импорт мотивирующих цитат
-from quotes import get_random_quote
-
-def load_data() -> Dict[str, Any]:
-    """Загружает данные из JSON файла"""
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке данных: {e}")
-        return {}
+from quotes import QuoteRotation, get_quotes
+# load_data/save_data реэкспортируются для старых скриптов проверки
+from storage import get_subscribers, get_run_ledger, get_outbox, get_quote_states, load_data, save_data
+from broadcast import Broadcaster, get_broadcaster, set_broadcaster
+from outbox import OutboxWorker
+from metrics import (
+    ADMISSION_IN_USE, ADMISSION_WAITING, OUTBOX_DEAD, OUTBOX_PENDING, SUBSCRIBERS, UPDATES_ACTIVE_CHATS,
+    UPDATES_QUEUED, instrument_handler, record_broadcast,
+)
+from admission import AdmissionController
+from messages import (
+    ABOUT_REPLY, BUSY_REPLY, CONTACTS_REPLY, HELP_REPLY, MEETING_PREPARATION, MEETING_START, MOTIVATIONAL_QUOTE,
+    SCHEDULER_TEST, START_REPLY, RenderedMessage, StaticReply
+)
 
-def save_data(data: Dict[str, Any]) -> None:
-    """Сохраняет данные в JSON файл"""
-    try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении данных: {e}")
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
+
+_quote_rotation: Optional[QuoteRotation] = None
+
+def get_quote_rotation() -> QuoteRotation:
+    """Возвращает ротацию цитат (состояние пользователей загружается один раз)"""
+    global _quote_rotation
+    if _quote_rotation is None:
+        _quote_rotation = QuoteRotation(get_quotes(), get_quote_states().load())
+    return _quote_rotation
+
+async def save_quote_rotation() -> None:
+    """Сохраняет сдвинутые курсоры цитат одной транзакцией вне event loop"""
+    if _quote_rotation is None:
+        return
+    rows = _quote_rotation.take_dirty()
+    if rows:
+        await asyncio.get_running_loop().run_in_executor(None, get_quote_states().save, rows)
+
+@functools.lru_cache(maxsize=4096)
+def _quote_message(index: int) -> RenderedMessage:
+    """Сообщение с цитатой: рендерится один раз на цитату (кэш ограничен — корпус может быть большим)"""
+    return MOTIVATIONAL_QUOTE.render(quote=get_quote_rotation().quotes[index])
+
+async def _reply_static(update: Update, reply: StaticReply) -> None:
+    """Отправляет заранее подготовленный ответ (entities вместо parse_mode)"""
+    await update.message.reply_text(reply.text, entities=reply.entities)
+
+async def busy_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ответ на команду, отклоненную контролем нагрузки"""
+    if update.message is not None:
+        await _reply_static(update, BUSY_REPLY)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start"""
     try:
-        welcome_message = """
-🤖 Добро пожаловать в бот-помощник команды Commitly!
-
-Доступные команды:
-/about - информация о компании
-/contacts - контакты команды
-/help - справка по командам
-
-Бот будет напоминать о важных событиях и мотивировать вас каждый день! 🚀
-        """
-        await update.message.reply_text(welcome_message)
+        await _reply_static(update, START_REPLY)
         logger.info(f"Пользователь {update.effective_user.id} запустил бота")
     except Exception as e:
         logger.error(f"Ошибка в команде start: {e}")
@@ -94,105 +150,31 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /about - информация о компании"""
     try:
         logger.info(f"Пользователь {update.effective_user.id} запросил информацию о компании")
-        
-        about_text = """*Commitly* — это B2B-платформа для обучения программистов через геймификацию.
-
-• Программисты как обычно пишут код и проходят тесты: юнит, функциональное тестирование, нагрузочное, тесты по безопасности и тд
-
-• Платформа автоматически генерирует для них персонализированные обучающие игры.
-
-• Обучение фокусируется на изучении новых технологий через практику, адаптированные под уровень и цели пользователя с помощью AI.
-
-• Система включает постоянный конкурентный режим с рейтингами, наградами и лидерами, что мотивирует сотрудников учиться активнее."""
-        
-        await update.message.reply_text(about_text, parse_mode=ParseMode.MARKDOWN)
+        await _reply_static(update, ABOUT_REPLY)
         logger.info(f"Информация о компании успешно отправлена пользователю {update.effective_user.id}")
-        
     except Exception as e:
         logger.error(f"Ошибка в команде about: {e}", exc_info=True)
-        try:
-            # Fallback без Markdown
-            fallback_text = """Commitly — это B2B-платформа для обучения программистов через геймификацию.
-
-Программисты как обычно пишут код и проходят тесты: юнит, функциональное тестирование, нагрузочное, тесты по безопасности и тд
-
-Платформа автоматически генерирует для них персонализированные обучающие игры.
-
-Обучение фокусируется на изучении новых технологий через практику, адаптированные под уровень и цели пользователя с помощью AI.
-
-Система включает постоянный конкурентный режим с рейтингами, наградами и лидерами, что мотивирует сотрудников учиться активнее."""
-            await update.message.reply_text(fallback_text)
-        except Exception as fallback_error:
-            logger.error(f"Критическая ошибка при отправке fallback сообщения: {fallback_error}")
-            await update.message.reply_text("Произошла ошибка. Попробуйте позже.")
+        await update.message.reply_text("Произошла ошибка. Попробуйте позже.")
 
 async def contacts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /contacts - контакты команды"""
     try:
         logger.info(f"Пользователь {update.effective_user.id} запросил контакты")
-        
-        # Простой текст без Markdown для избежания ошибок форматирования
-        contacts_text = """📞 Контакты команды:
-
-👨‍💻 Алексей: @alxxcold
-👨‍💻 Даниил: @D_Korr
-
-Свяжитесь с нами для любых вопросов! 💬"""
-        
-        await update.message.reply_text(contacts_text)
+        await _reply_static(update, CONTACTS_REPLY)
         logger.info(f"Контакты успешно отправлены пользователю {update.effective_user.id}")
-        
     except Exception as e:
         logger.error(f"Ошибка в команде contacts: {e}", exc_info=True)
-        try:
-            # Fallback - отправляем простой текст без эмодзи
-            fallback_text = "Контакты команды:\nАлексей: @alxxcold\nДаниил: @D_Korr"
-            await update.message.reply_text(fallback_text)
-        except Exception as fallback_error:
-            logger.error(f"Критическая ошибка при отправке fallback сообщения: {fallback_error}")
-            await update.message.reply_text("Произошла ошибка. Попробуйте позже.")
+        await update.message.reply_text("Произошла ошибка. Попробуйте позже.")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /help"""
     try:
         logger.info(f"Пользователь {update.effective_user.id} запросил справку")
-        
-        help_text = """🆘 Справка по командам:
-
-/start - запуск бота
-/about - информация о компании Commitly
-/contacts - контакты команды
-/help - эта справка
-/test - тест отправки сообщений
-/test_reminders - ручной тест напоминаний
-
-🤖 Автоматические функции:
-• Напоминания о встречах (вторник, четверг)
-• Ежедневные мотивирующие цитаты"""
-        
-        await update.message.reply_text(help_text)
+        await _reply_static(update, HELP_REPLY)
         logger.info(f"Справка успешно отправлена пользователю {update.effective_user.id}")
-        
     except Exception as e:
         logger.error(f"Ошибка в команде help: {e}", exc_info=True)
-        try:
-            # Fallback без эмодзи
-            fallback_text = """Справка по командам:
-
-/start - запуск бота
-/about - информация о компании Commitly
-/contacts - контакты команды
-/help - эта справка
-/test - тест отправки сообщений
-/test_reminders - ручной тест напоминаний
-
-Автоматические функции:
-• Напоминания о встречах (вторник, четверг)
-• Ежедневные мотивирующие цитаты"""
-            await update.message.reply_text(fallback_text)
-        except Exception as fallback_error:
-            logger.error(f"Критическая ошибка при отправке fallback сообщения: {fallback_error}")
-            await update.message.reply_text("Произошла ошибка. Попробуйте позже.")
+        await update.message.reply_text("Произошла ошибка. Попробуйте позже.")
 
 async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /test - тест отправки сообщений"""
@@ -214,7 +196,7 @@ async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         
         # Тест мотивирующей цитаты
         await asyncio.sleep(1)
-        quote = get_random_quote()
+        quote = get_quote_rotation().next_quote(update.effective_user.id)
         quote_message = f"💫 Тест мотивации:\n\n{quote}"
         await update.message.reply_text(quote_message)
         logger.info(f"Тестовая цитата отправлена пользователю {update.effective_user.id}")
@@ -243,158 +225,101 @@ async def test_reminders_command(update: Update, context: ContextTypes.DEFAULT_T
         logger.error(f"Ошибка в команде test_reminders: {e}", exc_info=True)
         await update.message.reply_text("Ошибка при тестировании напоминаний. Проверьте логи.")
 
+async def loop_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик служебной команды /loopstats - задержки и блокировки event loop (только ADMIN_IDS)"""
+    if update.effective_user is None or update.effective_user.id not in ADMIN_IDS:
+        return
+    watchdog = context.application.bot_data.get('loop_watchdog')
+    if watchdog is None:
+        await update.message.reply_text("Сторож event loop выключен. Включите его переменной LOOP_WATCHDOG=1")
+        return
+    await update.message.reply_text(watchdog.format_stats())
+
+async def _prune_blocked(chat_ids, label: str) -> int:
+    """Отключает пользователей, заблокировавших бота, и чистит их очередь (запись в SQLite — вне event loop)"""
+    if not chat_ids:
+        return 0
+    loop = asyncio.get_running_loop()
+    pruned = await loop.run_in_executor(None, functools.partial(get_subscribers().deactivate_many, chat_ids,
+                                                                reason='blocked'))
+    discarded = await loop.run_in_executor(None, get_outbox().discard_chats, chat_ids)
+    logger.info(f"{label}: отключено пользователей, заблокировавших бота: {pruned}, "
+                f"удалено сообщений из очереди: {discarded}, осталось подписчиков: {len(get_subscribers())}")
+    return pruned
+
+async def _broadcast_to_subscribers(bot, message: Union[RenderedMessage, Callable[[int], RenderedMessage]],
+                                    label: str):
+    """
+    Рассылает сообщение всем подписчикам; None, если подписчиков нет
+
+    message — готовое сообщение или функция user_id -> сообщение (для персональных рассылок)
+    """
+    users = get_subscribers().get_users()
+    if not users:
+        return None
+
+    if callable(message):
+        text = lambda user_id: message(user_id).text
+        fallback_text = lambda user_id: message(user_id).fallback_text
+    else:
+        text, fallback_text = message.text, message.fallback_text
+
+    result = await get_broadcaster().broadcast(
+        bot,
+        users,
+        text,
+        fallback_text=fallback_text,
+        label=label
+    )
+    result.pruned = await _prune_blocked(result.blocked_ids, label)
+    record_broadcast(label, result)
+    return result
+
 async def send_motivational_quote(bot) -> None:
-    """Отправляет мотивирующую цитату всем пользователям"""
+    """Отправляет каждому пользователю следующую цитату из его ротации"""
     try:
-        data = load_data()
-        users = data.get('users', [])
-        
-        if not users:
+        rotation = get_quote_rotation()
+        picks: Dict[int, RenderedMessage] = {}
+
+        def message_for(user_id: int) -> RenderedMessage:
+            # Курсор сдвигается один раз на пользователя за рассылку
+            message = picks.get(user_id)
+            if message is None:
+                message = picks[user_id] = _quote_message(rotation.next_index(user_id))
+            return message
+
+        # Отправляем без Markdown для избежания ошибок
+        result = await _broadcast_to_subscribers(bot, message_for, "Мотивирующая цитата")
+        await save_quote_rotation()
+        if result is None:
             logger.info("Нет пользователей для отправки мотивирующей цитаты")
             return
-            
-        quote = get_random_quote()
-        success_count = 0
-        
-        for user_id in users:
-            try:
-                # Отправляем без Markdown для избежания ошибок
-                message_text = f"💫 Мотивация дня:\n\n{quote}"
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=message_text
-                )
-                success_count += 1
-                logger.info(f"Мотивирующая цитата отправлена пользователю {user_id}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки цитаты пользователю {user_id}: {e}")
-                # Пробуем отправить без эмодзи
-                try:
-                    simple_quote = quote.replace("🚀", "").replace("💡", "").replace("⚡", "").replace("🎯", "").replace("🔥", "").replace("🌟", "").replace("💪", "").replace("🎨", "").replace("⭐", "").replace("🎪", "").replace("🏆", "").replace("🎵", "").replace("🌈", "").replace("🎭", "")
-                    await bot.send_message(
-                        chat_id=user_id,
-                        text=f"Мотивация дня:\n\n{simple_quote}"
-                    )
-                    success_count += 1
-                    logger.info(f"Мотивирующая цитата (упрощенная) отправлена пользователю {user_id}")
-                except Exception as e2:
-                    logger.error(f"Критическая ошибка отправки цитаты пользователю {user_id}: {e2}")
-        
-        logger.info(f"Отправлена мотивирующая цитата {success_count} из {len(users)} пользователям")
+
+        logger.info(f"Отправлена мотивирующая цитата {result.delivered} из {result.total} пользователям за {result.duration:.1f} с, отключено заблокировавших: {result.pruned}")
     except Exception as e:
         logger.error(f"Ошибка при отправке мотивирующих цитат: {e}", exc_info=True)
 
 async def remind_meeting_preparation(bot) -> None:
-    """Напоминает о подготовке к встрече (вторник 19:30)"""
+    """Напоминает о подготовке к встрече (вторник 19:32)"""
     try:
-        data = load_data()
-        users = data.get('users', [])
-        
-        if not users:
+        result = await _broadcast_to_subscribers(bot, MEETING_PREPARATION.render(), "Напоминание о подготовке к встрече")
+        if result is None:
             logger.info("Нет пользователей для напоминания о подготовке к встрече")
             return
-            
-        success_count = 0
-        
-        for user_id in users:
-            try:
-                # Отправляем без Markdown для избежания ошибок
-                message = """📅 Напоминание о встрече!
-
-Завтра (среда) в 18:50 начинается встреча по проекту! 
-
-⏰ Время подготовки: сегодня в 19:32
-🎯 Не забудьте подготовить отчеты и вопросы!
-
-Удачи! 🚀"""
-                
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=message
-                )
-                success_count += 1
-                logger.info(f"Напоминание о подготовке к встрече отправлено пользователю {user_id}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки напоминания пользователю {user_id}: {e}")
-                # Пробуем отправить упрощенную версию
-                try:
-                    simple_message = """Напоминание о встрече!
-
-Завтра (среда) в 18:50 начинается встреча по проекту! 
-
-Время подготовки: сегодня в 19:30
-Не забудьте подготовить отчеты и вопросы!
-
-Удачи!"""
-                    await bot.send_message(
-                        chat_id=user_id,
-                        text=simple_message
-                    )
-                    success_count += 1
-                    logger.info(f"Напоминание о подготовке (упрощенное) отправлено пользователю {user_id}")
-                except Exception as e2:
-                    logger.error(f"Критическая ошибка отправки напоминания пользователю {user_id}: {e2}")
-        
-        logger.info(f"Отправлено напоминание о подготовке к встрече {success_count} из {len(users)} пользователям")
+
+        logger.info(f"Отправлено напоминание о подготовке к встрече {result.delivered} из {result.total} пользователям за {result.duration:.1f} с, отключено заблокировавших: {result.pruned}")
     except Exception as e:
         logger.error(f"Ошибка при отправке напоминания о подготовке: {e}", exc_info=True)
 
 async def remind_meeting_start(bot) -> None:
     """Напоминает о начале встречи (четверг 18:50)"""
     try:
-        data = load_data()
-        users = data.get('users', [])
-        
-        if not users:
+        result = await _broadcast_to_subscribers(bot, MEETING_START.render(), "Напоминание о встрече")
+        if result is None:
             logger.info("Нет пользователей для напоминания о встрече")
             return
-            
-        success_count = 0
-        
-        for user_id in users:
-            try:
-                # Отправляем без Markdown для избежания ошибок
-                message = """🚀 Встреча начинается!
-
-Сейчас (18:50) начинается встреча по проекту!
-
-📋 Готовьтесь к обсуждению:
-• Текущие задачи
-• Проблемы и решения
-• Планы на следующую неделю
-
-Удачной встречи! 💪"""
-                
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=message
-                )
-                success_count += 1
-                logger.info(f"Напоминание о встрече отправлено пользователю {user_id}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки напоминания о встрече пользователю {user_id}: {e}")
-                # Пробуем отправить упрощенную версию
-                try:
-                    simple_message = """Встреча начинается!
-
-Сейчас (18:50) начинается встреча по проекту!
-
-Готовьтесь к обсуждению:
-• Текущие задачи
-• Проблемы и решения
-• Планы на следующую неделю
-
-Удачной встречи!"""
-                    await bot.send_message(
-                        chat_id=user_id,
-                        text=simple_message
-                    )
-                    success_count += 1
-                    logger.info(f"Напоминание о встрече (упрощенное) отправлено пользователю {user_id}")
-                except Exception as e2:
-                    logger.error(f"Критическая ошибка отправки напоминания о встрече пользователю {user_id}: {e2}")
-        
-        logger.info(f"Отправлено напоминание о встрече {success_count} из {len(users)} пользователям")
+
+        logger.info(f"Отправлено напоминание о встрече {result.delivered} из {result.total} пользователям за {result.duration:.1f} с, отключено заблокировавших: {result.pruned}")
     except Exception as e:
         logger.error(f"Ошибка при отправке напоминания о встрече: {e}", exc_info=True)
 
@@ -402,103 +327,29 @@ async def test_scheduled_message(bot) -> None:
     """Тестовая функция для проверки работы планировщика"""
     try:
         logger.info("🧪 Тестовая задача выполняется - планировщик работает!")
-        
-        data = load_data()
-        users = data.get('users', [])
-        
-        if not users:
+
+        result = await _broadcast_to_subscribers(bot, SCHEDULER_TEST.render(), "Тестовое сообщение")
+        if result is None:
             logger.info("Нет пользователей для тестового сообщения")
             return
-            
-        test_message = "🧪 Тест планировщика!\n\nЕсли вы получили это сообщение, значит периодические задачи работают правильно!"
-        
-        success_count = 0
-        for user_id in users:
-            try:
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=test_message
-                )
-                success_count += 1
-                logger.info(f"Тестовое сообщение отправлено пользователю {user_id}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки тестового сообщения пользователю {user_id}: {e}")
-        
-        logger.info(f"Тестовая задача завершена. Отправлено {success_count} из {len(users)} сообщений")
-        
-    except Exception as e:
-        logger.error(f"Ошибка в тестовой задаче: {e}", exc_info=True)
 
-async def track_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Отслеживает пользователей для отправки напоминаний"""
-    try:
-        user_id = update.effective_user.id
-        data = load_data()
-        
-        if 'users' not in data:
-            data['users'] = []
-            
-        if user_id not in data['users']:
-            data['users'].append(user_id)
-            save_data(data)
-            logger.info(f"Добавлен новый пользователь: {user_id}")
-    except Exception as e:
-        logger.error(f"Ошибка при отслеживании пользователя: {e}")
+        logger.info(f"Тестовая задача завершена. Отправлено {result.delivered} из {result.total} сообщений, отключено заблокировавших: {result.pruned}")
 
-# ...existing code...
-
-async def test_scheduled_message(bot) -> None:
-    """Тестовая функция для проверки работы планировщика"""
-    try:
-        logger.info("🧪 Тестовая задача выполняется - планировщик работает!")
-        
-        data = load_data()
-        users = data.get('users', [])
-        
-        if not users:
-            logger.info("Нет пользователей для тестового сообщения")
-            return
-            
-        test_message = "🧪 Тест планировщика!\n\nЕсли вы получили это сообщение, значит периодические задачи работают правильно!"
-        
-        success_count = 0
-        for user_id in users:
-            try:
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=test_message
-                )
-                success_count += 1
-                logger.info(f"Тестовое сообщение отправлено пользователю {user_id}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки тестового сообщения пользователю {user_id}: {e}")
-        
-        logger.info(f"Тестовая задача завершена. Отправлено {success_count} из {len(users)} сообщений")
-        
     except Exception as e:
         logger.error(f"Ошибка в тестовой задаче: {e}", exc_info=True)
 
-# ...existing code...
-
 async def track_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отслеживает пользователей для отправки напоминаний"""
     try:
         user_id = update.effective_user.id
-        data = load_data()
-        
-        if 'users' not in data:
-            data['users'] = []
-            
-        if user_id not in data['users']:
-            data['users'].append(user_id)
-            save_data(data)
+        if get_subscribers().add(user_id):
             logger.info(f"Добавлен новый пользователь: {user_id}")
     except Exception as e:
         logger.error(f"Ошибка при отслеживании пользователя: {e}")
 
 # Новая функция: цикл отправки мотиваций каждые 30 секунд (для отладки)
 async def _motivation_30s_loop(bot) -> None:
-    """Отправляет мотивирующие цитаты всем пользователям каждые 30 секунд (тестовый режим)"""
+    """Отправляет мотивирующие цитаты всем пользователям каждые 30 секунд (только при DEBUG_MOTIVATION_LOOP=1)"""
     while True:
         try:
             logger.info("Запуск цикла тестовой мотивации (каждые 30 секунд)")
@@ -507,94 +358,207 @@ async def _motivation_30s_loop(bot) -> None:
             logger.error(f"Ошибка в цикле мотивации (30с): {e}", exc_info=True)
         await asyncio.sleep(30)
 
+async def _on_startup(application) -> None:
+    """Запускает планировщик, когда event loop приложения уже работает"""
+    if LOOP_WATCHDOG:
+        from loop_watchdog import LoopWatchdog
+        watchdog = LoopWatchdog(threshold=LOOP_WATCHDOG_THRESHOLD)
+        watchdog.start()
+        application.bot_data['loop_watchdog'] = watchdog
+    scheduler = application.bot_data.get('scheduler')
+    if scheduler is not None:
+        await scheduler.start()
+    # Повторные отправки идут в основном процессе, даже если рассылки шардированы;
+    # тогда они берут токены из общего с воркерами ведра
+    sender = get_broadcaster()
+    if not isinstance(sender, Broadcaster):
+        sender = sender.local_broadcaster(outbox=get_outbox())
+    outbox_worker = OutboxWorker(
+        application.bot,
+        get_outbox(),
+        sender,
+        on_blocked=lambda chat_ids: _prune_blocked(chat_ids, "Очередь повторных отправок")
+    )
+    outbox_worker.start()
+    application.bot_data['outbox_worker'] = outbox_worker
+
+async def _on_shutdown(application) -> None:
+    """Останавливает планировщик и сохраняет накопленных пользователей"""
+    scheduler = application.bot_data.get('scheduler')
+    if scheduler is not None:
+        await scheduler.stop()
+    outbox_worker = application.bot_data.get('outbox_worker')
+    if outbox_worker is not None:
+        await outbox_worker.stop()
+    watchdog = application.bot_data.get('loop_watchdog')
+    if watchdog is not None:
+        await watchdog.stop()
+    sharded = application.bot_data.get('sharded_broadcaster')
+    if sharded is not None:
+        await asyncio.to_thread(sharded.stop)
+    get_subscribers().close()
+    await save_quote_rotation()
+    get_quote_states().close()
+    get_outbox().close()
+    if scheduler is not None and scheduler.ledger is not None:
+        scheduler.ledger.close()
+    logger.info("Данные пользователей сохранены")
+
 # Старая функция setup_jobs удалена - используется SimpleScheduler
 
-def main() -> None:
-    """Основная функция запуска бота"""
+def build_application() -> Application:
+    """Создает приложение со всеми обработчиками и планировщиком, но не запускает его"""
+    # telegram.ext (JobQueue, APScheduler) загружаем только здесь; telegram и httpx уже импортированы
+    from telegram.ext import ApplicationBuilder, CommandHandler
+    from update_processor import KeyedUpdateProcessor
+
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN не найден в переменных окружения!")
+
+    # Создание приложения без JobQueue для совместимости с Python 3.13
+    update_processor = KeyedUpdateProcessor(MAX_CONCURRENT_UPDATES)
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(update_processor)
+        .job_queue(None)  # Отключаем JobQueue
+        .post_init(_on_startup)
+        .post_shutdown(_on_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL)
+    application = builder.build()
+    
+    # Загружаем подписчиков в память один раз при старте
+    logger.info(f"Загружено подписчиков: {len(get_subscribers())}")
+    
+    # Рассылки в нескольких процессах: подписчики делятся между воркерами по user_id
+    if BROADCAST_WORKERS > 1:
+        from sharding import ShardedBroadcaster
+        sharded = ShardedBroadcaster(BOT_TOKEN, BROADCAST_WORKERS, base_url=TELEGRAM_API_URL)
+        sharded.start()
+        set_broadcaster(sharded)
+        application.bot_data['sharded_broadcaster'] = sharded
+    else:
+        # Недоставленные из-за временных ошибок сообщения уходят в очередь повторов
+        set_broadcaster(Broadcaster(outbox=get_outbox()))
+    
+    # Команды выполняются через контроль нагрузки; при перегрузке пользователь получает ответ "бот занят"
+    admission = AdmissionController(ADMISSION_CAPACITY, ADMISSION_QUEUE, ADMISSION_MAX_WAIT, costs=COMMAND_COSTS)
+
+    def command(name: str, handler: Callable) -> CommandHandler:
+        return CommandHandler(name, instrument_handler(name, admission.guard(name, handler, busy_reply)))
+
+    # Добавление обработчиков команд
+    application.add_handler(command("start", start))
+    application.add_handler(command("about", about))
+    application.add_handler(command("contacts", contacts))
+    application.add_handler(command("help", help_command))
+    application.add_handler(command("test", test_command))
+    application.add_handler(command("test_reminders", test_reminders_command))
+    # Служебная команда нужна как раз при перегрузке — мимо контроля нагрузки
+    application.add_handler(CommandHandler("loopstats", instrument_handler("loopstats", loop_stats)))
+    
+    # Добавление обработчика для отслеживания пользователей
+    application.add_handler(CommandHandler("start", track_user), group=1)
+    application.add_handler(CommandHandler("about", track_user), group=1)
+    application.add_handler(CommandHandler("contacts", track_user), group=1)
+    application.add_handler(CommandHandler("help", track_user), group=1)
+    application.add_handler(CommandHandler("test", track_user), group=1)
+    application.add_handler(CommandHandler("test_reminders", track_user), group=1)
+    
+    # Настройка простого планировщика задач
     try:
-        # Создание приложения без JobQueue для совместимости с Python 3.13
-        from telegram.ext import ApplicationBuilder
+        from simple_scheduler import SimpleScheduler
+        scheduler = SimpleScheduler(application.bot, MSK_TZ, ledger=get_run_ledger())
+        
+        # Добавляем задачи
+        scheduler.add_daily_task(
+            send_motivational_quote,
+            time(19, 30),
+            name="daily_motivation"
+        )
         
-        application = (
-            ApplicationBuilder()
-            .token(BOT_TOKEN)
-            .concurrent_updates(True)
-            .job_queue(None)  # Отключаем JobQueue
-            .build()
+        scheduler.add_daily_task(
+            remind_meeting_preparation,
+            time(19, 32),
+            days=(1,),  # вторник
+            name="meeting_prep_reminder"
         )
         
-        # Добавление обработчиков команд
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("about", about))
-        application.add_handler(CommandHandler("contacts", contacts))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("test", test_command))
-        application.add_handler(CommandHandler("test_reminders", test_reminders_command))
+        scheduler.add_daily_task(
+            remind_meeting_start,
+            time(18, 50),
+            days=(3,),  # четверг
+            name="meeting_start_reminder"
+        )
         
-        # Добавление обработчика для отслеживания пользователей
-        application.add_handler(CommandHandler("start", track_user), group=1)
-        application.add_handler(CommandHandler("about", track_user), group=1)
-        application.add_handler(CommandHandler("contacts", track_user), group=1)
-        application.add_handler(CommandHandler("help", track_user), group=1)
-        application.add_handler(CommandHandler("test", track_user), group=1)
-        application.add_handler(CommandHandler("test_reminders", track_user), group=1)
+        # Тестовая задача через 1 минуту
+        current_time = datetime.now(MSK_TZ)
+        test_time = current_time + timedelta(minutes=1)
+        scheduler.add_one_time_task(
+            test_scheduled_message,
+            test_time,
+            name="test_scheduled"
+        )
         
-        # Настройка простого планировщика задач
-        try:
-            from simple_scheduler import SimpleScheduler
-            scheduler = SimpleScheduler(application.bot, MSK_TZ)
-            
-            # Добавляем задачи
-            scheduler.add_daily_task(
-                send_motivational_quote,
-                time(19, 30),
-                name="daily_motivation"
-            )
-            
-            scheduler.add_daily_task(
-                remind_meeting_preparation,
-                time(19, 32),
-                days=(1,),  # вторник
-                name="meeting_prep_reminder"
-            )
-            
-            scheduler.add_daily_task(
-                remind_meeting_start,
-                time(18, 50),
-                days=(3,),  # четверг
-                name="meeting_start_reminder"
-            )
-            
-            # Тестовая задача через 1 минуту
-            current_time = datetime.now(MSK_TZ)
-            test_time = current_time + timedelta(minutes=1)
-            scheduler.add_one_time_task(
-                test_scheduled_message,
-                test_time,
-                name="test_scheduled"
-            )
-            
-            # Запускаем планировщик
-            asyncio.create_task(scheduler.start())
-            logger.info("Простой планировщик задач настроен и запущен")
-            
-        except Exception as e:
-            logger.warning(f"Не удалось настроить планировщик задач: {e}")
-            logger.info("Бот будет работать без автоматических напоминаний")
+        # Планировщик запустится в post_init, когда заработает event loop
+        application.bot_data['scheduler'] = scheduler
+        logger.info("Простой планировщик задач настроен")
         
-        # Запускаем тестовый цикл мотиваций каждые 30 секунд (для отладки)
-        try:
-            application.create_task(_motivation_30s_loop(application.bot))
-            logger.info("Запущен цикл мотиваций (30s) для тестирования")
-        except Exception as e:
-            logger.warning(f"Не удалось запустить цикл мотиваций: {e}")
+    except Exception as e:
+        logger.warning(f"Не удалось настроить планировщик задач: {e}")
+        logger.info("Бот будет работать без автоматических напоминаний")
+
+    # Значения, которые дешевле прочитать в момент опроса, чем обновлять при каждом изменении
+    SUBSCRIBERS.set_function(lambda: len(get_subscribers()))
+    OUTBOX_PENDING.set_function(lambda: get_outbox().counts()['pending'])
+    OUTBOX_DEAD.set_function(lambda: get_outbox().counts()['dead'])
+    UPDATES_ACTIVE_CHATS.set_function(lambda: update_processor.active_chats)
+    UPDATES_QUEUED.set_function(lambda: update_processor.queued_updates)
+    ADMISSION_IN_USE.set_function(lambda: admission.in_use)
+    ADMISSION_WAITING.set_function(lambda: admission.waiting)
+
+    return application
+
+def main() -> None:
+    """Основная функция запуска бота"""
+    try:
+        application = build_application()
+
+        if METRICS_PORT:
+            from metrics import start_http_server
+            start_http_server(METRICS_PORT, METRICS_HOST)
+        
+        # Тестовый цикл мотиваций каждые 30 секунд — только для отладки: он расходует
+        # ротацию цитат подписчиков, и ежедневная цитата начала бы повторяться
+        if DEBUG_MOTIVATION_LOOP:
+            try:
+                application.create_task(_motivation_30s_loop(application.bot))
+                logger.warning("Запущен отладочный цикл мотиваций (каждые 30 секунд)")
+            except Exception as e:
+                logger.warning(f"Не удалось запустить цикл мотиваций: {e}")
         
         # Запуск бота
-        logger.info("Запуск бота...")
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        if WEBHOOK_URL:
+            from webhook import run_webhook
+            logger.info("Запуск бота в режиме вебхука...")
+            run_webhook(
+                application,
+                WEBHOOK_URL,
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                drop_pending_updates=True
+            )
+        else:
+            from telegram import Update
+            logger.info("Запуск бота...")
+            application.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
         
     except Exception as e:
         logger.error(f"Критическая ошибка при запуске бота: {e}")
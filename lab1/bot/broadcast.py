@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Движок массовых рассылок для Telegram-бота
+Параллельная отправка с учетом лимитов Telegram (~30 сообщений/с на бота
+и 1 сообщение/с в один чат) и обработкой RetryAfter
+
+Ошибки отправки классифицируются: заблокировавшие бота пользователи
+возвращаются в результате для отписки, временные сбои уходят в очередь
+повторных отправок (storage.OutboxStore), остальные — в dead letters.
+По итогам рассылки пишется одна сводка (logging_setup.SendLog), а не строка
+на каждого получателя.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from logging_setup import SendLog
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит Telegram на исходящие сообщения бота
+GLOBAL_RATE_LIMIT = 30
+
+# Минимальный интервал между сообщениями в один чат (секунды)
+PER_CHAT_INTERVAL = 1.0
+
+# Количество одновременно выполняемых запросов
+DEFAULT_CONCURRENCY = 20
+
+# Сколько раз повторять отправку после RetryAfter
+MAX_RETRIES = 3
+
+# Через сколько секунд первая повторная попытка из очереди
+RETRY_DELAY = 30
+
+# Текст сообщения: общий для всех или свой для каждого chat_id
+TextSource = Union[str, Callable[[int], str]]
+
+# Классы ошибок отправки
+ERROR_BLOCKED = 'blocked'  # бот заблокирован или чат не существует — отписываем
+ERROR_RETRY = 'retry'      # сеть, таймаут, лимит — повторим позже
+ERROR_CONTENT = 'content'  # проблема в самом сообщении — пробуем упрощенный вариант
+
+
+def classify_error(error: Exception) -> str:
+    """Определяет, что делать с ошибкой отправки"""
+    if isinstance(error, Forbidden):
+        return ERROR_BLOCKED
+    # BadRequest в python-telegram-bot — подкласс NetworkError, проверяем раньше
+    if isinstance(error, BadRequest):
+        if 'chat not found' in error.message.lower():
+            return ERROR_BLOCKED
+        return ERROR_CONTENT
+    if isinstance(error, (RetryAfter, NetworkError)):
+        return ERROR_RETRY
+    return ERROR_CONTENT
+
+
+class TokenBucket:
+    """Асинхронное ведро токенов: не более rate запросов в секунду"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Дожидается свободного токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов (flood wait распространяется на всего бота)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        # Ведро наполняется с конца паузы, а не за время ожидания — иначе сразу после нее всплеск
+        self._updated = self._paused_until
+
+
+class ChatRateLimiter:
+    """Выдерживает минимальный интервал между сообщениями в один и тот же чат"""
+
+    def __init__(self, interval: float = PER_CHAT_INTERVAL, max_tracked: int = 10000):
+        self.interval = interval
+        self.max_tracked = max_tracked
+        self._next_allowed: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int) -> None:
+        """Дожидается, когда в чат снова можно писать"""
+        now = time.monotonic()
+        allowed = self._next_allowed.get(chat_id, 0.0)
+        self._next_allowed[chat_id] = max(now, allowed) + self.interval
+
+        if len(self._next_allowed) > self.max_tracked:
+            self._prune(now)
+
+        if allowed > now:
+            await asyncio.sleep(allowed - now)
+
+    def _prune(self, now: float) -> None:
+        self._next_allowed = {
+            chat_id: allowed for chat_id, allowed in self._next_allowed.items() if allowed > now
+        }
+
+
+class BroadcastResult:
+    """Итоги одной рассылки"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.sent = 0
+        self.fallback = 0
+        self.failed = 0
+        self.queued = 0
+        self.blocked_ids: List[int] = []
+        # Сколько заблокировавших бота пользователей исключено из рассылок по итогам
+        self.pruned = 0
+        self.duration = 0.0
+
+    @property
+    def delivered(self) -> int:
+        """Доставлено сообщений (включая упрощенные)"""
+        return self.sent + self.fallback
+
+    def __repr__(self) -> str:
+        return (f"BroadcastResult(total={self.total}, sent={self.sent}, fallback={self.fallback}, "
+                f"queued={self.queued}, blocked={len(self.blocked_ids)}, pruned={self.pruned}, failed={self.failed}, "
+                f"duration={self.duration:.2f}s)")
+
+
+class Broadcaster:
+    """Рассылает сообщение списку чатов с ограниченным параллелизмом"""
+
+    def __init__(
+        self,
+        rate_limit: float = GLOBAL_RATE_LIMIT,
+        per_chat_interval: float = PER_CHAT_INTERVAL,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        bucket=None,
+        outbox=None,
+        log_sample_rate: Optional[float] = None
+    ):
+        # bucket можно подменить общим между процессами (см. sharding.SharedTokenBucket)
+        self.bucket = bucket if bucket is not None else TokenBucket(rate_limit)
+        self.chat_limiter = ChatRateLimiter(per_chat_interval)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        # Очередь повторных отправок (storage.OutboxStore); без нее неудачи только считаются
+        self.outbox = outbox
+        # Доля строк лога по отдельным получателям (None — LOG_SAMPLE_RATE из окружения)
+        self.log_sample_rate = log_sample_rate
+
+    async def broadcast(
+        self,
+        bot,
+        chat_ids: Iterable[int],
+        text: TextSource,
+        fallback_text: Optional[TextSource] = None,
+        label: str = "рассылка"
+    ) -> BroadcastResult:
+        """
+        Отправляет text всем chat_ids
+
+        text и fallback_text — строка или функция chat_id -> строка
+        (для персональных сообщений).
+
+        Если Telegram отверг само сообщение, пробует один раз отправить
+        fallback_text. Заблокировавшие бота чаты попадают в result.blocked_ids,
+        временные сбои ставятся в очередь повторных отправок.
+
+        Returns:
+            BroadcastResult: Количество успешных, упрощенных, отложенных и неудачных отправок
+        """
+        chat_ids = list(chat_ids)
+        result = BroadcastResult(len(chat_ids))
+        if not chat_ids:
+            return result
+
+        started = time.monotonic()
+        pending = iter(chat_ids)
+        log = SendLog(label, logger, self.log_sample_rate)
+        # Неудачи копятся в памяти и пишутся в очередь одной транзакцией в конце
+        batch = self.outbox.batch() if self.outbox is not None else None
+
+        async def worker() -> None:
+            # Итератор общий: каждый воркер забирает следующий чат
+            for chat_id in pending:
+                await self._deliver(bot, chat_id, text, fallback_text, label, result, log, batch)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(chat_ids)))))
+        if batch is not None:
+            await self._save_failures(batch, label, result)
+        result.duration = time.monotonic() - started
+        log.summary(result.duration)
+        return result
+
+    async def _deliver(self, bot, chat_id: int, text: TextSource, fallback_text: Optional[TextSource],
+                       label: str, result: BroadcastResult, log: SendLog, batch=None) -> None:
+        text = _resolve(text, chat_id)
+        try:
+            await self.send(bot, chat_id, text)
+            result.sent += 1
+            log.record('sent', chat_id)
+            return
+        except Exception as e:
+            error = e
+            kind = classify_error(e)
+
+        fallback_text = _resolve(fallback_text, chat_id)
+        if kind == ERROR_CONTENT and fallback_text is not None:
+            try:
+                await self.send(bot, chat_id, fallback_text)
+                result.fallback += 1
+                # Причина, по которой понадобился упрощенный вариант, тоже попадает в сводку
+                log.record('fallback', chat_id, error)
+                return
+            except Exception as e:
+                error = e
+                kind = classify_error(e)
+
+        outcome = self._handle_failure(chat_id, text, fallback_text, label, error, kind, result, batch)
+        log.record(outcome, chat_id, error)
+
+    def _handle_failure(self, chat_id: int, text: str, fallback_text: Optional[str], label: str,
+                        error: Exception, kind: str, result: BroadcastResult, batch=None) -> str:
+        """Раскладывает неудачную отправку по итогам рассылки; возвращает исход для лога"""
+        if kind == ERROR_BLOCKED:
+            result.blocked_ids.append(chat_id)
+            return 'blocked'
+
+        if batch is None:
+            result.failed += 1
+            return 'failed'
+        if kind == ERROR_RETRY:
+            batch.enqueue(chat_id, text, fallback_text, label, str(error), RETRY_DELAY)
+            result.queued += 1
+            return 'queued'
+        batch.dead_letter(chat_id, text, label, 1, str(error))
+        result.failed += 1
+        return 'failed'
+
+    async def _save_failures(self, batch, label: str, result: BroadcastResult) -> None:
+        """Записывает накопленные неудачи в очередь повторов одной транзакцией вне event loop"""
+        if not len(batch):
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.outbox.apply, batch)
+        except Exception as e:
+            logger.error(f"{label}: не удалось сохранить недоставленные сообщения ({len(batch)}): {e}")
+            # В очередь они не попали — считаем неудачными
+            result.failed += len(batch.enqueued)
+            result.queued -= len(batch.enqueued)
+
+    async def send(self, bot, chat_id: int, text: str) -> None:
+        """Отправляет одно сообщение с учетом лимитов, повторяя после RetryAfter"""
+        attempt = 0
+        while True:
+            await self.chat_limiter.wait(chat_id)
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = _retry_after_seconds(e)
+                logger.warning(f"Превышен лимит Telegram, пауза {delay:.0f} с (чат {chat_id})")
+                self.bucket.pause(delay)
+
+
+def _resolve(text: Optional[TextSource], chat_id: int) -> Optional[str]:
+    return text(chat_id) if callable(text) else text
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+_broadcaster: Optional[Broadcaster] = None
+
+
+def get_broadcaster() -> Broadcaster:
+    """Возвращает общий движок рассылок (лимиты общие для всех рассылок бота)"""
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = Broadcaster()
+    return _broadcaster
+
+
+def set_broadcaster(broadcaster) -> None:
+    """Подменяет общий движок рассылок (например, на sharding.ShardedBroadcaster)"""
+    global _broadcaster
+    _broadcaster = broadcaster
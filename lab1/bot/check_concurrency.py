@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скрипт для проверки конкурентной обработки без Telegram и сети
+Контроль нагрузки (admission.py): стоимость, резерв для дешевых команд,
+очередь, отказы и отмена ожидания. Очереди чатов (update_processor.py):
+порядок внутри чата и общий лимит. Планировщик (simple_scheduler.py):
+порядок запусков из кучи, политики пропущенных запусков, журнал запусков
+и остановка с выполняющимися задачами
+
+Завершается с кодом 1, если хотя бы одна проверка не прошла
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytz
+from telegram import Update
+
+from admission import QUEUE_FULL, TIMEOUT, AdmissionController
+from simple_scheduler import MISFIRE_CATCH_UP, MISFIRE_RUN_ONCE, MISFIRE_SKIP, SimpleScheduler
+from storage import RunLedger
+from update_processor import KeyedUpdateProcessor
+
+# Настройка логирования; сбой обработки обновления ниже вызывается намеренно
+logging.basicConfig(level=logging.WARNING)
+logging.getLogger('update_processor').setLevel(logging.CRITICAL)
+
+MSK_TZ = pytz.timezone('Europe/Moscow')
+
+failures = []
+
+def check(condition: bool, description: str) -> None:
+    """Печатает результат проверки и запоминает неудачные"""
+    print(f"{'✅' if condition else '❌'} {description}")
+    if not condition:
+        failures.append(description)
+
+async def check_admission():
+    """Проверяет стоимость, резерв, очередь и отказы контроля нагрузки"""
+    print("🚦 Проверка контроля нагрузки...")
+
+    # Дорогим командам доступно 3 единицы из 4, в очереди — не больше 2 дорогих
+    admission = AdmissionController(capacity=4, max_waiting=4, max_wait=0.3, costs={'heavy': 2}, light_reserve=1)
+    check(admission.cost('heavy') == 2 and admission.cost('help') == 1, "Стоимость команд из таблицы и по умолчанию")
+
+    check(await admission.acquire('heavy') is None, "Первая дорогая команда выполняется сразу")
+    second = asyncio.create_task(admission.acquire('heavy'))
+    third = asyncio.create_task(admission.acquire('heavy'))
+    await asyncio.sleep(0)
+    check(admission.waiting == 2, f"Дорогие команды сверх резерва ждут: {admission.waiting}")
+    check(await admission.acquire('heavy') == QUEUE_FULL, "Дорогих в очереди не больше половины: queue_full")
+
+    check(await admission.acquire('help') is None, "Дешевая команда не стоит в очереди за дорогими")
+    check(admission.in_use == 3, f"Занято 3 из 4: {admission.in_use}")
+
+    admission.release('heavy')
+    check(await second is None, "Освободившееся место получает первая дорогая команда")
+    check(await third == TIMEOUT, "Не дождавшаяся места команда получает timeout")
+    check(admission.waiting == 0, "Отказавшие команды убраны из очереди")
+
+    admission.release('heavy')
+    admission.release('help')
+    check(admission.in_use == 0, f"После release емкость свободна: {admission.in_use}")
+
+    # Отмена ожидания не оставляет занятого места и записи в очереди
+    admission = AdmissionController(capacity=1, max_waiting=4, max_wait=5)
+    await admission.acquire('help')
+    waiter = asyncio.create_task(admission.acquire('help'))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    check(admission.waiting == 0 and admission.in_use == 1, "Отмененное ожидание убрано из очереди")
+
+    # Команды одной стоимости получают место в порядке прихода
+    order = []
+
+    async def command(name: str):
+        if await admission.acquire('help') is None:
+            order.append(name)
+
+    waiters = [asyncio.create_task(command(name)) for name in ('a', 'b', 'c')]
+    await asyncio.sleep(0)
+    for _ in waiters:
+        admission.release('help')
+        await asyncio.sleep(0)
+    await asyncio.gather(*waiters)
+    check(order == ['a', 'b', 'c'], f"Очередь обслуживается по порядку: {order}")
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': '/help'}
+    }, None)
+
+async def check_update_processor():
+    """Проверяет порядок обновлений внутри чата и общий лимит"""
+    print("\n📨 Проверка очередей чатов...")
+
+    processor = KeyedUpdateProcessor(max_concurrent_updates=2)
+    handled = {}
+    active = 0
+    peak = 0
+
+    async def handle(chat_id: int, number: int):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        handled.setdefault(chat_id, []).append(number)
+        if number == 1:
+            raise RuntimeError("сбой обработки")
+
+    # Как Application: каждое обновление — отдельная задача в порядке прихода
+    tasks = []
+    update_id = 0
+    for number in range(4):
+        for chat_id in (1, 2, 3):
+            update_id += 1
+            tasks.append(asyncio.create_task(
+                processor.process_update(make_update(update_id, chat_id), handle(chat_id, number))
+            ))
+    await asyncio.gather(*tasks)
+
+    check(all(handled.get(chat_id) == [0, 1, 2, 3] for chat_id in (1, 2, 3)),
+          f"Обновления каждого чата выполнены по порядку, сбой не теряет следующие: {handled}")
+    check(peak == 2, f"Одновременно обрабатывается не больше 2 чатов: {peak}")
+    check(processor.active_chats == 0 and processor.queued_updates == 0, "Очереди чатов после обработки пусты")
+
+async def check_scheduler():
+    """Проверяет кучу задач, политики пропущенных запусков и журнал"""
+    print("\n⏰ Проверка планировщика...")
+
+    ran = []
+
+    def job(name: str, delay: float = 0):
+        async def run(bot):
+            ran.append(name)
+            await asyncio.sleep(delay)
+        return run
+
+    # Разовые задачи запускаются по времени, а не по порядку добавления
+    scheduler = SimpleScheduler(None, MSK_TZ)
+    now = datetime.now(MSK_TZ)
+    for name, offset in (('c', 0.3), ('a', 0.1), ('b', 0.2)):
+        scheduler.add_one_time_task(job(name), now + timedelta(seconds=offset), name=name)
+    await scheduler.start()
+    await asyncio.sleep(0.6)
+    await scheduler.stop()
+    check(ran == ['a', 'b', 'c'], f"Задачи выполнены по времени запуска: {ran}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = RunLedger(os.path.join(tmp, 'runs.db'))
+        # Последний слот — три дня назад: пропущено три ежедневных запуска
+        today_slot = (datetime.now(MSK_TZ) - timedelta(hours=1)).replace(second=0, microsecond=0)
+        missed_slots = [today_slot - timedelta(days=days) for days in (2, 1, 0)]
+
+        async def run_with_policy(policy: str):
+            ran.clear()
+            ledger.record_run(policy, today_slot - timedelta(days=3))
+            scheduler = SimpleScheduler(None, MSK_TZ, ledger=ledger)
+            scheduler.add_daily_task(job(policy), today_slot.time(), name=policy, misfire_policy=policy)
+            await scheduler.start()
+            await asyncio.sleep(0.1)
+            await scheduler.stop()
+            return list(ran)
+
+        check(await run_with_policy(MISFIRE_SKIP) == [], "skip: пропущенные запуски не выполняются")
+        check(ledger.last_run(MISFIRE_SKIP) == today_slot, "skip: последний пропущенный слот записан в журнал")
+        check(len(await run_with_policy(MISFIRE_RUN_ONCE)) == 1, "run_once: пропущенное выполняется один раз")
+        check(len(await run_with_policy(MISFIRE_CATCH_UP)) == len(missed_slots),
+              f"catch_up: выполнен каждый из {len(missed_slots)} пропущенных слотов")
+        check(ledger.last_run(MISFIRE_CATCH_UP) == missed_slots[-1], "catch_up: в журнале последний слот")
+
+        # Перезапуск с тем же журналом не повторяет выполненные слоты
+        ran.clear()
+        scheduler = SimpleScheduler(None, MSK_TZ, ledger=ledger)
+        scheduler.add_daily_task(job(MISFIRE_CATCH_UP), today_slot.time(), name=MISFIRE_CATCH_UP,
+                                 misfire_policy=MISFIRE_CATCH_UP)
+        await scheduler.start()
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+        check(ran == [], "После перезапуска выполненные слоты не повторяются")
+
+        task = scheduler.tasks[0]
+        check(not await scheduler._claim(task, missed_slots[0]), "Уже выполненный слот повторно не занимается")
+        check(await scheduler._claim(task, today_slot + timedelta(days=1)), "Следующий слот занимается")
+        ledger.close()
+
+    # stop() дожидается коротких задач и отменяет слишком долгие
+    for delay, timeout, expected in ((0.1, 1, 'дождался'), (10, 0.1, 'отменил')):
+        ran.clear()
+        scheduler = SimpleScheduler(None, MSK_TZ)
+        scheduler.add_one_time_task(job('long', delay), datetime.now(MSK_TZ) + timedelta(seconds=0.05), name='long')
+        await scheduler.start()
+        await asyncio.sleep(0.1)
+        await scheduler.stop(timeout=timeout)
+        check(ran == ['long'] and not scheduler._running_jobs, f"stop() {expected} задачу длительностью {delay} с")
+
+async def main():
+    await check_admission()
+    await check_update_processor()
+    await check_scheduler()
+
+    if failures:
+        print(f"\n❌ Не прошло проверок: {len(failures)}")
+        sys.exit(1)
+    print("\n🎉 Все проверки пройдены!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
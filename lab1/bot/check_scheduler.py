@@ -8,7 +8,7 @@ import asyncio
 import logging
 from datetime import datetime, time, timedelta
 import pytz
-from bot import load_data, save_data
+from storage import load_data, save_data
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
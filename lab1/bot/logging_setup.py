@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Неблокирующее логирование для Telegram-бота
+Обработчики логгеров только кладут запись в очередь (QueueHandler), а
+форматирование и запись в stderr выполняет отдельный поток (QueueListener),
+поэтому event loop не ждет вывода даже при тысячах записей за рассылку.
+
+Циклы отправки пишут не строку на каждого получателя, а сводку SendLog:
+счетчики по исходам и видам ошибок одной записью в конце. Первая ошибка
+каждого вида логируется сразу; остальные строки по получателям — только
+выборочно, с долей LOG_SAMPLE_RATE (по умолчанию 0)
+
+Переменные окружения:
+    LOG_LEVEL        уровень логирования (INFO)
+    LOG_FORMAT       text или json — запись одной строкой JSON со всеми полями из extra
+    LOG_SAMPLE_RATE  доля строк по отдельным получателям, 0..1
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0'))
+
+# Стандартные атрибуты LogRecord: все остальные пришли через extra
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; поля из extra попадают в нее как есть"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в вызывающем потоке
+
+    Стандартный prepare() собирает текст сообщения и traceback еще в event loop;
+    здесь запись уходит в очередь как есть, а форматирует ее поток QueueListener.
+    Очередь не покидает процесс, поэтому args и exc_info не нужно сериализовать.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, text_format: str = TEXT_FORMAT) -> None:
+    """
+    Настраивает корневой логгер: QueueHandler в очередь, вывод в stderr из фонового потока
+
+    Повторный вызов ничего не делает. Очередь дописывается при выходе из процесса
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(text_format))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Дописывает накопленные записи и останавливает поток вывода"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class SendLog:
+    """
+    Сводка одного цикла отправок (рассылки, повторов из очереди)
+
+    record() только увеличивает счетчики; строка по отдельному получателю
+    пишется для первой ошибки каждого вида и выборочно с долей sample_rate.
+    summary() пишет одну запись с итогами; в extra — event, label,
+    outcomes, errors и duration для разбора в JSON-логах
+    """
+
+    def __init__(self, label: str, logger: logging.Logger, sample_rate: Optional[float] = None):
+        self.label = label
+        self.logger = logger
+        self.sample_rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.outcomes: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def record(self, outcome: str, chat_id: int, error: Optional[BaseException] = None) -> None:
+        """Учитывает исход отправки одному получателю"""
+        self.outcomes[outcome] += 1
+        if error is None:
+            if self.sample_rate and random.random() < self.sample_rate:
+                self.logger.info("%s: %s, пользователь %s", self.label, outcome, chat_id,
+                                 extra={'event': 'send', 'label': self.label, 'outcome': outcome, 'chat_id': chat_id})
+            return
+
+        kind = type(error).__name__
+        self.errors[kind] += 1
+        first = self.errors[kind] == 1
+        if first or (self.sample_rate and random.random() < self.sample_rate):
+            self.logger.warning("%s: %s, пользователь %s: %s [%s%s]", self.label, outcome, chat_id, error, kind,
+                                ", первая ошибка такого вида" if first else "",
+                                extra={'event': 'send', 'label': self.label, 'outcome': outcome,
+                                       'chat_id': chat_id, 'error': kind})
+
+    @property
+    def total(self) -> int:
+        return sum(self.outcomes.values())
+
+    def summary(self, duration: Optional[float] = None, level: int = logging.INFO) -> None:
+        """Одна запись с итогами цикла; ничего не пишет, если отправок не было"""
+        if not self.outcomes:
+            return
+        outcomes = ', '.join(f"{name}={count}" for name, count in self.outcomes.most_common())
+        message = f"{self.label}: итог {self.total} отправок: {outcomes}"
+        if duration is not None:
+            message += f" за {duration:.2f} с"
+        if self.errors:
+            message += "; ошибки: " + ', '.join(f"{name}={count}" for name, count in self.errors.most_common())
+        self.logger.log(level, message, extra={
+            'event': 'send_summary',
+            'label': self.label,
+            'outcomes': dict(self.outcomes),
+            'errors': dict(self.errors),
+            'duration': round(duration, 3) if duration is not None else None,
+        })
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сторож event loop: замер задержек и поиск блокирующих вызовов
+Корутина-пульс просыпается каждые interval секунд и меряет, насколько
+позже срока ее разбудили — это и есть задержка event loop. Отдельный поток
+следит за пульсом: если тот не приходил дольше threshold, значит loop чем-то
+занят синхронно, и поток снимает стек потока event loop. Из стека берется
+самый глубокий кадр кода бота (обработчик, задача) — он и попадает в лог,
+в статистику команды /loopstats и в метрики
+
+Включается переменной окружения LOOP_WATCHDOG=1 (для стенда и отладки)
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+from metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+# Как часто просыпается пульс (секунды)
+DEFAULT_INTERVAL = 0.1
+
+# С какой задержки считать, что loop заблокирован (секунды)
+DEFAULT_THRESHOLD = 0.25
+
+# Сколько последних блокировок хранить для /loopstats
+STALL_HISTORY = 20
+
+# Сколько последних замеров задержки учитывать в процентилях
+LAG_WINDOW = 3000
+
+_THIS_FILE = os.path.abspath(__file__)
+_BOT_DIR = os.path.dirname(_THIS_FILE)
+
+
+class Stall(NamedTuple):
+    """Одна блокировка event loop"""
+    started_at: datetime
+    duration: float
+    location: str
+    task: str
+    stack: str
+
+
+class LoopWatchdog:
+    """
+    Сторож event loop
+
+    Args:
+        threshold: Задержка, начиная с которой снимается стек (секунды)
+        interval: Период пульса (секунды)
+        code_dir: Каталог кода бота — по нему в стеке ищется виновный кадр
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, interval: float = DEFAULT_INTERVAL,
+                 code_dir: str = _BOT_DIR):
+        self.threshold = threshold
+        self.interval = interval
+        self.code_dir = code_dir
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self._lags: Deque[float] = deque(maxlen=LAG_WINDOW)
+        self._stalls: Deque[Stall] = deque(maxlen=STALL_HISTORY)
+        self._lock = threading.Lock()
+        self._beat = time.monotonic()
+        # Стек, снятый потоком во время текущей блокировки: (время, место, задача, стек)
+        self._captured: Optional[tuple] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Запускает пульс в текущем event loop и поток наблюдения"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Сторож event loop запущен: порог {self.threshold * 1000:.0f} мс, "
+                    f"пульс каждые {self.interval * 1000:.0f} мс")
+
+    async def stop(self) -> None:
+        """Останавливает пульс и поток"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._beat = time.monotonic()
+            self._record_lag(lag)
+
+    def _record_lag(self, lag: float) -> None:
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        with self._lock:
+            self.samples += 1
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            captured, self._captured = self._captured, None
+            if lag < self.threshold:
+                return
+            self.stall_count += 1
+            if captured is None:
+                # Блокировка оказалась короче периода опроса потока: стека нет
+                captured = (datetime.now() - timedelta(seconds=lag), "не определено", "не определено", "")
+            started_at, location, task, stack = captured
+            self._stalls.append(Stall(started_at, lag, location, task, stack))
+        EVENT_LOOP_STALLS.inc()
+        logger.warning(f"Event loop был заблокирован {lag * 1000:.0f} мс: {location} (задача {task})")
+
+    def _watch(self) -> None:
+        """Поток наблюдения: снимает стек, если пульс задерживается дольше порога"""
+        while not self._stopped.wait(self.interval / 2):
+            blocked_for = time.monotonic() - self._beat - self.interval
+            if blocked_for < self.threshold:
+                continue
+            with self._lock:
+                if self._captured is not None:
+                    continue
+                self._captured = self._capture(blocked_for)
+                location, task, stack = self._captured[1:]
+            logger.warning(f"Event loop заблокирован уже {blocked_for * 1000:.0f} мс: {location} "
+                           f"(задача {task})\n{stack}")
+
+    def _capture(self, blocked_for: float) -> tuple:
+        started_at = datetime.now() - timedelta(seconds=blocked_for)
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return started_at, "не определено", "не определено", ""
+        summary = traceback.extract_stack(frame)
+        del frame
+        location = self._locate(summary)
+        task = "не определено"
+        try:
+            current = asyncio.current_task(self._loop)
+        except RuntimeError:
+            current = None
+        if current is not None:
+            task = current.get_name()
+            coro = current.get_coro()
+            if coro is not None:
+                task += f" / {getattr(coro, '__qualname__', coro)}"
+        return started_at, location, task, ''.join(summary.format())
+
+    def _locate(self, summary: traceback.StackSummary) -> str:
+        """Самый глубокий кадр кода бота, иначе — самый глубокий кадр вообще"""
+        for entry in reversed(summary):
+            # venv бота может лежать в том же каталоге — библиотеки не считаем кодом бота
+            if (entry.filename.startswith(self.code_dir) and entry.filename != _THIS_FILE
+                    and 'site-packages' not in entry.filename):
+                return f"{os.path.basename(entry.filename)}:{entry.lineno} в {entry.name}"
+        if summary:
+            entry = summary[-1]
+            return f"{entry.filename}:{entry.lineno} в {entry.name}"
+        return "не определено"
+
+    def stats(self) -> Dict[str, Any]:
+        """Сводка для /loopstats"""
+        with self._lock:
+            lags = list(self._lags)
+            stalls: List[Stall] = list(self._stalls)
+            samples, max_lag, stall_count = self.samples, self.max_lag, self.stall_count
+        return {
+            'samples': samples,
+            'p50': statistics.median(lags) if lags else 0.0,
+            'p99': statistics.quantiles(lags, n=100, method='inclusive')[98] if len(lags) > 1 else (lags[0] if lags else 0.0),
+            'max': max_lag,
+            'stall_count': stall_count,
+            'stalls': stalls,
+        }
+
+    def format_stats(self, last: int = 5) -> str:
+        """Текст ответа /loopstats"""
+        stats = self.stats()
+        lines = [
+            "⏱ Event loop",
+            f"Замеров: {stats['samples']}, порог блокировки: {self.threshold * 1000:.0f} мс",
+            f"Задержка: p50 {stats['p50'] * 1000:.1f} мс, p99 {stats['p99'] * 1000:.1f} мс, "
+            f"максимум {stats['max'] * 1000:.0f} мс",
+            f"Блокировок: {stats['stall_count']}",
+        ]
+        for stall in stats['stalls'][-last:][::-1]:
+            lines.append(f"• {stall.started_at.strftime('%d.%m %H:%M:%S')} — {stall.duration * 1000:.0f} мс, "
+                         f"{stall.location}")
+        return "\n".join(lines)
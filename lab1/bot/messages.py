@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Шаблоны сообщений для рассылок и готовые ответы на команды
+Каждое сообщение рендерится один раз за рассылку в два варианта: основной
+(с эмодзи) и упрощенный без эмодзи, который отправляется, если Telegram
+отверг основной. Упрощенный вариант выводится из основного, поэтому тексты
+не расходятся
+
+Статические ответы (/start, /about, /contacts, /help) разбираются при
+импорте в текст и entities: Telegram не парсит разметку, и ответ не может
+упасть на ошибке Markdown
+"""
+
+import re
+from typing import NamedTuple, Optional, Tuple
+
+from telegram import MessageEntity
+from telegram.constants import MessageLimit
+
+# Эмодзи и служебные символы, из которых они собираются
+# (вариационные селекторы, соединитель ZWJ, keycap, флаги)
+_EMOJI_RE = re.compile(
+    "["
+    "\U0001F000-\U0001FAFF"  # пиктограммы, смайлы, транспорт, флаги, дополнения
+    "\u2300-\u23FF"          # ⌚ ⏰ ⏳ и т.п.
+    "\u2600-\u27BF"          # ☀ ⚡ ✅ ✨ ❗ и т.п.
+    "\u2B00-\u2BFF"          # ⭐ ⬆ и т.п.
+    "\uFE00-\uFE0F"          # вариационные селекторы
+    "\u200D"                 # соединитель ZWJ
+    "\u20E3"                 # keycap
+    "]+ ?"
+)
+
+# Пробелы, оставшиеся в конце строк после удаления эмодзи
+_TRAILING_SPACE_RE = re.compile(r"[ \t]+$", re.MULTILINE)
+
+
+def strip_emoji(text: str) -> str:
+    """Удаляет эмодзи (вместе с пробелом после них) и висящие пробелы в конце строк"""
+    return _TRAILING_SPACE_RE.sub("", _EMOJI_RE.sub("", text)).strip()
+
+
+class RenderedMessage(NamedTuple):
+    """Готовое к рассылке сообщение"""
+    text: str
+    fallback_text: str
+
+
+class MessageTemplate:
+    """
+    Шаблон сообщения в формате str.format
+
+    Шаблон без полей рендерится один раз и переиспользуется во всех рассылках.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self._static: Optional[RenderedMessage] = None
+
+    def render(self, **fields) -> RenderedMessage:
+        """Подставляет поля и возвращает основной и упрощенный варианты"""
+        if not fields:
+            if self._static is None:
+                self._static = self._render(self.template)
+            return self._static
+        return self._render(self.template.format(**fields))
+
+    @staticmethod
+    def _render(text: str) -> RenderedMessage:
+        return RenderedMessage(text, strip_emoji(text))
+
+
+MOTIVATIONAL_QUOTE = MessageTemplate("💫 Мотивация дня:\n\n{quote}")
+
+MEETING_PREPARATION = MessageTemplate("""📅 Напоминание о встрече!
+
+Завтра (среда) в 18:50 начинается встреча по проекту!
+
+⏰ Время подготовки: сегодня в 19:32
+🎯 Не забудьте подготовить отчеты и вопросы!
+
+Удачи! 🚀""")
+
+MEETING_START = MessageTemplate("""🚀 Встреча начинается!
+
+Сейчас (18:50) начинается встреча по проекту!
+
+📋 Готовьтесь к обсуждению:
+• Текущие задачи
+• Проблемы и решения
+• Планы на следующую неделю
+
+Удачной встречи! 💪""")
+
+SCHEDULER_TEST = MessageTemplate(
+    "🧪 Тест планировщика!\n\nЕсли вы получили это сообщение, значит периодические задачи работают правильно!"
+)
+
+
+class StaticReply(NamedTuple):
+    """Готовый ответ: текст и entities со смещениями в UTF-16"""
+    text: str
+    entities: Tuple[MessageEntity, ...]
+
+
+# Поддерживаемая разметка: *жирный* и `код`
+_MARKUP_RE = re.compile(r"\*([^*\n]+)\*|`([^`\n]+)`")
+
+
+def _utf16_len(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+def prerender(markup: str) -> StaticReply:
+    """
+    Разбирает разметку в текст и entities
+
+    Raises:
+        ValueError: Незакрытая разметка или текст длиннее лимита Telegram
+    """
+    parts = []
+    entities = []
+    offset = 0
+    position = 0
+    for match in _MARKUP_RE.finditer(markup):
+        before = markup[position:match.start()]
+        parts.append(before)
+        offset += _utf16_len(before)
+
+        bold, code = match.groups()
+        inner = bold if bold is not None else code
+        entity_type = MessageEntity.BOLD if bold is not None else MessageEntity.CODE
+        length = _utf16_len(inner)
+        entities.append(MessageEntity(entity_type, offset, length))
+        parts.append(inner)
+        offset += length
+        position = match.end()
+    parts.append(markup[position:])
+
+    text = ''.join(parts)
+    stray = re.search(r"[*`]", _MARKUP_RE.sub("", markup))
+    if stray:
+        raise ValueError(f"Незакрытая разметка '{stray.group()}' в ответе: {markup[:40]!r}")
+    if _utf16_len(text) > MessageLimit.MAX_TEXT_LENGTH:
+        raise ValueError(f"Ответ длиннее {MessageLimit.MAX_TEXT_LENGTH} символов: {markup[:40]!r}")
+    return StaticReply(text, tuple(entities))
+
+
+START_REPLY = prerender("""🤖 Добро пожаловать в бот-помощник команды Commitly!
+
+Доступные команды:
+/about - информация о компании
+/contacts - контакты команды
+/help - справка по командам
+
+Бот будет напоминать о важных событиях и мотивировать вас каждый день! 🚀""")
+
+ABOUT_REPLY = prerender("""*Commitly* — это B2B-платформа для обучения программистов через геймификацию.
+
+• Программисты как обычно пишут код и проходят тесты: юнит, функциональное тестирование, нагрузочное, тесты по безопасности и тд
+
+• Платформа автоматически генерирует для них персонализированные обучающие игры.
+
+• Обучение фокусируется на изучении новых технологий через практику, адаптированные под уровень и цели пользователя с помощью AI.
+
+• Система включает постоянный конкурентный режим с рейтингами, наградами и лидерами, что мотивирует сотрудников учиться активнее.""")
+
+CONTACTS_REPLY = prerender("""📞 Контакты команды:
+
+👨‍💻 Алексей: @alxxcold
+👨‍💻 Даниил: @D_Korr
+
+Свяжитесь с нами для любых вопросов! 💬""")
+
+HELP_REPLY = prerender("""🆘 Справка по командам:
+
+/start - запуск бота
+/about - информация о компании Commitly
+/contacts - контакты команды
+/help - эта справка
+/test - тест отправки сообщений
+/test_reminders - ручной тест напоминаний
+
+🤖 Автоматические функции:
+• Напоминания о встречах (вторник, четверг)
+• Ежедневные мотивирующие цитаты""")
+
+BUSY_REPLY = prerender("""⏳ Сейчас бот перегружен запросами.
+Пожалуйста, повторите команду через минуту.""")
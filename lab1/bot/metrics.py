@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Метрики бота в формате Prometheus
+Счетчики, значения и гистограммы хранятся в памяти процесса и отдаются
+по HTTP на /metrics в текстовом формате Prometheus (0.0.4) — без внешних
+зависимостей. Сервер метрик поднимается в отдельном потоке на METRICS_PORT
+и по умолчанию слушает только 127.0.0.1
+
+Метрики:
+    bot_command_duration_seconds{command}               время обработки команды
+    bot_broadcast_duration_seconds{broadcast}           длительность рассылки
+    bot_broadcast_messages_total{broadcast,outcome}     исходы отправок: sent, fallback, queued, failed, blocked
+    bot_broadcast_throughput_messages_per_second{broadcast}  скорость последней рассылки
+    bot_scheduler_lag_seconds{task}                     опоздание запуска задачи планировщика
+    bot_storage_operation_duration_seconds{operation}   время операций с SQLite
+    bot_event_loop_lag_seconds, bot_event_loop_stalls_total   задержка и блокировки event loop (loop_watchdog.py)
+    bot_updates_active_chats, bot_updates_queued             чаты в обработке и ждущие своей очереди обновления
+    bot_admission_wait_seconds{command}, bot_admission_rejected_total{command,reason}   ожидание места и отказы (admission.py)
+    bot_admission_in_use, bot_admission_waiting              занятая емкость и очередь команд
+    bot_subscribers, bot_outbox_pending, bot_outbox_dead_letters
+"""
+
+import functools
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_PATH = '/metrics'
+
+# Границы гистограмм по умолчанию (секунды): от миллисекунд до десятков секунд
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Для длинных операций (рассылки, опоздание задач): от секунды до часа
+LONG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Registry:
+    """Набор метрик, которые отдаются одним ответом /metrics"""
+
+    def __init__(self):
+        self._metrics: List['_Metric'] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: '_Metric') -> None:
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Текст в формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, names, values, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], LabelValues, float]]:
+        """Сэмплы метрики: (суффикс имени, имена меток, значения меток, значение)"""
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Счетчик не может уменьшаться")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '_total', self.labelnames, key, value
+
+
+class Gauge(_Metric):
+    """Текущее значение; для метрики без меток можно задать функцию, вызываемую при сборе"""
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        if self.labelnames:
+            raise ValueError("Функция задается только для метрики без меток")
+        self._function = function
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                yield '', (), (), float(self._function())
+            except Exception as e:
+                logger.warning(f"Не удалось получить значение {self.name}: {e}")
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', self.labelnames, key, value
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (накопительно, как в Prometheus)"""
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # На набор меток: [счетчики по корзинам..., сумма]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 1)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-1] += value
+
+    def timed(self, **labels) -> Callable:
+        """Декоратор для синхронных функций"""
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return int(sum(state[:-1])) if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        names = self.labelnames + ('le',)
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield '_bucket', names, key + (_format_value(bound),), cumulative
+            yield '_sum', self.labelnames, key, state[-1]
+            yield '_count', self.labelnames, key, cumulative
+
+
+# --- Метрики бота ---
+
+COMMAND_SECONDS = Histogram(
+    'bot_command_duration_seconds', "Время обработки команды", ('command',)
+)
+BROADCAST_SECONDS = Histogram(
+    'bot_broadcast_duration_seconds', "Длительность рассылки", ('broadcast',), buckets=LONG_BUCKETS
+)
+BROADCAST_MESSAGES = Counter(
+    'bot_broadcast_messages', "Исходы отправок в рассылках", ('broadcast', 'outcome')
+)
+BROADCAST_THROUGHPUT = Gauge(
+    'bot_broadcast_throughput_messages_per_second', "Скорость последней рассылки", ('broadcast',)
+)
+SCHEDULER_LAG_SECONDS = Histogram(
+    'bot_scheduler_lag_seconds', "Опоздание запуска задачи относительно расписания", ('task',),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 3600.0)
+)
+STORAGE_SECONDS = Histogram(
+    'bot_storage_operation_duration_seconds', "Время операций с базой SQLite", ('operation',)
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    'bot_event_loop_lag_seconds', "Задержка пробуждения пульса event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+EVENT_LOOP_STALLS = Counter('bot_event_loop_stalls', "Блокировок event loop дольше порога сторожа")
+UPDATES_ACTIVE_CHATS = Gauge('bot_updates_active_chats', "Чатов, обновления которых обрабатываются сейчас")
+UPDATES_QUEUED = Gauge('bot_updates_queued', "Обновлений, ждущих окончания предыдущих в своем чате")
+ADMISSION_WAIT_SECONDS = Histogram(
+    'bot_admission_wait_seconds', "Ожидание места под команду", ('command',)
+)
+ADMISSION_REJECTED = Counter(
+    'bot_admission_rejected', "Команд, отклоненных из-за перегрузки", ('command', 'reason')
+)
+ADMISSION_IN_USE = Gauge('bot_admission_in_use', "Занятая стоимость выполняющихся команд")
+ADMISSION_WAITING = Gauge('bot_admission_waiting', "Команд, ждущих места")
+SUBSCRIBERS = Gauge('bot_subscribers', "Активных подписчиков")
+OUTBOX_PENDING = Gauge('bot_outbox_pending', "Сообщений в очереди повторных отправок")
+OUTBOX_DEAD = Gauge('bot_outbox_dead_letters', "Окончательно недоставленных сообщений")
+
+
+def instrument_handler(command: str, handler: Callable) -> Callable:
+    """Оборачивает асинхронный обработчик команды замером времени"""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            COMMAND_SECONDS.observe(time.perf_counter() - started, command=command)
+    return wrapper
+
+
+def record_broadcast(label: str, result) -> None:
+    """Учитывает итоги рассылки (broadcast.BroadcastResult)"""
+    for outcome, count in (('sent', result.sent), ('fallback', result.fallback), ('queued', result.queued),
+                           ('failed', result.failed), ('blocked', len(result.blocked_ids))):
+        if count:
+            BROADCAST_MESSAGES.inc(count, broadcast=label, outcome=outcome)
+    BROADCAST_SECONDS.observe(result.duration, broadcast=label)
+    if result.duration > 0:
+        BROADCAST_THROUGHPUT.set(result.total / result.duration, broadcast=label)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split('?', 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # Опросы Prometheus не пишем в лог
+        pass
+
+
+def start_http_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Запускает сервер /metrics в фоновом потоке (не занимает event loop бота)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны на http://{host}:{server.server_address[1]}{METRICS_PATH}")
+    return server
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Повторная отправка сообщений из очереди (storage.OutboxStore)
+Фоновая задача периодически забирает сообщения, время которых наступило,
+и повторяет отправку с экспоненциальной задержкой; исчерпавшие попытки
+сообщения переносятся в dead letters (там же сохраняется последняя ошибка).
+За проход пишется одна сводка по исходам (logging_setup.SendLog)
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from broadcast import ERROR_BLOCKED, ERROR_CONTENT, ERROR_RETRY, classify_error
+from logging_setup import SendLog
+
+logger = logging.getLogger(__name__)
+
+# Задержка перед второй повторной попыткой; дальше удваивается
+RETRY_BASE_DELAY = 30
+
+# Максимальная задержка между попытками (секунды)
+RETRY_MAX_DELAY = 3600
+
+# После стольких попыток сообщение считается недоставленным
+MAX_ATTEMPTS = 8
+
+# Как часто проверять очередь (секунды)
+POLL_INTERVAL = 15
+
+# Сколько сообщений забирать за один проход
+BATCH_LIMIT = 100
+
+
+def retry_delay(attempts: int) -> float:
+    """Задержка перед следующей попыткой после attempts неудачных"""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+
+
+class OutboxWorker:
+    """
+    Фоновая повторная отправка
+
+    Args:
+        bot: Экземпляр telegram.Bot
+        store: storage.OutboxStore
+        sender: broadcast.Broadcaster (лимиты общие с рассылками)
+        on_blocked: Корутина, которую ждут со списком чатов, заблокировавших бота за проход
+    """
+
+    def __init__(self, bot, store, sender, on_blocked: Optional[Callable[[List[int]], Awaitable[None]]] = None,
+                 poll_interval: float = POLL_INTERVAL, max_attempts: int = MAX_ATTEMPTS):
+        self.bot = bot
+        self.store = store
+        self.sender = sender
+        self.on_blocked = on_blocked
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Запускает фоновую задачу"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Очередь повторных отправок запущена")
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Очередь повторных отправок остановлена")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.process_due()
+            except Exception as e:
+                logger.error(f"Ошибка обработки очереди повторных отправок: {e}", exc_info=True)
+            await asyncio.sleep(self.poll_interval)
+
+    async def process_due(self) -> int:
+        """Повторяет отправку всех сообщений, время которых наступило; возвращает число доставленных"""
+        loop = asyncio.get_running_loop()
+        messages = await loop.run_in_executor(None, self.store.due, BATCH_LIMIT)
+        delivered = 0
+        blocked: List[int] = []
+        log = SendLog("Очередь повторных отправок", logger)
+        # Итоги попыток пишутся в базу одной транзакцией после прохода, вне event loop
+        batch = self.store.batch()
+        for message in messages:
+            if await self._retry(message, blocked, log, batch):
+                delivered += 1
+        await loop.run_in_executor(None, self.store.apply, batch)
+        if blocked and self.on_blocked is not None:
+            await self.on_blocked(blocked)
+        log.summary()
+        return delivered
+
+    async def _retry(self, message, blocked: List[int], log: SendLog, batch) -> bool:
+        text = message.text
+        try:
+            await self.sender.send(self.bot, message.chat_id, text)
+        except Exception as e:
+            kind = classify_error(e)
+            if kind == ERROR_CONTENT and message.fallback_text is not None:
+                text = message.fallback_text
+                try:
+                    await self.sender.send(self.bot, message.chat_id, text)
+                except Exception as fallback_error:
+                    e, kind = fallback_error, classify_error(fallback_error)
+                else:
+                    batch.delete(message.id)
+                    log.record('fallback', message.chat_id, e)
+                    return True
+            log.record(self._on_failure(message, e, kind, blocked, batch), message.chat_id, e)
+            return False
+
+        batch.delete(message.id)
+        log.record('sent', message.chat_id)
+        return True
+
+    def _on_failure(self, message, error: Exception, kind: str, blocked: List[int], batch) -> str:
+        """Откладывает, отбрасывает или переносит сообщение в dead letters; возвращает исход для лога"""
+        attempts = message.attempts + 1
+        if kind == ERROR_BLOCKED:
+            batch.delete(message.id)
+            blocked.append(message.chat_id)
+            return 'blocked'
+        if kind == ERROR_RETRY and attempts < self.max_attempts:
+            batch.reschedule(message.id, attempts, retry_delay(attempts), str(error))
+            return 'rescheduled'
+        batch.dead_letter(message.chat_id, message.text, message.label, attempts, str(error),
+                          message_id=message.id)
+        return 'dead'
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Корпус цитат на диске
+Файл отображается в память (mmap) и читается лениво: при открытии
+разбирается только заголовок и каталог индексов, цитата декодируется
+при обращении. Индексы по языку и тегу — отсортированные массивы номеров
+цитат, поэтому выборка по теме стоит O(k) от размера результата
+
+Формат файла (все числа little-endian):
+    заголовок   MAGIC, версия u32, число цитат u32,
+                смещение таблицы смещений u64, смещение каталога u64, длина каталога u64
+    данные      цитаты в UTF-8 подряд
+    смещения    (count + 1) x u64 — границы цитат (от начала файла)
+    массивы     номера цитат u32 для каждого языка и тега
+    каталог     JSON: {"languages": {язык: [смещение, длина]}, "tags": {тег: [смещение, длина]}}
+
+Сборка из текстового файла (язык<TAB>теги через запятую<TAB>текст, либо просто текст):
+    python quote_corpus.py build quotes.tsv quotes.qcorpus
+"""
+
+import bisect
+import json
+import mmap
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+MAGIC = b'QCRP'
+VERSION = 1
+
+# MAGIC, версия, количество, смещение таблицы смещений, смещение каталога, длина каталога
+_HEADER = struct.Struct('<4sIIQQQ')
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def is_corpus_file(path: str) -> bool:
+    """Проверяет, что файл — собранный корпус (а не текстовый список цитат)"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def parse_source(path: str) -> Iterator[Tuple[str, str, List[str]]]:
+    """
+    Читает исходный файл цитат
+
+    Строка — либо «язык<TAB>теги<TAB>текст», либо просто текст.
+    Пустые строки и строки, начинающиеся с #, пропускаются.
+
+    Yields:
+        (текст, язык, теги)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            parts = line.split('\t', 2)
+            if len(parts) == 3:
+                language, tags, text = parts
+                yield text.strip(), language.strip().lower(), [
+                    tag.strip().lower() for tag in tags.split(',') if tag.strip()
+                ]
+            else:
+                yield line.strip(), '', []
+
+
+def _write_array(f, values: array) -> None:
+    if not _LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def _pad(f, alignment: int = 8) -> None:
+    f.write(b'\0' * (-f.tell() % alignment))
+
+
+def build_corpus(entries: Iterable[Tuple[str, str, Sequence[str]]], path: str) -> int:
+    """
+    Собирает корпус из (текст, язык, теги)
+
+    Returns:
+        int: Количество цитат в корпусе
+    """
+    offsets = array('Q', [0])
+    languages: Dict[str, array] = {}
+    tags: Dict[str, array] = {}
+
+    with open(path, 'wb') as f:
+        f.write(b'\0' * _HEADER.size)
+        data_start = f.tell()
+        for quote_id, (text, language, quote_tags) in enumerate(entries):
+            f.write(text.encode('utf-8'))
+            offsets.append(f.tell() - data_start)
+            if language:
+                languages.setdefault(language, array('I')).append(quote_id)
+            for tag in set(quote_tags):
+                tags.setdefault(tag, array('I')).append(quote_id)
+        count = len(offsets) - 1
+
+        _pad(f)
+        offsets_start = f.tell()
+        # Смещения в корпусе считаются от начала файла
+        _write_array(f, array('Q', (data_start + offset for offset in offsets)))
+
+        directory = {'languages': {}, 'tags': {}}
+        for section, index in (('languages', languages), ('tags', tags)):
+            for name, ids in sorted(index.items()):
+                _pad(f)
+                directory[section][name] = [f.tell(), len(ids)]
+                _write_array(f, ids)
+
+        directory_start = f.tell()
+        raw_directory = json.dumps(directory, ensure_ascii=False).encode('utf-8')
+        f.write(raw_directory)
+
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, count, offsets_start, directory_start, len(raw_directory)))
+    return count
+
+
+class QuoteCorpus:
+    """
+    Корпус цитат, открытый через mmap
+
+    Ведет себя как последовательность строк (len, индекс, итерация), поэтому
+    подходит для quotes.QuoteRotation без загрузки цитат в память.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, offsets_start, directory_start, directory_size = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} не является корпусом цитат версии {VERSION}")
+
+        self._count = count
+        self._view = memoryview(self._mmap)
+        self._offsets = self._u_array(offsets_start, count + 1, 'Q')
+        directory = json.loads(bytes(self._view[directory_start:directory_start + directory_size]))
+        self._languages: Dict[str, Tuple[int, int]] = {k: tuple(v) for k, v in directory['languages'].items()}
+        self._tags: Dict[str, Tuple[int, int]] = {k: tuple(v) for k, v in directory['tags'].items()}
+
+    def _u_array(self, start: int, length: int, typecode: str) -> Sequence[int]:
+        size = array(typecode).itemsize * length
+        raw = self._view[start:start + size]
+        if _LITTLE_ENDIAN:
+            # Без копирования: числа читаются прямо из отображенного файла
+            return raw.cast(typecode)
+        values = array(typecode, bytes(raw))
+        values.byteswap()
+        return values
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("quote index out of range")
+        return str(self._view[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self._count):
+            yield self[index]
+
+    def languages(self) -> List[str]:
+        """Языки, для которых есть индекс"""
+        return sorted(self._languages)
+
+    def tags(self) -> List[str]:
+        """Теги, для которых есть индекс"""
+        return sorted(self._tags)
+
+    def ids(self, tag: Optional[str] = None, language: Optional[str] = None) -> Sequence[int]:
+        """
+        Номера цитат с заданным тегом и/или языком (по возрастанию)
+
+        Для одного условия возвращается индекс как есть, без копирования;
+        для двух — пересечение, перебирается меньший из индексов.
+        """
+        selected = []
+        if tag is not None:
+            selected.append(self._index(self._tags, tag.lower()))
+        if language is not None:
+            selected.append(self._index(self._languages, language.lower()))
+        if not selected:
+            return range(self._count)
+        if len(selected) == 1:
+            return selected[0]
+
+        smaller, larger = sorted(selected, key=len)
+        return [quote_id for quote_id in smaller if _contains(larger, quote_id)]
+
+    def select(self, tag: Optional[str] = None, language: Optional[str] = None) -> 'QuoteSelection':
+        """Подмножество корпуса как последовательность строк"""
+        return QuoteSelection(self, self.ids(tag, language))
+
+    def _index(self, index: Dict[str, Tuple[int, int]], name: str) -> Sequence[int]:
+        location = index.get(name)
+        if location is None:
+            return ()
+        return self._u_array(location[0], location[1], 'I')
+
+    def close(self) -> None:
+        """Освобождает отображение файла"""
+        self._offsets = None
+        try:
+            self._view.release()
+            self._mmap.close()
+        except BufferError:
+            # Выборки из корпуса еще используются — отображение освободится вместе с ними
+            pass
+
+
+class QuoteSelection:
+    """Выборка из корпуса: последовательность цитат по списку номеров"""
+
+    def __init__(self, corpus: QuoteCorpus, ids: Sequence[int]):
+        self.corpus = corpus
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> str:
+        return self.corpus[self.ids[index]]
+
+    def __iter__(self) -> Iterator[str]:
+        for quote_id in self.ids:
+            yield self.corpus[quote_id]
+
+
+def _contains(sorted_ids: Sequence[int], value: int) -> bool:
+    position = bisect.bisect_left(sorted_ids, value)
+    return position < len(sorted_ids) and sorted_ids[position] == value
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) != 4 or argv[1] != 'build':
+        print("Использование: python quote_corpus.py build <исходный файл> <корпус>")
+        return 2
+    count = build_corpus(parse_source(argv[2]), argv[3])
+    print(f"Собран корпус {argv[3]}: {count} цитат")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
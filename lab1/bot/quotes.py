@@ -2,10 +2,36 @@
 # -*- coding: utf-8 -*-
 """
 Модуль с мотивирующими цитатами для Telegram-бота
+
+Ротация без повторов: для каждого пользователя цитаты идут в порядке
+собственной перетасованной «колоды», пока не закончатся все. Порядок
+задается перестановкой по формуле, поэтому состояние пользователя —
+это только пара (seed, cursor), а выбор следующей цитаты — O(1)
 """
 
+import logging
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from quote_corpus import QuoteCorpus, is_corpus_file, parse_source
+
+logger = logging.getLogger(__name__)
+
+# Файл с цитатами: текстовый (по одной на строку) или собранный корпус
+# (см. quote_corpus.py); если не задан — встроенная коллекция
+QUOTES_FILE = os.getenv('QUOTES_FILE', '')
+
+# Фильтры по корпусу: рассылать только цитаты с тегом и/или на языке
+QUOTES_TAG = os.getenv('QUOTES_TAG') or None
+QUOTES_LANGUAGE = os.getenv('QUOTES_LANGUAGE') or None
+
+_MASK64 = (1 << 64) - 1
+_FEISTEL_ROUNDS = 4
+
 # Коллекция мотивирующих цитат с эмодзи
-MOTIVATIONAL_QUOTES = [
+MOTIVATIONAL_QUOTES = (
     "🚀 Код — это поэзия, написанная на языке логики!",
     "💡 Каждая ошибка — это шаг к совершенству!",
     "⚡ Программирование — это искусство решения проблем!",
@@ -21,7 +47,131 @@ MOTIVATIONAL_QUOTES = [
     "🎵 Код должен звучать как музыка для программиста!",
     "🌈 Разнообразие технологий — это палитра для творчества!",
     "🎭 Отладка — это театр, где ты играешь роль детектива!"
-]
+)
+
+
+def load_quotes(path: str) -> List[str]:
+    """
+    Загружает цитаты из текстового файла
+
+    Одна цитата на строку (или «язык<TAB>теги<TAB>текст», см. quote_corpus.parse_source);
+    пустые строки и строки, начинающиеся с #, пропускаются.
+
+    Returns:
+        list: Список цитат
+    """
+    return [text for text, _, _ in parse_source(path)]
+
+
+def _mix64(value: int) -> int:
+    """Перемешивание битов (splitmix64): одинаковый результат во всех процессах"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+class QuoteRotation:
+    """
+    Ротация цитат по пользователям без повторов
+
+    Круг k пользователя — псевдослучайная перестановка позиций 0..n-1
+    с ключом из (seed, k). Состояние пользователя: seed и cursor
+    (сколько цитат он уже получил).
+
+    Args:
+        quotes: Последовательность цитат (список, корпус или выборка из корпуса)
+        states: Сохраненные состояния {user_id: (seed, cursor)}
+    """
+
+    def __init__(self, quotes: Sequence[str], states: Optional[Dict[int, Tuple[int, int]]] = None):
+        if not quotes:
+            raise ValueError("Список цитат пуст")
+        self.quotes = quotes
+        self._states: Dict[int, Tuple[int, int]] = dict(states or {})
+        self._dirty: Dict[int, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.quotes)
+
+    def next_index(self, user_id: int) -> int:
+        """Номер следующей цитаты пользователя; сдвигает его курсор"""
+        n = len(self.quotes)
+        with self._lock:
+            seed, cursor = self._states.get(user_id) or (random.getrandbits(32), 0)
+            state = (seed, cursor + 1)
+            self._states[user_id] = state
+            self._dirty[user_id] = state
+        return self._index(seed, cursor, n)
+
+    def next_quote(self, user_id: int) -> str:
+        """Следующая цитата пользователя"""
+        return self.quotes[self.next_index(user_id)]
+
+    def take_dirty(self) -> List[Tuple[int, int, int]]:
+        """Забирает измененные состояния для сохранения: [(user_id, seed, cursor)]"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return [(user_id, seed, cursor) for user_id, (seed, cursor) in dirty.items()]
+
+    @classmethod
+    def _index(cls, seed: int, cursor: int, n: int) -> int:
+        if n == 2:
+            # Из двух цитат без повторов подряд — только чередование
+            return (seed + cursor) % 2
+        round_, position = divmod(cursor, n)
+        # На стыке кругов первая цитата нового круга не должна совпасть
+        # с последней цитатой предыдущего: тогда меняем местами позиции 0 и 1
+        # (последняя позиция круга при n > 2 этой заменой не затрагивается)
+        if round_ > 0 and n > 2 and position < 2:
+            if cls._permute(seed, round_, 0, n) == cls._permute(seed, round_ - 1, n - 1, n):
+                position = 1 - position
+        return cls._permute(seed, round_, position, n)
+
+    @staticmethod
+    def _permute(seed: int, round_: int, position: int, n: int) -> int:
+        # Сеть Фейстеля на 2^(2*half) >= n элементах; значения за пределами
+        # [0, n) пропускаются повторным применением (cycle walking), в среднем
+        # не больше четырех раз
+        half = (max(1, (n - 1).bit_length()) + 1) // 2
+        mask = (1 << half) - 1
+        key = _mix64((seed << 32) ^ round_)
+        value = position
+        while True:
+            left, right = value >> half, value & mask
+            for step in range(_FEISTEL_ROUNDS):
+                left, right = right, left ^ (_mix64(key ^ (step << 56) ^ right) & mask)
+            value = (left << half) | right
+            if value < n:
+                return value
+
+
+def get_quotes() -> Sequence[str]:
+    """
+    Коллекция цитат для рассылок
+
+    Собранный корпус открывается через mmap и фильтруется по QUOTES_TAG/QUOTES_LANGUAGE;
+    текстовый файл читается целиком; без QUOTES_FILE — встроенная коллекция.
+    """
+    if not QUOTES_FILE:
+        return MOTIVATIONAL_QUOTES
+    try:
+        if is_corpus_file(QUOTES_FILE):
+            corpus = QuoteCorpus(QUOTES_FILE)
+            quotes = corpus.select(tag=QUOTES_TAG, language=QUOTES_LANGUAGE)
+        else:
+            quotes = load_quotes(QUOTES_FILE)
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось прочитать {QUOTES_FILE}: {e}")
+        return MOTIVATIONAL_QUOTES
+
+    if not quotes:
+        logger.warning(f"В {QUOTES_FILE} нет подходящих цитат, используется встроенная коллекция")
+        return MOTIVATIONAL_QUOTES
+    logger.info(f"Цитат для рассылки из {QUOTES_FILE}: {len(quotes)}")
+    return quotes
+
 
 def get_random_quote() -> str:
     """
@@ -30,7 +180,6 @@ def get_random_quote() -> str:
     Returns:
         str: Случайная цитата из коллекции
     """
-    import random
     return random.choice(MOTIVATIONAL_QUOTES)
 
 def get_quote_count() -> int:
@@ -42,11 +191,11 @@ def get_quote_count() -> int:
     """
     return len(MOTIVATIONAL_QUOTES)
 
-def get_all_quotes() -> list:
+def get_all_quotes() -> Tuple[str, ...]:
     """
     Возвращает все доступные цитаты
     
     Returns:
-        list: Список всех цитат
+        tuple: Неизменяемая коллекция цитат (без копирования)
     """
-    return MOTIVATIONAL_QUOTES.copy()
+    return MOTIVATIONAL_QUOTES
@@ -24,9 +24,14 @@ if [ ! -f ".env" ]; then
     exit 1
 fi
 
-# Устанавливаем зависимости если нужно
+# Устанавливаем зависимости, только если requirements.txt изменился с прошлой установки
 echo "📦 Проверка зависимостей..."
-pip install -r requirements.txt --quiet
+REQ_HASH=$(sha256sum requirements.txt | cut -d' ' -f1)
+if [ "$(cat venv/.requirements.sha256 2>/dev/null)" != "$REQ_HASH" ]; then
+    pip install -r requirements.txt --quiet && echo "$REQ_HASH" > venv/.requirements.sha256
+else
+    echo "✅ Зависимости не изменились"
+fi
 
 # Запускаем бота
 echo "🚀 Запуск бота..."
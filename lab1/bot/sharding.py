@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Шардирование рассылок по нескольким процессам
+Координатор делит подписчиков между воркерами консистентным хешированием
+по user_id; каждый воркер рассылает свою часть через собственный Bot,
+а общий лимит Telegram соблюдается через ведро токенов в разделяемой памяти
+"""
+
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from broadcast import GLOBAL_RATE_LIMIT, Broadcaster, BroadcastResult, TextSource
+from logging_setup import setup_logging, stop_logging
+from storage import DB_FILE, OutboxStore
+
+logger = logging.getLogger(__name__)
+
+# Количество виртуальных узлов на шард: выравнивает размер частей
+RING_REPLICAS = 160
+
+# Как часто координатор проверяет, живы ли воркеры (секунды)
+WORKER_CHECK_INTERVAL = 5.0
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class ConsistentHashRing:
+    """Кольцо консистентного хеширования: user_id -> номер шарда"""
+
+    def __init__(self, shards: Iterable[int], replicas: int = RING_REPLICAS):
+        points = sorted(
+            (_hash(f"{shard}:{replica}"), shard)
+            for shard in shards
+            for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, user_id: int) -> int:
+        """Возвращает шард пользователя"""
+        index = bisect.bisect(self._keys, _hash(str(user_id))) % len(self._keys)
+        return self._shards[index]
+
+    def partition(self, user_ids: Iterable[int]) -> Dict[int, List[int]]:
+        """Раскладывает пользователей по шардам"""
+        parts: Dict[int, List[int]] = {}
+        for user_id in user_ids:
+            parts.setdefault(self.shard_for(user_id), []).append(user_id)
+        return parts
+
+
+class SharedTokenBucket:
+    """
+    Ведро токенов в разделяемой памяти: общий лимит для всех процессов
+
+    Интерфейс совпадает с broadcast.TokenBucket (acquire/pause).
+    """
+
+    def __init__(self, state):
+        self.rate, self._tokens, self._updated, self._paused_until, self._lock = state
+
+    @staticmethod
+    def create_state(ctx, rate: float = GLOBAL_RATE_LIMIT):
+        """Создает разделяемое состояние, которое передается воркерам при запуске"""
+        return (
+            rate,
+            ctx.Value('d', float(rate), lock=False),
+            ctx.Value('d', time.time(), lock=False),
+            ctx.Value('d', 0.0, lock=False),
+            ctx.Lock()
+        )
+
+    async def acquire(self) -> None:
+        """Дожидается свободного токена"""
+        while True:
+            with self._lock:
+                now = time.time()
+                if now < self._paused_until.value:
+                    wait = self._paused_until.value - now
+                else:
+                    tokens = min(self.rate, self._tokens.value + (now - self._updated.value) * self.rate)
+                    self._updated.value = now
+                    if tokens >= 1:
+                        self._tokens.value = tokens - 1
+                        return
+                    self._tokens.value = tokens
+                    wait = (1 - tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов во всех процессах"""
+        with self._lock:
+            self._paused_until.value = max(self._paused_until.value, time.time() + seconds)
+            self._tokens.value = 0.0
+            # Наполнение начинается с конца паузы, как в broadcast.TokenBucket
+            self._updated.value = self._paused_until.value
+
+
+def _worker_main(shard: int, token: str, inbox, results, bucket_state, base_url: Optional[str] = None) -> None:
+    """Точка входа процесса-воркера"""
+    setup_logging(text_format=f'%(asctime)s - shard{shard} - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(_worker_loop(shard, token, inbox, results, bucket_state, base_url))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_logging()
+
+
+async def _worker_loop(shard: int, token: str, inbox, results, bucket_state, base_url: Optional[str] = None) -> None:
+    from telegram import Bot
+
+    loop = asyncio.get_running_loop()
+    # Своё соединение с базой: sqlite-соединения не передаются между процессами
+    outbox = OutboxStore(DB_FILE)
+    broadcaster = Broadcaster(bucket=SharedTokenBucket(bucket_state), outbox=outbox)
+    bot = Bot(token, base_url=base_url) if base_url else Bot(token)
+    try:
+        await bot.initialize()
+    except Exception as e:
+        # Отвечаем на задания неудачей, чтобы координатор не ждал вечно
+        logger.error(f"Шард {shard}: не удалось инициализировать бота: {e}")
+        bot = None
+
+    try:
+        while True:
+            job = await loop.run_in_executor(None, inbox.get)
+            if job is None:
+                break
+            job_id, chat_ids, text, fallback_text, label = job
+            # Персональные тексты приходят словарем chat_id -> текст
+            if isinstance(text, dict):
+                text = text.__getitem__
+            if isinstance(fallback_text, dict):
+                fallback_text = fallback_text.__getitem__
+            if bot is None:
+                results.put((job_id, shard, 0, 0, 0, len(chat_ids), []))
+                continue
+            try:
+                result = await broadcaster.broadcast(bot, chat_ids, text, fallback_text, label)
+                results.put((job_id, shard, result.sent, result.fallback, result.queued,
+                             result.failed, result.blocked_ids))
+            except Exception as e:
+                logger.error(f"Шард {shard}: ошибка рассылки '{label}': {e}", exc_info=True)
+                results.put((job_id, shard, 0, 0, 0, len(chat_ids), []))
+    finally:
+        outbox.close()
+        if bot is not None:
+            await bot.shutdown()
+
+
+class ShardedBroadcaster:
+    """
+    Рассылка через N процессов-воркеров
+
+    Совместим с broadcast.Broadcaster по методу broadcast(); аргумент bot
+    не используется — у каждого воркера свой экземпляр Bot.
+    """
+
+    def __init__(self, token: str, workers: int, rate_limit: float = GLOBAL_RATE_LIMIT,
+                 base_url: Optional[str] = None):
+        self.workers = workers
+        self.ring = ConsistentHashRing(range(workers))
+        ctx = multiprocessing.get_context('spawn')
+        # Ссылку держим сами: после start() Process отпускает свои args,
+        # а семафор должен дожить до распаковки в дочернем процессе
+        self._bucket_state = SharedTokenBucket.create_state(ctx, rate_limit)
+        self._results = ctx.Queue()
+        self._inboxes = [ctx.Queue() for _ in range(workers)]
+        self._processes = [
+            ctx.Process(
+                target=_worker_main,
+                args=(shard, token, self._inboxes[shard], self._results, self._bucket_state, base_url),
+                name=f"broadcast-shard-{shard}",
+                daemon=True
+            )
+            for shard in range(workers)
+        ]
+        self._job_ids = itertools.count()
+        self._jobs: Dict[int, _ShardJob] = {}
+        self._collector: Optional[threading.Thread] = None
+
+    def local_broadcaster(self, outbox=None) -> Broadcaster:
+        """
+        Broadcaster для отправок из основного процесса (повторы из очереди)
+
+        Берет токены из того же разделяемого ведра, что и воркеры: общий
+        лимит 30 сообщений/с не превышается, а RetryAfter, полученный любой
+        стороной, приостанавливает обе
+        """
+        return Broadcaster(bucket=SharedTokenBucket(self._bucket_state), outbox=outbox)
+
+    def start(self) -> None:
+        """Запускает процессы-воркеры и поток сбора результатов"""
+        for process in self._processes:
+            process.start()
+        self._collector = threading.Thread(target=self._collect, name="broadcast-results", daemon=True)
+        self._collector.start()
+        logger.info(f"Запущено процессов рассылки: {self.workers}")
+
+    def stop(self) -> None:
+        """Останавливает воркеров"""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        if self._collector is not None:
+            self._collector.join(timeout=5)
+        logger.info("Процессы рассылки остановлены")
+
+    async def broadcast(self, bot, chat_ids: Iterable[int], text: TextSource,
+                        fallback_text: Optional[TextSource] = None, label: str = "рассылка") -> BroadcastResult:
+        """Делит чаты по шардам и ждет итогов от всех воркеров"""
+        chat_ids = list(chat_ids)
+        result = BroadcastResult(len(chat_ids))
+        if not chat_ids:
+            return result
+
+        started = time.monotonic()
+        parts = self.ring.partition(chat_ids)
+        job_id = next(self._job_ids)
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        self._jobs[job_id] = _ShardJob(loop, done, result, parts)
+
+        for shard, shard_ids in parts.items():
+            self._inboxes[shard].put((
+                job_id, shard_ids, _for_shard(text, shard_ids), _for_shard(fallback_text, shard_ids), label
+            ))
+
+        while not done.done():
+            await asyncio.wait({done}, timeout=WORKER_CHECK_INTERVAL)
+            self._fail_dead_shards(job_id)
+
+        result.duration = time.monotonic() - started
+        return result
+
+    def _fail_dead_shards(self, job_id: int) -> None:
+        """Засчитывает части упавших воркеров как неудачные"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        for shard in list(job.pending):
+            if not self._processes[shard].is_alive():
+                logger.error(f"Процесс рассылки шарда {shard} не работает")
+                self._on_result((job_id, shard, 0, 0, 0, len(job.parts[shard]), []))
+
+    def _collect(self) -> None:
+        """Поток: читает итоги воркеров и передает их в event loop"""
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            job = self._jobs.get(message[0])
+            if job is not None:
+                job.loop.call_soon_threadsafe(self._on_result, message)
+
+    def _on_result(self, message) -> None:
+        job_id, shard, sent, fallback, queued, failed, blocked_ids = message
+        job = self._jobs.get(job_id)
+        if job is None or shard not in job.pending:
+            return
+        job.pending.discard(shard)
+        job.result.sent += sent
+        job.result.fallback += fallback
+        job.result.queued += queued
+        job.result.failed += failed
+        job.result.blocked_ids.extend(blocked_ids)
+        if not job.pending:
+            del self._jobs[job_id]
+            if not job.done.done():
+                job.done.set_result(job.result)
+
+
+def _for_shard(text: Optional[TextSource], chat_ids: List[int]):
+    """Функции не передаются в другой процесс: раскрываем их в словарь по чатам шарда"""
+    if callable(text):
+        return {chat_id: text(chat_id) for chat_id in chat_ids}
+    return text
+
+
+class _ShardJob:
+    """Рассылка, ожидающая итогов от шардов"""
+
+    def __init__(self, loop, done, result: BroadcastResult, parts: Dict[int, List[int]]):
+        self.loop = loop
+        self.done = done
+        self.result = result
+        self.parts = parts
+        self.pending = set(parts)
@@ -3,81 +3,365 @@
 """
 Простой планировщик задач для Telegram-бота
 Альтернатива JobQueue для Python 3.13
+
+Все задачи хранятся в одной куче по времени следующего запуска;
+единственный цикл спит ровно до ближайшей задачи. Выполненные слоты
+записываются в журнал запусков, поэтому перезапуск не приводит
+к повторной рассылке.
 """
 
 import asyncio
+import heapq
+import itertools
 import logging
+import time as _time
 from datetime import datetime, time, timedelta
-import pytz
-from typing import Callable, Any
+from typing import Callable, List, Optional, Set, Tuple
+
+from metrics import SCHEDULER_LAG_SECONDS
 
 logger = logging.getLogger(__name__)
 
+# Сколько секунд при остановке ждать выполняющиеся задачи, прежде чем отменить их
+STOP_TIMEOUT = 10
+
+# Максимальная длительность одного сна цикла (секунды).
+# Ограничение нужно, чтобы заметить перевод системных часов.
+MAX_SLEEP = 300
+
+# Политики для запусков, пропущенных, пока бот был остановлен
+MISFIRE_SKIP = 'skip'          # пропустить, дождаться следующего слота
+MISFIRE_RUN_ONCE = 'run_once'  # выполнить один раз сразу после старта
+MISFIRE_CATCH_UP = 'catch_up'  # выполнить каждый пропущенный слот по порядку
+
+# Сколько пропущенных слотов максимум догонять при MISFIRE_CATCH_UP
+MAX_CATCH_UP = 10
+
+
+def _localize(naive: datetime, tz) -> datetime:
+    """Привязывает наивное время к часовому поясу (pytz или zoneinfo)"""
+    if tz is None:
+        return naive.astimezone()
+    if hasattr(tz, 'localize'):
+        return tz.localize(naive)
+    return naive.replace(tzinfo=tz)
+
+
+class DailySchedule:
+    """Ежедневный запуск в заданное время (опционально — только в указанные дни недели)"""
+
+    def __init__(self, schedule_time: time, days: Optional[tuple] = None):
+        self.schedule_time = schedule_time
+        self.days = frozenset(days) if days is not None else None
+
+    def next_after(self, now: datetime, tz) -> Optional[datetime]:
+        day = now.date()
+        for _ in range(8):
+            if self.days is None or day.weekday() in self.days:
+                candidate = _localize(datetime.combine(day, self.schedule_time.replace(tzinfo=None)), tz)
+                if candidate > now:
+                    return candidate
+            day += timedelta(days=1)
+        return None
+
+
+class OneTimeSchedule:
+    """Однократный запуск в заданный момент"""
+
+    def __init__(self, when: datetime):
+        self.when = when
+
+    def next_after(self, now: datetime, tz) -> Optional[datetime]:
+        if self.when.tzinfo is None:
+            self.when = _localize(self.when, tz)
+        return self.when if self.when > now else None
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> frozenset:
+    """Разбирает поле cron: *, */n, a-b, a-b/n, списки через запятую"""
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            step = int(step_str)
+            if step <= 0:
+                raise ValueError(f"Некорректный шаг в поле cron: {field}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_str, end_str = part.split('-', 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Значение вне диапазона в поле cron: {field}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule:
+    """
+    Расписание в формате cron: "минута час день месяц день_недели"
+
+    День недели: 0 или 7 — воскресенье, 1 — понедельник, ..., 6 — суббота.
+    Как и в cron, если заданы и день месяца, и день недели, достаточно
+    совпадения любого из них.
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Выражение cron должно содержать 5 полей: {expression!r}")
+        self.expression = expression
+        self.minutes = tuple(sorted(_parse_cron_field(fields[0], 0, 59)))
+        self.hours = tuple(sorted(_parse_cron_field(fields[1], 0, 23)))
+        self.days_of_month = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        # Переводим в нумерацию Python: 0 — понедельник
+        self.weekdays = frozenset((d - 1) % 7 for d in _parse_cron_field(fields[4], 0, 7))
+        self._dom_any = fields[2] == '*'
+        self._dow_any = fields[4] == '*'
+
+    def _day_matches(self, day) -> bool:
+        dom_ok = day.day in self.days_of_month
+        dow_ok = day.weekday() in self.weekdays
+        if self._dom_any or self._dow_any:
+            return dom_ok and dow_ok
+        return dom_ok or dow_ok
+
+    def next_after(self, now: datetime, tz) -> Optional[datetime]:
+        local_now = now.astimezone(tz) if tz is not None else now
+        start = local_now.replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        # Перебираем дни, а внутри дня — только подходящие часы и минуты
+        for _ in range(366 * 5):
+            if day.month in self.months and self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.combine(day, time(hour, minute))
+                        if candidate >= start:
+                            return _localize(candidate, tz)
+            day += timedelta(days=1)
+        return None
+
+
+class _ScheduledTask:
+    """Задача планировщика"""
+
+    def __init__(self, task_func: Callable, schedule, name: str, misfire_policy: str = MISFIRE_SKIP):
+        if misfire_policy not in (MISFIRE_SKIP, MISFIRE_RUN_ONCE, MISFIRE_CATCH_UP):
+            raise ValueError(f"Неизвестная политика пропуска: {misfire_policy}")
+        self.task_func = task_func
+        self.schedule = schedule
+        self.name = name
+        self.misfire_policy = misfire_policy
+        self.next_run: Optional[datetime] = None
+
+
 class SimpleScheduler:
-    """Простой планировщик задач"""
-    
-    def __init__(self, bot, timezone):
+    """
+    Простой планировщик задач
+
+    ledger — журнал запусков (например, storage.RunLedger) с методами
+    last_run(name), record_run(name, when) и compact(names). Без него
+    планировщик работает только в памяти. last_run() читает кэш в памяти,
+    а записи (record_run, compact) идут в SQLite и выполняются в executor,
+    чтобы коммит не останавливал event loop.
+    """
+
+    def __init__(self, bot, timezone, ledger=None):
         self.bot = bot
         self.timezone = timezone
-        self.tasks = []
+        self.ledger = ledger
+        self.tasks: List[_ScheduledTask] = []
         self.running = False
-        
+        self._heap: List[Tuple[float, int, _ScheduledTask]] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._running_jobs: Set[asyncio.Task] = set()
+        # Проверка и запись слота в журнал не должны перемежаться между задачами
+        self._claim_lock = asyncio.Lock()
+
     async def start(self):
         """Запуск планировщика"""
         self.running = True
+        self._wakeup = asyncio.Event()
+
+        now = self._now()
+        if self.ledger is not None:
+            names = [task.name for task in self.tasks if task.name]
+            removed = await asyncio.get_running_loop().run_in_executor(None, self.ledger.compact, names)
+            if removed:
+                logger.info(f"Из журнала запусков удалено устаревших задач: {removed}")
+
+        for task in self.tasks:
+            missed = await self._missed_runs(task, now)
+            if missed:
+                self._spawn(self._catch_up(task, missed))
+            self._schedule(task, now)
+
+        self._loop_task = asyncio.create_task(self._run())
         logger.info("Простой планировщик запущен")
-        
-        # Запускаем все задачи
-        for task_func, schedule_time, days, name in self.tasks:
-            asyncio.create_task(self._run_scheduled_task(task_func, schedule_time, days, name))
-    
-    async def stop(self):
-        """Остановка планировщика"""
+
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        """
+        Остановка планировщика
+
+        Выполняющиеся задачи (рассылки) получают timeout секунд на завершение,
+        затем отменяются; к возврату из stop() ни одна из них не работает,
+        и хранилище можно закрывать
+        """
         self.running = False
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+        jobs = set(self._running_jobs)
+        if jobs:
+            logger.info(f"Ожидание выполняющихся задач планировщика: {len(jobs)}")
+            _, pending = await asyncio.wait(jobs, timeout=timeout)
+            if pending:
+                logger.warning(f"Задачи планировщика не завершились за {timeout} с и отменены: {len(pending)}")
+                for job in pending:
+                    job.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
         logger.info("Простой планировщик остановлен")
-    
-    def add_daily_task(self, task_func: Callable, schedule_time: time, days: tuple = None, name: str = None):
+
+    def add_daily_task(self, task_func: Callable, schedule_time: time, days: tuple = None, name: str = None,
+                       misfire_policy: str = MISFIRE_SKIP):
         """Добавить ежедневную задачу"""
-        self.tasks.append((task_func, schedule_time, days, name))
+        self._add(_ScheduledTask(task_func, DailySchedule(schedule_time, days), name, misfire_policy))
         logger.info(f"Добавлена задача '{name}' на {schedule_time.strftime('%H:%M')} МСК")
-    
-    def add_one_time_task(self, task_func: Callable, when: datetime, name: str = None):
-        """Добавить разовую задачу"""
-        self.tasks.append((task_func, when.time(), None, name))
+
+    def add_one_time_task(self, task_func: Callable, when: datetime, name: str = None,
+                          misfire_policy: str = MISFIRE_SKIP):
+        """Добавить разовую задачу (выполняется ровно один раз, в том числе с учетом перезапусков)"""
+        self._add(_ScheduledTask(task_func, OneTimeSchedule(when), name, misfire_policy))
         logger.info(f"Добавлена разовая задача '{name}' на {when.strftime('%H:%M:%S %d.%m.%Y')} МСК")
-    
-    async def _run_scheduled_task(self, task_func: Callable, schedule_time: time, days: tuple, name: str):
-        """Запуск запланированной задачи"""
+
+    def add_cron_task(self, task_func: Callable, expression: str, name: str = None,
+                      misfire_policy: str = MISFIRE_SKIP):
+        """Добавить задачу по cron-выражению ("минута час день месяц день_недели")"""
+        self._add(_ScheduledTask(task_func, CronSchedule(expression), name, misfire_policy))
+        logger.info(f"Добавлена задача '{name}' по расписанию '{expression}'")
+
+    def _add(self, task: _ScheduledTask) -> None:
+        self.tasks.append(task)
+        if self.running:
+            self._schedule(task, self._now())
+            self._wakeup.set()
+
+    def _now(self) -> datetime:
+        if self.timezone is None:
+            return datetime.now().astimezone()
+        return datetime.now(self.timezone)
+
+    async def _missed_runs(self, task: _ScheduledTask, now: datetime) -> List[datetime]:
+        """Слоты, пропущенные с последнего записанного запуска, с учетом политики"""
+        if self.ledger is None or not task.name:
+            return []
+        last_run = self.ledger.last_run(task.name)
+        if last_run is None:
+            return []
+
+        missed = []
+        slot = task.schedule.next_after(last_run, self.timezone)
+        while slot is not None and slot <= now:
+            missed.append(slot)
+            slot = task.schedule.next_after(slot, self.timezone)
+            if len(missed) > MAX_CATCH_UP:
+                missed.pop(0)
+
+        if not missed:
+            return []
+        if task.misfire_policy == MISFIRE_SKIP:
+            logger.info(f"Задача '{task.name}': пропущенные запуски не выполняются (последний слот {missed[-1]})")
+            await self._record_run(task, missed[-1])
+            return []
+        if task.misfire_policy == MISFIRE_RUN_ONCE:
+            return missed[-1:]
+        return missed
+
+    async def _claim(self, task: _ScheduledTask, slot: datetime) -> bool:
+        """Записывает слот в журнал; False, если он уже был выполнен"""
+        if self.ledger is None or not task.name:
+            return True
+        async with self._claim_lock:
+            last_run = self.ledger.last_run(task.name)
+            if last_run is not None and last_run >= slot:
+                logger.info(f"Задача '{task.name}' на {slot} уже выполнялась, пропускаем")
+                return False
+            await self._record_run(task, slot)
+        return True
+
+    async def _record_run(self, task: _ScheduledTask, slot: datetime) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.ledger.record_run, task.name, slot)
+
+    def _spawn(self, coro) -> None:
+        job = asyncio.create_task(coro)
+        self._running_jobs.add(job)
+        job.add_done_callback(self._running_jobs.discard)
+
+    async def _catch_up(self, task: _ScheduledTask, slots: List[datetime]):
+        """Последовательно выполняет пропущенные слоты"""
+        logger.info(f"Задача '{task.name}': выполняем пропущенных запусков: {len(slots)}")
+        for slot in slots:
+            await self._execute(task, slot)
+
+    def _schedule(self, task: _ScheduledTask, after: datetime) -> None:
+        """Кладет задачу в кучу на время следующего запуска"""
+        task.next_run = task.schedule.next_after(after, self.timezone)
+        if task.next_run is None:
+            logger.info(f"Задача '{task.name}' больше не будет выполняться")
+            return
+        heapq.heappush(self._heap, (task.next_run.timestamp(), next(self._counter), task))
+
+    async def _run(self):
+        """Единственный цикл: спит до ближайшей задачи и запускает все наступившие"""
         while self.running:
             try:
-                now = datetime.now(self.timezone)
-                current_time = now.time()
-                current_weekday = now.weekday()
-                
-                # Проверяем, нужно ли выполнять задачу сегодня
-                should_run = True
-                if days is not None:
-                    should_run = current_weekday in days
-                
-                # Проверяем время
-                if should_run and current_time >= schedule_time:
-                    # Проверяем, не выполняли ли мы уже эту задачу сегодня
-                    last_run_key = f"{name}_{now.date()}"
-                    if not hasattr(self, '_last_runs'):
-                        self._last_runs = set()
-                    
-                    if last_run_key not in self._last_runs:
-                        logger.info(f"Выполнение задачи '{name}' в {current_time.strftime('%H:%M:%S')}")
-                        try:
-                            await task_func(self.bot)
-                            self._last_runs.add(last_run_key)
-                            logger.info(f"Задача '{name}' выполнена успешно")
-                        except Exception as e:
-                            logger.error(f"Ошибка выполнения задачи '{name}': {e}")
-                
-                # Ждем до следующей минуты
-                await asyncio.sleep(60)
-                
+                if self._heap:
+                    delay = min(self._heap[0][0] - _time.time(), MAX_SLEEP)
+                else:
+                    delay = MAX_SLEEP
+
+                if delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                now_ts = _time.time()
+                now = self._now()
+                while self._heap and self._heap[0][0] <= now_ts:
+                    _, _, task = heapq.heappop(self._heap)
+                    self._spawn(self._execute(task, task.next_run))
+                    self._schedule(task, now)
+
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Ошибка в планировщике задачи '{name}': {e}")
-                await asyncio.sleep(60)
+                logger.error(f"Ошибка в цикле планировщика: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def _execute(self, task: _ScheduledTask, slot: datetime):
+        """Выполнение одной задачи"""
+        # Слот фиксируется до запуска: при сбое посреди рассылки она не повторится
+        if not await self._claim(task, slot):
+            return
+        SCHEDULER_LAG_SECONDS.observe(max((self._now() - slot).total_seconds(), 0.0), task=task.name or 'unnamed')
+        logger.info(f"Выполнение задачи '{task.name}' в {self._now().strftime('%H:%M:%S')}")
+        try:
+            await task.task_func(self.bot)
+            logger.info(f"Задача '{task.name}' выполнена успешно")
+        except Exception as e:
+            logger.error(f"Ошибка выполнения задачи '{task.name}': {e}")
@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранилище подписчиков Telegram-бота на SQLite
+Заменяет перезапись всего bot_data.json на индексированные точечные запросы
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from metrics import STORAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Файл базы данных
+DB_FILE = 'bot_data.db'
+
+# Старый JSON-файл, из которого выполняется разовая миграция
+LEGACY_JSON_FILE = 'bot_data.json'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    inactive_since TEXT,
+    inactive_reason TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Добавляет пользователя или возвращает в рассылку ранее отключенного
+_UPSERT_ACTIVE_USER = (
+    "INSERT INTO users (user_id, created_at) VALUES (?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET inactive_since = NULL, inactive_reason = NULL "
+    "WHERE inactive_since IS NOT NULL"
+)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    """Открывает базу в режиме WAL; autocommit — каждая запись отдельной короткой транзакцией"""
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SubscriberStore:
+    """Репозиторий подписчиков поверх SQLite в режиме WAL"""
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self) -> None:
+        """Добавляет колонки, появившиеся после создания базы"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(users)")}
+        for column in ('inactive_since', 'inactive_reason'):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE users ADD COLUMN {column} TEXT")
+
+    @STORAGE_SECONDS.timed(operation='subscribers.add_user')
+    def add_user(self, user_id: int) -> bool:
+        """Добавляет пользователя, возвращает True, если он новый"""
+        with self._lock:
+            cursor = self._conn.execute(_UPSERT_ACTIVE_USER, (user_id, _now_iso()))
+            return cursor.rowcount == 1
+
+    @STORAGE_SECONDS.timed(operation='subscribers.add_users')
+    def add_users(self, user_ids: Iterable[int]) -> int:
+        """Добавляет пачку пользователей одной транзакцией"""
+        now = _now_iso()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    _UPSERT_ACTIVE_USER, ((int(user_id), now) for user_id in user_ids)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._conn.total_changes - before
+
+    @STORAGE_SECONDS.timed(operation='subscribers.deactivate_users')
+    def deactivate_users(self, user_ids: Iterable[int], reason: str) -> int:
+        """
+        Помечает пачку пользователей неактивными одной транзакцией
+
+        Неактивные не попадают в рассылки, пока снова не напишут боту.
+
+        Returns:
+            int: Сколько пользователей было отключено
+        """
+        now = _now_iso()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "UPDATE users SET inactive_since = ?, inactive_reason = ? "
+                    "WHERE user_id = ? AND inactive_since IS NULL",
+                    ((now, reason, int(user_id)) for user_id in user_ids)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._conn.total_changes - before
+
+    def count_inactive(self) -> int:
+        """Возвращает количество отключенных пользователей"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM users WHERE inactive_since IS NOT NULL"
+            ).fetchone()[0]
+
+    def has_user(self, user_id: int) -> bool:
+        """Проверяет, подписан ли пользователь (поиск по первичному ключу)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM users WHERE user_id = ? AND inactive_since IS NULL", (user_id,)
+            ).fetchone()
+            return row is not None
+
+    @STORAGE_SECONDS.timed(operation='subscribers.get_users')
+    def get_users(self) -> List[int]:
+        """Возвращает активных подписчиков в порядке добавления"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id FROM users WHERE inactive_since IS NULL ORDER BY rowid"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count_users(self) -> int:
+        """Возвращает количество активных подписчиков"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM users WHERE inactive_since IS NULL"
+            ).fetchone()[0]
+
+    @STORAGE_SECONDS.timed(operation='subscribers.replace_users')
+    def replace_users(self, user_ids: Iterable[int]) -> None:
+        """Полностью заменяет список подписчиков"""
+        now = _now_iso()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM users")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, created_at) VALUES (?, ?)",
+                    ((int(user_id), now) for user_id in user_ids)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """Читает служебное значение"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        """Записывает служебное значение"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+
+    def migrate_from_json(self, json_path: str = LEGACY_JSON_FILE) -> int:
+        """
+        Разовая миграция пользователей из старого bot_data.json
+
+        Returns:
+            int: Количество перенесенных пользователей
+        """
+        if self.get_meta('json_migrated') or not os.path.exists(json_path):
+            return 0
+
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения {json_path} для миграции: {e}")
+            return 0
+
+        migrated = self.add_users(data.get('users', []))
+        self.set_meta('json_migrated', _now_iso())
+        logger.info(f"Перенесено {migrated} пользователей из {json_path} в {self.path}")
+        return migrated
+
+    def close(self) -> None:
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
+
+
+class SubscriberCache:
+    """
+    Множество подписчиков в памяти с отложенной пакетной записью в хранилище
+
+    Проверка и добавление выполняются за O(1) без обращения к диску;
+    новые пользователи накапливаются и сбрасываются в SQLite одной
+    транзакцией через flush_delay секунд после первого добавления
+    или сразу при накоплении batch_size записей.
+    """
+
+    def __init__(self, store: SubscriberStore, flush_delay: float = 5.0, batch_size: int = 500):
+        self.store = store
+        self.flush_delay = flush_delay
+        self.batch_size = batch_size
+        self._users: Set[int] = set(store.get_users())
+        self._pending: Set[int] = set()
+        self._lock = threading.Lock()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def add(self, user_id: int) -> bool:
+        """Добавляет пользователя, возвращает True, если он новый"""
+        if user_id in self._users:
+            return False
+        self._users.add(user_id)
+        with self._lock:
+            self._pending.add(user_id)
+            pending = len(self._pending)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты проверки) пишем сразу
+            self.flush()
+            return True
+
+        if pending >= self.batch_size:
+            self._cancel_timer()
+            loop.run_in_executor(None, self.flush)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_delay, self._flush_in_background, loop)
+        return True
+
+    def deactivate_many(self, user_ids: Iterable[int], reason: str = 'blocked') -> int:
+        """Исключает пользователей из рассылок и помечает их неактивными в хранилище"""
+        removed = [user_id for user_id in set(user_ids) if user_id in self._users]
+        if not removed:
+            return 0
+        self._users.difference_update(removed)
+        with self._lock:
+            # Еще не записанных сначала сохраняем, чтобы было что помечать
+            pending = self._pending & set(removed)
+            self._pending.difference_update(removed)
+        try:
+            if pending:
+                self.store.add_users(pending)
+            self.store.deactivate_users(removed, reason)
+        except Exception as e:
+            logger.error(f"Ошибка при отключении пользователей: {e}")
+        return len(removed)
+
+    def get_users(self) -> List[int]:
+        """Возвращает снимок подписчиков"""
+        return list(self._users)
+
+    def reload(self) -> None:
+        """Перечитывает подписчиков из хранилища, предварительно сохранив накопленное"""
+        self.flush()
+        self._users = set(self.store.get_users())
+
+    def flush(self) -> int:
+        """Записывает накопленных пользователей в хранилище"""
+        with self._lock:
+            batch, self._pending = self._pending, set()
+        if not batch:
+            return 0
+        try:
+            self.store.add_users(batch)
+            logger.debug(f"Сохранено {len(batch)} новых пользователей")
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении пользователей: {e}")
+            with self._lock:
+                self._pending |= batch
+            return 0
+        return len(batch)
+
+    def _flush_in_background(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._flush_handle = None
+        loop.run_in_executor(None, self.flush)
+
+    def _cancel_timer(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+    def close(self) -> None:
+        """Отменяет отложенную запись и сбрасывает всё на диск"""
+        self._cancel_timer()
+        self.flush()
+
+
+class RunLedger:
+    """
+    Журнал запусков задач планировщика
+
+    Хранит по одной строке на задачу — время последнего выполненного
+    слота, поэтому не растет со временем и переживает перезапуски.
+    """
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scheduler_runs ("
+            "name TEXT PRIMARY KEY, last_run TEXT NOT NULL)"
+        )
+        self._cache: Dict[str, datetime] = {
+            name: datetime.fromisoformat(last_run)
+            for name, last_run in self._conn.execute("SELECT name, last_run FROM scheduler_runs")
+        }
+
+    def last_run(self, name: str) -> Optional[datetime]:
+        """Возвращает время последнего выполненного слота задачи"""
+        return self._cache.get(name)
+
+    @STORAGE_SECONDS.timed(operation='scheduler_runs.record_run')
+    def record_run(self, name: str, when: datetime) -> None:
+        """Отмечает слот задачи как выполненный"""
+        self._cache[name] = when
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO scheduler_runs (name, last_run) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET last_run = excluded.last_run",
+                (name, when.isoformat())
+            )
+
+    def compact(self, active_names: Iterable[str]) -> int:
+        """Удаляет записи задач, которых больше нет в расписании"""
+        stale = set(self._cache) - set(active_names)
+        if not stale:
+            return 0
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM scheduler_runs WHERE name = ?", ((name,) for name in stale)
+            )
+        for name in stale:
+            del self._cache[name]
+        return len(stale)
+
+    def close(self) -> None:
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
+
+
+class QuoteStateStore:
+    """
+    Состояние ротации цитат по пользователям (см. quotes.QuoteRotation)
+
+    На пользователя хранится только пара (seed, cursor).
+    """
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS quote_rotation ("
+            "user_id INTEGER PRIMARY KEY, seed INTEGER NOT NULL, cursor INTEGER NOT NULL)"
+        )
+
+    @STORAGE_SECONDS.timed(operation='quote_rotation.load')
+    def load(self) -> Dict[int, Tuple[int, int]]:
+        """Возвращает состояния всех пользователей {user_id: (seed, cursor)}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, seed, cursor FROM quote_rotation").fetchall()
+        return {user_id: (seed, cursor) for user_id, seed, cursor in rows}
+
+    @STORAGE_SECONDS.timed(operation='quote_rotation.save')
+    def save(self, rows: Iterable[Tuple[int, int, int]]) -> None:
+        """Сохраняет пачку состояний (user_id, seed, cursor) одной транзакцией"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO quote_rotation (user_id, seed, cursor) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET seed = excluded.seed, cursor = excluded.cursor",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
+
+
+_OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    fallback_text TEXT,
+    label TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox (next_attempt_at);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    label TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    failed_at TEXT NOT NULL
+);
+"""
+
+
+class OutboxMessage(NamedTuple):
+    """Сообщение, ожидающее повторной отправки"""
+    id: int
+    chat_id: int
+    text: str
+    fallback_text: Optional[str]
+    label: str
+    attempts: int
+
+
+class OutboxBatch:
+    """
+    Изменения очереди, накопленные за рассылку или проход повторов
+
+    Методы только запоминают изменения; записываются они одной транзакцией
+    через OutboxStore.apply() в потоке executor, а не отдельным коммитом
+    на каждого получателя в event loop
+    """
+
+    def __init__(self):
+        self.enqueued: List[Tuple] = []
+        self.rescheduled: List[Tuple] = []
+        self.deleted: List[int] = []
+        self.dead: List[Tuple] = []
+
+    def enqueue(self, chat_id: int, text: str, fallback_text: Optional[str], label: str,
+                error: str, delay: float, attempts: int = 1) -> None:
+        self.enqueued.append((chat_id, text, fallback_text, label, attempts, time.time() + delay, error, _now_iso()))
+
+    def reschedule(self, message_id: int, attempts: int, delay: float, error: str) -> None:
+        self.rescheduled.append((attempts, time.time() + delay, error, message_id))
+
+    def delete(self, message_id: int) -> None:
+        self.deleted.append(message_id)
+
+    def dead_letter(self, chat_id: int, text: str, label: str, attempts: int, error: str,
+                    message_id: Optional[int] = None) -> None:
+        self.dead.append((chat_id, text, label, attempts, error, _now_iso()))
+        if message_id is not None:
+            self.deleted.append(message_id)
+
+    def __len__(self) -> int:
+        return len(self.enqueued) + len(self.rescheduled) + len(self.deleted) + len(self.dead)
+
+
+class OutboxStore:
+    """
+    Очередь исходящих сообщений для повторных попыток и таблица «мертвых» писем
+
+    Сообщения, которые не удалось доставить из-за временной ошибки,
+    ждут здесь следующей попытки; исчерпавшие попытки или отклоненные
+    окончательно переносятся в dead_letters для разбора.
+    """
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.executescript(_OUTBOX_SCHEMA)
+
+    @STORAGE_SECONDS.timed(operation='outbox.due')
+    def due(self, limit: int = 100) -> List[OutboxMessage]:
+        """Сообщения, время повторной попытки которых наступило"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, chat_id, text, fallback_text, label, attempts FROM outbox "
+                "WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+        return [OutboxMessage(*row) for row in rows]
+
+    def batch(self) -> OutboxBatch:
+        """Новый набор изменений для apply()"""
+        return OutboxBatch()
+
+    @STORAGE_SECONDS.timed(operation='outbox.apply')
+    def apply(self, batch: OutboxBatch) -> None:
+        """Записывает накопленные изменения очереди одной транзакцией"""
+        if not len(batch):
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO outbox (chat_id, text, fallback_text, label, attempts, next_attempt_at, last_error, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch.enqueued
+                )
+                self._conn.executemany(
+                    "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?", batch.rescheduled
+                )
+                self._conn.executemany("DELETE FROM outbox WHERE id = ?", ((message_id,) for message_id in batch.deleted))
+                self._conn.executemany(
+                    "INSERT INTO dead_letters (chat_id, text, label, attempts, error, failed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", batch.dead
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @STORAGE_SECONDS.timed(operation='outbox.discard_chats')
+    def discard_chats(self, chat_ids: Iterable[int]) -> int:
+        """Удаляет из очереди сообщения для отключенных чатов"""
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "DELETE FROM outbox WHERE chat_id = ?", ((int(chat_id),) for chat_id in chat_ids)
+            )
+            return self._conn.total_changes - before
+
+    def counts(self) -> Dict[str, int]:
+        """Размер очереди и количество «мертвых» писем"""
+        with self._lock:
+            pending = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            dead = self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        return {'pending': pending, 'dead': dead}
+
+    def close(self) -> None:
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+_store: Optional[SubscriberStore] = None
+_subscribers: Optional[SubscriberCache] = None
+_run_ledger: Optional[RunLedger] = None
+_outbox: Optional[OutboxStore] = None
+_quote_states: Optional[QuoteStateStore] = None
+
+
+def get_store() -> SubscriberStore:
+    """Возвращает общее хранилище, при первом вызове выполняя миграцию из JSON"""
+    global _store
+    if _store is None:
+        _store = SubscriberStore(DB_FILE)
+        _store.migrate_from_json(LEGACY_JSON_FILE)
+    return _store
+
+
+def get_subscribers() -> SubscriberCache:
+    """Возвращает общий кэш подписчиков (загружается один раз)"""
+    global _subscribers
+    if _subscribers is None:
+        _subscribers = SubscriberCache(get_store())
+    return _subscribers
+
+
+def get_run_ledger() -> RunLedger:
+    """Возвращает общий журнал запусков планировщика"""
+    global _run_ledger
+    if _run_ledger is None:
+        _run_ledger = RunLedger(DB_FILE)
+    return _run_ledger
+
+
+def get_outbox() -> OutboxStore:
+    """Возвращает общую очередь повторных отправок"""
+    global _outbox
+    if _outbox is None:
+        _outbox = OutboxStore(DB_FILE)
+    return _outbox
+
+
+def get_quote_states() -> QuoteStateStore:
+    """Возвращает общее хранилище состояния ротации цитат"""
+    global _quote_states
+    if _quote_states is None:
+        _quote_states = QuoteStateStore(DB_FILE)
+    return _quote_states
+
+
+def load_data() -> Dict[str, Any]:
+    """Возвращает данные бота в старом формате (для скриптов проверки)"""
+    try:
+        return {'users': get_subscribers().get_users()}
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке данных: {e}")
+        return {}
+
+
+def save_data(data: Dict[str, Any]) -> None:
+    """Сохраняет данные бота в старом формате (для скриптов проверки)"""
+    try:
+        subscribers = get_subscribers()
+        subscribers.flush()
+        get_store().replace_users(data.get('users', []))
+        subscribers.reload()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении данных: {e}")
@@ -15,11 +15,13 @@ class MockMessage:
     def __init__(self):
         self.text = ""
     
-    async def reply_text(self, text, parse_mode=None):
+    async def reply_text(self, text, parse_mode=None, entities=None):
         print(f"\n{'='*50}")
         print(f"ОТПРАВЛЕНО СООБЩЕНИЕ:")
         print(f"{'='*50}")
         print(text)
+        if entities:
+            print(f"Entities: {[(e.type, e.offset, e.length) for e in entities]}")
         print(f"{'='*50}")
         return True
 
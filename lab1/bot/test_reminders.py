@@ -6,7 +6,8 @@
 
 import asyncio
 import logging
-from bot import send_motivational_quote, remind_meeting_preparation, remind_meeting_start, load_data, save_data
+from bot import send_motivational_quote, remind_meeting_preparation, remind_meeting_start
+from storage import load_data, save_data
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тестовый скрипт для проверки режима вебхука
+Поднимает локальный сервер и отправляет в него обновления как «фейковый Telegram»
+"""
+
+import asyncio
+import logging
+
+from aiohttp.test_utils import TestClient, TestServer
+from telegram.ext import ApplicationBuilder
+
+from webhook import SECRET_HEADER, build_webhook_app
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+
+SECRET = 'test-secret'
+
+FAKE_UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 123456789, 'type': 'private'},
+        'from': {'id': 123456789, 'is_bot': False, 'first_name': 'Test'},
+        'text': '/help',
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}]
+    }
+}
+
+async def test_webhook():
+    """Тестирует прием обновлений, проверку секрета и /health"""
+    print("🤖 Тестирование режима вебхука...")
+    
+    application = ApplicationBuilder().token('123456:TEST').job_queue(None).build()
+    client = TestClient(TestServer(build_webhook_app(application, '/telegram', SECRET)))
+    await client.start_server()
+    
+    try:
+        resp = await client.post('/telegram', json=FAKE_UPDATE, headers={SECRET_HEADER: 'wrong'})
+        print(f"{'✅' if resp.status == 403 else '❌'} Неверный секрет: HTTP {resp.status}")
+        
+        resp = await client.post('/telegram', json=FAKE_UPDATE, headers={SECRET_HEADER: SECRET})
+        queued = application.update_queue.qsize()
+        print(f"{'✅' if resp.status == 200 and queued == 1 else '❌'} Обновление принято: HTTP {resp.status}, в очереди {queued}")
+        
+        resp = await client.post('/telegram', data='not json', headers={SECRET_HEADER: SECRET})
+        print(f"{'✅' if resp.status == 400 else '❌'} Некорректное тело: HTTP {resp.status}")
+        
+        resp = await client.get('/health')
+        print(f"✅ /health: HTTP {resp.status} {await resp.json()}")
+    finally:
+        await client.close()
+    
+    print("🎉 Тестирование завершено!")
+
+if __name__ == "__main__":
+    asyncio.run(test_webhook())
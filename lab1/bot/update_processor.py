@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Обработка обновлений: по порядку внутри чата, параллельно между чатами
+concurrent_updates(True) запускает каждое обновление отдельной задачей без
+ограничений и без порядка: две команды одного пользователя могут выполниться
+наоборот и одновременно менять его подписку. KeyedUpdateProcessor держит для
+каждого чата очередь: пока обрабатывается одно обновление чата, следующие
+ждут в ней и выполняются строго по порядку той же задачей. Разные чаты
+обрабатываются параллельно, но не более max_concurrent_updates сразу
+
+Ожидающие в очереди чата обновления не занимают слот общего лимита, поэтому
+один пользователь, приславший десяток команд, не задерживает остальных
+"""
+
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений разных чатов обрабатывается одновременно по умолчанию
+DEFAULT_MAX_CONCURRENT_UPDATES = 32
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """Ключ очереди: id чата, иначе id пользователя; None — обновление без чата"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return ('user', update.effective_user.id)
+    return None
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработчик обновлений с очередью на каждый чат
+
+    Args:
+        max_concurrent_updates: Сколько чатов обрабатывается одновременно
+    """
+
+    __slots__ = ('_queues',)
+
+    def __init__(self, max_concurrent_updates: int = DEFAULT_MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        # Очереди чатов, которые сейчас обрабатываются; пустые удаляются сразу
+        self._queues: Dict[Hashable, Deque[Awaitable[Any]]] = {}
+
+    @property
+    def active_chats(self) -> int:
+        """Сколько чатов обрабатывается прямо сейчас"""
+        return len(self._queues)
+
+    @property
+    def queued_updates(self) -> int:
+        """Сколько обновлений ждут, пока освободится их чат"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = update_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # Чат уже обрабатывается: его задача выполнит обновление после текущих,
+            # а слот общего лимита освобождается сразу
+            queue.append(coroutine)
+            return
+
+        self._queues[key] = queue = deque()
+        try:
+            await self._run(coroutine)
+            while queue:
+                await self._run(queue.popleft())
+        finally:
+            del self._queues[key]
+            # Задачу отменили посреди очереди: закрываем оставшиеся корутины,
+            # чтобы не получить "coroutine was never awaited"
+            while queue:
+                queue.popleft().close()
+
+    @staticmethod
+    async def _run(coroutine: Awaitable[Any]) -> None:
+        # Ошибки обработчиков Application разбирает сам; сюда доходят только
+        # сбои вне обработчиков — из-за них не должны теряться следующие обновления чата
+        try:
+            await coroutine
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления: {e}", exc_info=True)
+
+    async def initialize(self) -> None:
+        """Ничего не делает"""
+
+    async def shutdown(self) -> None:
+        """Ничего не делает: Application.stop() дожидается задач, разбирающих очереди"""
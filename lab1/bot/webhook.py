@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Режим вебхука для Telegram-бота
+Локальный aiohttp-сервер принимает обновления от Telegram, проверяет
+секретный токен и отдает /health для балансировщика
+"""
+
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает secret_token из setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+DEFAULT_PATH = '/telegram'
+HEALTH_PATH = '/health'
+
+
+def build_webhook_app(application: Application, path: str = DEFAULT_PATH,
+                      secret_token: Optional[str] = None) -> web.Application:
+    """
+    Создает aiohttp-приложение, передающее обновления в application.update_queue
+
+    Args:
+        application: Приложение python-telegram-bot
+        path: Путь, на который Telegram присылает обновления
+        secret_token: Ожидаемое значение заголовка X-Telegram-Bot-Api-Secret-Token
+
+    Returns:
+        web.Application: Приложение с маршрутами вебхука и /health
+    """
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret_token):
+            logger.warning(f"Отклонен запрос к вебхуку с неверным секретом от {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, application.bot)
+        except Exception as e:
+            logger.error(f"Некорректное обновление в вебхуке: {e}")
+            return web.Response(status=400)
+
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(request: web.Request) -> web.Response:
+        status = 200 if application.running else 503
+        return web.json_response({'status': 'ok' if application.running else 'starting'}, status=status)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get(HEALTH_PATH, handle_health)
+    return app
+
+
+async def serve_webhook(application: Application, webhook_url: str, listen: str = '0.0.0.0',
+                        port: int = 8080, path: str = DEFAULT_PATH, secret_token: Optional[str] = None,
+                        drop_pending_updates: bool = False) -> None:
+    """Запускает бота в режиме вебхука до получения SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl+C через KeyboardInterrupt
+            pass
+
+    runner = web.AppRunner(build_webhook_app(application, path, secret_token))
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+
+        await application.bot.set_webhook(
+            url=webhook_url.rstrip('/') + path,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=drop_pending_updates
+        )
+        await application.start()
+
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        logger.info(f"Вебхук слушает {listen}:{port}{path}, health: {HEALTH_PATH}")
+
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application: Application, webhook_url: str, **kwargs) -> None:
+    """Блокирующий запуск вебхука (аналог application.run_polling)"""
+    try:
+        asyncio.run(serve_webhook(application, webhook_url, **kwargs))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,145 @@
+"""
+Контроль нагрузки
+=================
+У каждой команды есть стоимость: /news ходит в NewsAPI и стоит дороже, /help —
+единица. Одновременно выполняются команды общей стоимостью не больше capacity;
+последние light_reserve единиц дорогим командам недоступны, поэтому дешёвые
+отвечают быстро, пока идут тяжёлые. Если места нет, команда ждёт в короткой
+очереди (не больше max_waiting команд, дорогих — не больше половины, и не
+дольше max_wait секунд), иначе вместо неё вызывается ответ «бот занят».
+
+Освободившееся место отдаётся первой ожидающей команде, которая в него
+помещается: дешёвые команды не стоят в очереди за дорогими.
+capacity + max_waiting стоит держать меньше MAX_CONCURRENT_UPDATES
+(update_processor.py), чтобы ожидающие команды не заняли все слоты обработки.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+DEFAULT_CAPACITY = 16
+DEFAULT_MAX_WAITING = 8
+DEFAULT_MAX_WAIT = 5.0      # секунды
+DEFAULT_COST = 1            # стоимость команды, которой нет в таблице
+REJECT_LOG_INTERVAL = 10.0  # сводка об отказах в лог не чаще, секунды
+
+# Причины отказа (метка reason в метриках)
+QUEUE_FULL = "queue_full"
+TIMEOUT = "timeout"
+
+
+class AdmissionController:
+    """Взвешенный ограничитель одновременных команд с короткой очередью."""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, max_waiting: int = DEFAULT_MAX_WAITING,
+                 max_wait: float = DEFAULT_MAX_WAIT, costs: dict[str, int] | None = None,
+                 light_reserve: int | None = None) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.costs = dict(costs or {})
+        # по умолчанию дешёвым командам оставлена четверть ёмкости
+        self.light_reserve = min(capacity - 1, capacity // 4 if light_reserve is None else light_reserve)
+        self.in_use = 0
+        self._waiters: deque[tuple[int, asyncio.Future]] = deque()
+        self._rejected_since_log = 0
+        self._last_reject_log = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def cost(self, command: str) -> int:
+        """Стоимость команды; дорогая не может стоить больше доступной ей ёмкости."""
+        cost = self.costs.get(command, DEFAULT_COST)
+        if cost <= DEFAULT_COST:
+            return max(cost, 1)
+        return min(cost, self.capacity - self.light_reserve)
+
+    def _fits(self, cost: int) -> bool:
+        limit = self.capacity if cost <= DEFAULT_COST else self.capacity - self.light_reserve
+        return self.in_use + cost <= limit
+
+    def _queue_limit(self, cost: int) -> int:
+        return self.max_waiting if cost <= DEFAULT_COST else self.max_waiting // 2
+
+    async def acquire(self, command: str) -> str | None:
+        """Занимает место под команду: None — можно выполнять (затем release()), иначе причина отказа."""
+        cost = self.cost(command)
+        # не обгоняем ожидающих той же или меньшей стоимости
+        if self._fits(cost) and not any(waiting_cost <= cost for waiting_cost, _ in self._waiters):
+            self.in_use += cost
+            return None
+        if len(self._waiters) >= self._queue_limit(cost):
+            return QUEUE_FULL
+
+        entry = (cost, asyncio.get_running_loop().create_future())
+        self._waiters.append(entry)
+        try:
+            done, _ = await asyncio.wait((entry[1],), timeout=self.max_wait)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        if not done:
+            self._abandon(entry)
+            return TIMEOUT
+        return None
+
+    def release(self, command: str) -> None:
+        self.in_use -= self.cost(command)
+        self._wake()
+
+    def _abandon(self, entry: tuple[int, asyncio.Future]) -> None:
+        cost, waiter = entry
+        if waiter.done():   # место выдали одновременно с отменой — возвращаем
+            self.in_use -= cost
+        else:
+            self._waiters.remove(entry)
+            waiter.cancel()
+        self._wake()
+
+    def _wake(self) -> None:
+        for entry in list(self._waiters):
+            cost, waiter = entry
+            if self._fits(cost):
+                self._waiters.remove(entry)
+                self.in_use += cost
+                waiter.set_result(None)
+
+    def _log_reject(self, command: str, reason: str) -> None:
+        # при перегрузке отказов тысячи: в лог — сводка раз в REJECT_LOG_INTERVAL, точные числа — в метриках
+        self._rejected_since_log += 1
+        now = time.monotonic()
+        if now - self._last_reject_log < REJECT_LOG_INTERVAL:
+            return
+        logging.warning("Overloaded: %d commands rejected, last /%s (%s); %d of %d in use, %d waiting",
+                        self._rejected_since_log, command, reason, self.in_use, self.capacity, self.waiting)
+        self._rejected_since_log = 0
+        self._last_reject_log = now
+
+    def guard(self, command: str, handler: Callable[..., Awaitable],
+              on_reject: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        """Обработчик выполняется, только если нашлось место; иначе вызывается on_reject(update, context)."""
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            reason = await self.acquire(command)
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, command=command)
+            if reason is not None:
+                ADMISSION_REJECTED.inc(command=command, reason=reason)
+                self._log_reject(command, reason)
+                await on_reject(update, context)
+                return
+            try:
+                await handler(update, context)
+            finally:
+                self.release(command)
+        return wrapper
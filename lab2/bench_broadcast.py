@@ -0,0 +1,258 @@
+"""
+Бенчмарк рассылок и команд
+==========================
+Бот собирается через build_application() и ходит по HTTP в локальный
+фейковый Bot API (fake_telegram.py) с настраиваемой задержкой и ошибками.
+Каждый размер базы подписчиков прогоняется в отдельном процессе со своей
+временной базой (BOT_DB_PATH), поэтому пик памяти честный:
+
+    рассылки   daily_quote_job, prep_reminder_job, meet_reminder_job:
+               время, запросов sendMessage в секунду, доставлено
+    команды    /start, /about, /contacts, /help, /rate через Application.process_update:
+               задержка p50/p99
+    память     пиковый RSS процесса и прирост за прогон
+
+По умолчанию пауза между пачками рассылки (BATCH_INTERVAL) отключена, чтобы
+мерить собственные накладные расходы бота; --real-limits оставляет её.
+Результат сохраняется в JSON; --compare сравнивает с прошлым и возвращает
+код 1, если что-то ухудшилось больше чем на --tolerance.
+
+    python bench_broadcast.py --sizes 1000,10000 --latency-ms 20 --flood-rate 0.01 \\
+        --output results.json --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Any
+
+from fake_telegram import FakeApiConfig, FakeTelegramServer, fetch_stats, reset_stats
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_TOKEN = "123456:benchmark"
+
+JOBS = ("daily_quote_job", "prep_reminder_job", "meet_reminder_job")
+COMMANDS = ("/start", "/about", "/contacts", "/help", "/rate")
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def command_update(update_id: int, chat_id: int, command: str) -> dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+async def run_scenario(size: int, root_url: str, commands: int, real_limits: bool) -> dict[str, Any]:
+    """Прогон в дочернем процессе (переменные окружения уже выставлены)."""
+    sys.path.insert(0, BOT_DIR)
+    import bot
+    import broadcast
+    from telegram import Update
+    from telegram.ext import CallbackContext
+
+    if not real_limits:
+        broadcast.BATCH_INTERVAL = 0.0
+
+    rss_before = peak_rss_mb()
+    application = bot.build_application()
+    for chat_id in range(1, size + 1):
+        bot.SUBSCRIPTIONS.add(chat_id)
+    await application.initialize()
+    context = CallbackContext(application)
+
+    jobs = {}
+    for name in JOBS:
+        reset_stats(root_url)
+        started = time.perf_counter()
+        await getattr(bot, name)(context)
+        seconds = time.perf_counter() - started
+        stats = fetch_stats(root_url)
+        requests = stats.get("method:sendMessage", 0)
+        jobs[name] = {
+            "seconds": round(seconds, 3),
+            "requests": requests,
+            "delivered": stats.get("status:200", 0),
+            "per_second": round(requests / seconds, 1) if seconds else 0.0,
+        }
+
+    latencies = []
+    for index in range(commands):
+        update = Update.de_json(
+            command_update(index + 1, index % size + 1, COMMANDS[index % len(COMMANDS)]),
+            application.bot,
+        )
+        started = time.perf_counter()
+        await application.process_update(update)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    await application.shutdown()
+    peak = peak_rss_mb()
+    return {
+        "subscribers": size,
+        "broadcasts": jobs,
+        "commands": {
+            "count": len(latencies),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "max_ms": round(max(latencies), 2) if latencies else 0.0,
+        },
+        "memory": {
+            "peak_rss_mb": round(peak, 1),
+            "rss_growth_mb": round(peak - rss_before, 1),
+        },
+    }
+
+
+def run_size(size: int, server: FakeTelegramServer, args: argparse.Namespace) -> dict[str, Any]:
+    """Запускает прогон для size подписчиков в новом процессе."""
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--size", str(size),
+               "--root-url", server.root_url, "--commands", str(args.commands)]
+    if args.real_limits:
+        command.append("--real-limits")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ)
+        env.update({
+            "BOT_TOKEN": BENCH_TOKEN,
+            "TELEGRAM_API_URL": server.base_url,
+            "BOT_DB_PATH": os.path.join(workdir, "bench_state.db"),
+            "NEWSAPI_KEY": "",
+        })
+        env.pop("WEBHOOK_URL", None)
+        completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr[-4000:])
+        raise RuntimeError(f"Прогон для {size} подписчиков завершился с кодом {completed.returncode}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> int:
+    """Печатает изменения относительно baseline; 1, если есть ухудшения больше tolerance."""
+    previous = {result["subscribers"]: result for result in baseline.get("results", [])}
+    regressions = 0
+
+    def report(label: str, old: float, new: float, higher_is_better: bool) -> None:
+        nonlocal regressions
+        if not old:
+            return
+        change = new / old - 1
+        worse = -change if higher_is_better else change
+        mark = ""
+        if worse > tolerance:
+            regressions += 1
+            mark = "  <-- ухудшение"
+        print(f"  {label:<44} {old:>10.1f} -> {new:>10.1f} ({change:+.1%}){mark}")
+
+    print(f"Сравнение с прошлым результатом (допуск {tolerance:.0%}):")
+    for result in current["results"]:
+        old = previous.get(result["subscribers"])
+        if old is None:
+            continue
+        size = result["subscribers"]
+        for name, stats in result["broadcasts"].items():
+            if name in old["broadcasts"]:
+                report(f"{size}: {name}, сообщ/с", old["broadcasts"][name]["per_second"],
+                       stats["per_second"], higher_is_better=True)
+        report(f"{size}: команды p99, мс", old["commands"]["p99_ms"], result["commands"]["p99_ms"],
+               higher_is_better=False)
+        report(f"{size}: пиковый RSS, МБ", old["memory"]["peak_rss_mb"], result["memory"]["peak_rss_mb"],
+               higher_is_better=False)
+    return 1 if regressions else 0
+
+
+def print_summary(report: dict[str, Any]) -> None:
+    for result in report["results"]:
+        print(f"{result['subscribers']} подписчиков:")
+        for name, stats in result["broadcasts"].items():
+            print(f"  {name:<20} {stats['per_second']:>9.1f} сообщ/с  {stats['seconds']:>8.2f} с  "
+                  f"доставлено {stats['delivered']}/{stats['requests']}")
+        commands = result["commands"]
+        print(f"  команды ({commands['count']}): p50 {commands['p50_ms']} мс, p99 {commands['p99_ms']} мс")
+        print(f"  память: пик {result['memory']['peak_rss_mb']} МБ, прирост {result['memory']['rss_growth_mb']} МБ")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк рассылок и команд на фейковом Telegram API")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="размеры базы подписчиков через запятую")
+    parser.add_argument("--commands", type=int, default=400, help="сколько команд прогнать для замера задержки")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка ответа API, мс")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--blocked-rate", type=float, default=0.0, help="доля ответов 403 (бот заблокирован)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 502")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real-limits", action="store_true", help="не отключать паузу между пачками рассылки")
+    parser.add_argument("--output", default="bench_results.json", help="куда сохранить JSON с результатами")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение при сравнении (доля)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--root-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_scenario(args.size, args.root_url, args.commands, args.real_limits))))
+        return 0
+
+    config = FakeApiConfig(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        flood_rate=args.flood_rate,
+        retry_after=args.retry_after,
+        blocked_rate=args.blocked_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    with FakeTelegramServer(config) as server:
+        results = [run_size(size, server, args) for size in sizes]
+
+    report = {
+        "lab": "lab2",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "config": {**asdict(config), "real_limits": args.real_limits, "commands": args.commands},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_summary(report)
+    print(f"Результаты сохранены в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            return compare(report, json.load(f), args.tolerance)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
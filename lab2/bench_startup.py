@@ -0,0 +1,99 @@
+"""
+Замер холодного старта
+======================
+Каждый прогон — новый интерпретатор во временной папке с пустой базой
+(BOT_DB_PATH), так что прошлые прогоны на результат не влияют. Сеть не
+используется: приложение собирается через build_application(), но не запускается.
+
+Этапы:
+    storage  импорт storage.py
+    bot      импорт модуля бота (конфигурация, готовые ответы)
+    build    build_application(): хранилище, состояние, приложение, обработчики
+    total    от запуска процесса до готового приложения, включая старт Python
+
+Запуск:
+    python bench_startup.py [--runs 10] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+PHASES = ("storage", "bot", "build", "total")
+
+# Выполняется в дочернем процессе и печатает длительности этапов в мс
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {bot_dir!r})
+t0 = time.perf_counter()
+import storage
+t1 = time.perf_counter()
+import bot
+t2 = time.perf_counter()
+bot.build_application()
+t3 = time.perf_counter()
+print(json.dumps({{"storage": (t1 - t0) * 1000, "bot": (t2 - t1) * 1000, "build": (t3 - t2) * 1000}}))
+"""
+
+
+def run_once(workdir: str) -> dict[str, float]:
+    """Один прогон в новом процессе."""
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "123456:benchmark")
+    env["BOT_DB_PATH"] = os.path.join(workdir, "bench_state.db")
+    env.pop("WEBHOOK_URL", None)
+
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(bot_dir=BOT_DIR)],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    )
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    timings["total"] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+def summarize(runs: list[dict[str, float]]) -> dict[str, dict[str, float]]:
+    """Медиана, минимум и максимум по каждому этапу."""
+    return {
+        phase: {
+            "median_ms": round(statistics.median(run[phase] for run in runs), 1),
+            "min_ms": round(min(run[phase] for run in runs), 1),
+            "max_ms": round(max(run[phase] for run in runs), 1),
+        }
+        for phase in PHASES
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер холодного старта бота")
+    parser.add_argument("--runs", type=int, default=10, help="количество прогонов")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run_once(workdir)   # прогрев __pycache__ и файлового кэша, не учитывается
+        runs = [run_once(workdir) for _ in range(args.runs)]
+
+    summary = summarize(runs)
+    python = sys.version.split()[0]
+    if args.json:
+        print(json.dumps({"runs": args.runs, "python": python, "phases": summary}, indent=2))
+        return 0
+
+    print(f"Холодный старт, {args.runs} прогонов (Python {python}):")
+    for phase in PHASES:
+        stats = summary[phase]
+        print(f"  {phase:<8} медиана {stats['median_ms']:7.1f} мс   "
+              f"мин {stats['min_ms']:7.1f}   макс {stats['max_ms']:7.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,30 +13,74 @@ Commitly Helper Bot
 - Каждый четверг в 18:50 — напоминание о встрече
 - Ежедневно в 19:00 — мотивационная цитата
 
+На каждое событие заводится одно задание JobQueue, которое рассылает сообщение
+всем чатам из реестра подписок (subscriptions.py) пачками (broadcast.py).
+Чаты, заблокировавшие бота, помечаются неактивными и выпадают из рассылок;
+сообщения, не доставленные из-за временных ошибок, повторяются из очереди
+в SQLite с растущей задержкой.
+
 Часы берутся из переменной окружения BOT_TIMEZONE (по умолчанию Europe/Moscow).
+Подписки и регионы сохраняются в SQLite (storage.py, путь — BOT_DB_PATH)
+и восстанавливаются при старте.
+
+Быстрый старт: telegram.ext (с JobQueue и APScheduler) импортируется только
+в build_application(), вебхук (aiohttp) — только в режиме вебхука. Сам telegram
+(и с ним httpx) загружается при импорте модуля: его типы нужны здесь,
+в responses.py и broadcast.py. Список
+команд в меню Telegram отправляется заданием JobQueue уже после запуска,
+не задерживая первый запрос обновлений. Замер — bench_startup.py.
+
+Метрики Prometheus (metrics.py): время команд, рассылки, опоздание заданий
+JobQueue и операции с SQLite. Если задан METRICS_PORT, они отдаются на
+http://METRICS_HOST:METRICS_PORT/metrics (по умолчанию только 127.0.0.1).
+
+LOOP_WATCHDOG=1 включает сторожа event loop (loop_watchdog.py): блокировки
+дольше LOOP_WATCHDOG_THRESHOLD пишутся в лог со стеком, сводка — командой
+/loopstats для пользователей из ADMIN_IDS.
+
+Логи пишет фоновый поток (logging_setup.py: LOG_LEVEL, LOG_FORMAT=json,
+LOG_SAMPLE_RATE); рассылки и проходы очереди повторов логируют одну сводку
+по исходам, а не строку на каждого получателя.
+
+Обновления разных чатов обрабатываются параллельно (до MAX_CONCURRENT_UPDATES
+чатов сразу), обновления одного чата — строго по порядку (update_processor.py).
+Перед командами стоит контроль нагрузки (admission.py): у /news стоимость выше,
+чем у остальных команд; при перегрузке бот отвечает, что занят, а не копит задачи.
 """
 
+from __future__ import annotations
+
 import asyncio
+import html
 import logging
 import os
-import random
+from collections.abc import Sequence
 from datetime import time
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.constants import ParseMode
-from telegram.ext import (
-    Application,
-    ApplicationBuilder,
-    CommandHandler,
-    ContextTypes,
-    Defaults,
-    CallbackQueryHandler,
+
+from broadcast import BLOCKED, MAX_ATTEMPTS, RETRY, SENT, retry_delay, send_batched, send_one
+from logging_setup import SendLog, setup_logging
+from storage import ChatStore, OutboxChanges
+from subscriptions import SubscriptionRegistry
+from quotes import QuoteRotation, load_quotes
+from quote_corpus import QuoteCorpus, is_corpus_file
+from responses import prerender_html, reply_static
+from metrics import (
+    ADMISSION_IN_USE, ADMISSION_WAITING, SUBSCRIBERS, UPDATES_ACTIVE_CHATS, UPDATES_QUEUED, instrument_handler,
+    record_broadcast, watch_job_queue,
 )
+from admission import AdmissionController
 
-# NewsAPI client
-# Документация: https://newsapi.org/docs/client-libraries/python
-from newsapi import NewsApiClient
+# Асинхронный клиент NewsAPI (httpx, общий пул соединений)
+from news_client import NewsClient
+from news_cache import TTLCache, news_cache_key
+
+if TYPE_CHECKING:
+    from telegram.ext import Application, ContextTypes
 
 # Для таймзоны используем zoneinfo из стандартной библиотеки (Python 3.9+).
 # На некоторых системах может понадобиться пакет tzdata (добавлен в requirements.txt).
@@ -54,9 +98,87 @@ load_dotenv()  # Загружаем .env (если есть)
 BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 NEWSAPI_KEY = os.getenv("NEWSAPI_KEY", "").strip()
 BOT_TIMEZONE = os.getenv("BOT_TIMEZONE", "Europe/Moscow").strip()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()       # пусто => run_polling
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip() or None
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram").strip()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip()
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+BOT_DB_PATH = os.getenv("BOT_DB_PATH", "bot_state.db").strip()
+# Свой сервер telegram-bot-api или фейковый API бенчмарка (fake_telegram.py); пусто => api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))        # 0 => /metrics выключен
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "0").strip() == "1"     # сторож event loop (loop_watchdog.py)
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv("LOOP_WATCHDOG_THRESHOLD", "0.25"))   # секунды
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(",", " ").split()}   # служебные команды
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))   # чатов одновременно (update_processor.py)
+# Контроль нагрузки (admission.py): ёмкость, очередь и ожидание; остальным — ответ «бот занят»
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "16"))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", "8"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))   # секунды
+COMMAND_COSTS = {"news": 4}   # запрос в NewsAPI; остальные команды стоят 1
+STORE: ChatStore | None = None               # открывается в main()
+NEWS_CLIENT: NewsClient | None = None        # создаётся в main(), если задан NEWSAPI_KEY
 REGION_PREFS: dict[int, str] = {}            # chat_id -> "ru" | "us" | "eu"
+SUBSCRIPTIONS = SubscriptionRegistry()       # чаты, подписанные через /start
 DEFAULT_REGION = os.getenv("DEFAULT_REGION", "ru")
 RATE_URL = "https://forms.gle/GFWv2BbVZTsMikAd7"
+DEFAULT_NEWS_TOPIC = "software development OR developer training OR programming education"
+NEWS_REGIONS = ("ru", "us", "eu")
+# Интервал фоновой подгрузки новостей по умолчанию (секунды). Одно обновление — до 5 запросов
+# к NewsAPI (по 2 на ru/us и 1 на eu), учитывайте квоту тарифа.
+NEWS_PREFETCH_INTERVAL = float(os.getenv("NEWS_PREFETCH_INTERVAL", "3600"))
+NEWS_DIGESTS: dict[str, str] = {}            # region -> готовый HTML новости по теме по умолчанию
+# Как часто проверять очередь повторных отправок (секунды)
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "30"))
+QUOTES_FILE = os.getenv("QUOTES_FILE", "").strip()   # текст или корпус (quote_corpus.py); пусто => QUOTES ниже
+QUOTES_TAG = os.getenv("QUOTES_TAG", "").strip() or None            # фильтры корпуса
+QUOTES_LANGUAGE = os.getenv("QUOTES_LANGUAGE", "").strip() or None
+QUOTE_ROTATION: QuoteRotation | None = None  # создаётся в load_state()
+NEWS_CACHE = TTLCache(
+    maxsize=int(os.getenv("NEWS_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("NEWS_CACHE_TTL", "600")),   # секунды
+    negative_ttl=float(os.getenv("NEWS_CACHE_NEGATIVE_TTL", "60")),   # «новостей нет» — секунды
+)
+
+
+def load_state(store: ChatStore) -> None:
+    """Восстанавливает подписки, регионы и ротацию цитат из хранилища (один запрос на таблицу)."""
+    global QUOTE_ROTATION
+    for chat_id in store.load_subscriptions():
+        SUBSCRIPTIONS.add(chat_id)
+    REGION_PREFS.update(store.load_regions())
+    QUOTE_ROTATION = QuoteRotation(load_quote_list(), store.load_quote_states())
+    logging.info("Restored %d subscriptions and %d region prefs", len(SUBSCRIPTIONS), len(REGION_PREFS))
+
+
+def load_quote_list() -> Sequence[str]:
+    """Цитаты из QUOTES_FILE (корпус открывается через mmap и фильтруется), иначе встроенный QUOTES."""
+    if not QUOTES_FILE:
+        return QUOTES
+    try:
+        if is_corpus_file(QUOTES_FILE):
+            quotes = QuoteCorpus(QUOTES_FILE).select(tag=QUOTES_TAG, language=QUOTES_LANGUAGE)
+        else:
+            quotes = load_quotes(QUOTES_FILE)
+    except (OSError, ValueError) as e:
+        logging.error("Failed to read %s: %s", QUOTES_FILE, e)
+        return QUOTES
+    if not quotes:
+        logging.warning("No matching quotes in %s, using built-in list", QUOTES_FILE)
+        return QUOTES
+    logging.info("Loaded %d quotes from %s", len(quotes), QUOTES_FILE)
+    return quotes
+
+
+async def persist(method: str, *args) -> None:
+    """Вызывает метод ChatStore вне event loop; ошибки только логируются."""
+    if STORE is None:
+        return
+    try:
+        await asyncio.to_thread(getattr(STORE, method), *args)
+    except Exception as e:
+        logging.exception("Failed to persist %s%s: %s", method, args, e)
 
 
 def get_region(chat_id: int) -> str:
@@ -125,18 +247,6 @@ def get_tz():
         return ZoneInfo("Europe/Moscow")  # простой запасной вариант
 
 
-def job_name(prefix: str, chat_id: int) -> str:
-    """Уникальное имя задания JobQueue для конкретного чата."""
-    return f"{prefix}_{chat_id}"
-
-
-async def send_safe_text(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, parse_mode: ParseMode | None = ParseMode.HTML) -> None:
-    """Безопасная отправка сообщения c лаконичной обработкой ошибок."""
-    try:
-        await context.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
-    except Exception as e:  # простой перехват, чтобы бот не падал
-        logging.exception("Failed to send message: %s", e)
-
 # --- описания для /help ---
 def desc_about() -> str:
     return "ℹ️ /about — что такое Commitly и как это работает."
@@ -164,23 +274,38 @@ def desc_rate() -> str:
     return "📝 /rate — оценить работу бота и оставить отзыв."
 
 
+# --- готовые ответы (разбираются один раз при импорте) ---
+HELP_REPLY = prerender_html("\n\n".join([
+    "🤖 Привет! Вот что я умею:",
+    desc_about(),
+    desc_contacts(),
+    desc_news(),
+    desc_region(),
+    desc_start(),
+    desc_rate(),
+    desc_help(),
+]))
+ABOUT_REPLY = prerender_html(ABOUT_TEXT_HTML)
+CONTACTS_REPLY = prerender_html(CONTACTS_HTML)
+RATE_REPLY = prerender_html(f"📝 Пожалуйста, оцените работу бота и оставьте отзыв:\n{html.escape(RATE_URL)}")
+BUSY_TEXT = "⏳ Сейчас бот перегружен запросами. Пожалуйста, повторите через минуту."
+
+
 # --------------------------
 # Команды
 # --------------------------
 
+async def busy_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ответ на команду или нажатие кнопки, отклонённые контролем нагрузки."""
+    if update.callback_query is not None:
+        await update.callback_query.answer(BUSY_TEXT)
+    elif update.message is not None:
+        await update.message.reply_text(BUSY_TEXT, parse_mode=None)
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        text = "\n\n".join([
-            "🤖 Привет! Вот что я умею:",
-            desc_about(),
-            desc_contacts(),
-            desc_news(),
-            desc_region(),
-            desc_start(),
-            desc_rate(),
-            desc_help(),
-        ])
-        await update.message.reply_text(text)
+        await reply_static(update.message, HELP_REPLY)
     except Exception as e:
         logging.exception("help failed: %s", e)
         await update.message.reply_text("Не удалось показать помощь.")
@@ -188,9 +313,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 async def rate_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        await update.message.reply_text(
-            f"📝 Пожалуйста, оцените работу бота и оставьте отзыв:\n{RATE_URL}"
-        )
+        await reply_static(update.message, RATE_REPLY)
     except Exception as e:
         logging.exception("rate failed: %s", e)
         await update.message.reply_text("Не удалось отправить ссылку на форму.")
@@ -207,36 +330,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
 
-        tz = get_tz()
-
-        for name in (
-            job_name("daily_quote", chat_id),
-            job_name("prep_reminder", chat_id),
-            job_name("meet_reminder", chat_id),
-        ):
-            for job in jq.get_jobs_by_name(name):
-                job.schedule_removal()
-
-        jq.run_daily(
-            callback=daily_quote_job,
-            time=time(hour=19, minute=0, tzinfo=tz),
-            name=job_name("daily_quote", chat_id),
-            data={"chat_id": chat_id},
-        )
-        jq.run_daily(
-            callback=prep_reminder_job,
-            time=time(hour=18, minute=50, tzinfo=tz),
-            days=(1,),
-            name=job_name("prep_reminder", chat_id),
-            data={"chat_id": chat_id},
-        )
-        jq.run_daily(
-            callback=meet_reminder_job,
-            time=time(hour=18, minute=50, tzinfo=tz),
-            days=(3,),
-            name=job_name("meet_reminder", chat_id),
-            data={"chat_id": chat_id},
-        )
+        if SUBSCRIPTIONS.add(chat_id):
+            await persist("add_subscription", chat_id)
 
         schedule_info = (
             f"✅ Подписал этот чат на напоминания и ежедневные цитаты.\n\n"
@@ -262,6 +357,7 @@ async def set_region(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                 await update.message.reply_text("❌ Недопустимый регион. Доступно: ru, us, eu.")
                 return
             REGION_PREFS[chat_id] = region
+            await persist("set_region", chat_id, region)
             await update.message.reply_text(f"✅ Регион сохранён: {region.upper()} — новости будут подбираться под него.")
             return
 
@@ -290,6 +386,7 @@ async def region_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
         chat_id = query.message.chat_id
         REGION_PREFS[chat_id] = region
+        await persist("set_region", chat_id, region)
         await query.edit_message_text(f"✅ Регион сохранён: {region.upper()} — новости будут подбираться под него.")
     except Exception as e:
         logging.exception("region_callback failed: %s", e)
@@ -299,7 +396,7 @@ async def region_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def about(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """/about — описание проекта."""
     try:
-        await update.message.reply_html(ABOUT_TEXT_HTML)
+        await reply_static(update.message, ABOUT_REPLY)
     except Exception as e:
         logging.exception("about failed: %s", e)
         await update.message.reply_text("Не удалось показать описание. Попробуйте позже.")
@@ -308,7 +405,7 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def contacts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """/contacts — контакты коллег."""
     try:
-        await update.message.reply_html(CONTACTS_HTML)
+        await reply_static(update.message, CONTACTS_REPLY)
     except Exception as e:
         logging.exception("contacts failed: %s", e)
         await update.message.reply_text("Не удалось показать контакты. Попробуйте позже.")
@@ -335,76 +432,137 @@ def _pick_first_paragraph(article: dict) -> tuple[str, str]:
     return title, text
 
 
+def render_article(article: dict) -> str:
+    """HTML-сообщение с новостью: жирный заголовок, первый абзац и ссылка."""
+    title, first_para = _pick_first_paragraph(article)
+
+    # Форматируем через HTML (только <b> и переносы строк), чтобы избежать проблем MarkdownV2
+    title_html = html.escape(title) if title else "Без заголовка"
+    first_para_html = html.escape(first_para)
+    url = article.get("url") or ""
+
+    formatted = f"<b>{title_html}</b>\n\n{first_para_html}"
+    if url:
+        formatted += f"\n\n{url}"  # Telegram сам сделает ссылку кликабельной
+    return formatted
+
+
+async def find_article(topic: str, language: str, country: str | None) -> dict | None:
+    """Первая новость по теме: top-headlines страны, иначе everything.
+
+    Для регионов со страной оба запроса идут параллельно, чтобы фолбэк
+    не добавлял второй полный round-trip к времени ответа.
+    """
+    if country:
+        top, everything = await asyncio.gather(
+            NEWS_CLIENT.top_headlines(q=topic, country=country, page_size=10),
+            NEWS_CLIENT.everything(q=topic, language=language, sort_by="publishedAt", page_size=10),
+            return_exceptions=True,
+        )
+        if isinstance(top, list) and top:
+            return top[0]
+    else:
+        everything = await NEWS_CLIENT.everything(q=topic, language=language, sort_by="publishedAt", page_size=10)
+
+    if isinstance(everything, BaseException):
+        raise everything
+    return everything[0] if everything else None
+
+
 async def news(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        if not NEWSAPI_KEY:
+        if NEWS_CLIENT is None:
             await update.message.reply_text("🔑 NEWSAPI_KEY не задан. Добавьте ключ в .env.")
             return
 
-        client = NewsApiClient(api_key=NEWSAPI_KEY)
-
         chat_id = update.effective_chat.id
         region = get_region(chat_id)
         language, country = region_to_params(region)
 
         topic = " ".join(context.args).strip() if context.args else ""
         if not topic:
-            topic = "software development OR developer training OR programming education"
-
-        article = None
-
-        if country:
-            try:
-                resp = client.get_top_headlines(q=topic, country=country, page_size=10)
-                articles = resp.get("articles", []) if isinstance(resp, dict) else []
-                if articles:
-                    article = articles[0]
-            except Exception:
-                pass
-
-        if article is None:
-            resp = client.get_everything(
-                q=topic,
-                language=language,
-                sort_by="publishedAt",
-                page_size=10,
-            )
-            articles = resp.get("articles", []) if isinstance(resp, dict) else []
-            if articles:
-                article = articles[0]
+            # Новость по теме по умолчанию заранее подготовлена фоновым заданием
+            digest = NEWS_DIGESTS.get(region)
+            if digest:
+                await update.message.reply_text(digest, parse_mode=ParseMode.HTML)
+                return
+            topic = DEFAULT_NEWS_TOPIC
+
+        article = await NEWS_CACHE.get_or_fetch(
+            news_cache_key(topic, language, country),
+            lambda: find_article(topic, language, country),
+        )
+        logging.debug("news cache: %s", NEWS_CACHE.stats())
 
         if not article:
             await update.message.reply_text("😕 Новости не найдены. Попробуйте другую тему или регион (/region).")
             return
 
-        title, first_para = _pick_first_paragraph(article)
-
-        # Форматируем через HTML (только <b> и переносы строк), чтобы избежать проблем MarkdownV2
-        import html as _html
-        title_html = _html.escape(title) if title else "Без заголовка"
-        first_para_html = _html.escape(first_para)
-        url = article.get("url") or ""
-
-        formatted = f"<b>{title_html}</b>\n\n{first_para_html}"
-        if url:
-            formatted += f"\n\n{url}"  # Telegram сам сделает ссылку кликабельной
-
+        formatted = render_article(article)
         await update.message.reply_text(formatted, parse_mode=ParseMode.HTML)
     except Exception as e:
         logging.exception("news failed: %s", e)
         await update.message.reply_text("Ошибка при получении новостей. Попробуйте позже.")
 
 
+async def loop_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/loopstats — задержки и блокировки event loop; отвечает только пользователям из ADMIN_IDS."""
+    if update.effective_user is None or update.effective_user.id not in ADMIN_IDS:
+        return
+    watchdog = context.application.bot_data.get("loop_watchdog")
+    if watchdog is None:
+        text = "Сторож event loop выключен. Включите его переменной LOOP_WATCHDOG=1"
+    else:
+        text = watchdog.format_stats()
+    # В именах кадров стека бывают <lambda> и <module> — без HTML-разметки
+    await update.message.reply_text(text, parse_mode=None)
+
+
 # --------------------------
 # Задания JobQueue (напоминания и дайджест)
 # --------------------------
 
+async def prune_blocked(chat_ids: list[int], label: str) -> int:
+    """Исключает из рассылок чаты, где бот заблокирован или удалён (одной записью в базу)."""
+    blocked = set(chat_ids)
+    if not blocked:
+        return 0
+    pruned = [chat_id for chat_id in blocked if SUBSCRIPTIONS.remove(chat_id)]
+    # В базу — все заблокированные чаты, даже уже исключённые из реестра в памяти:
+    # иначе их сообщения остаются в очереди повторов до dead letters
+    await persist("deactivate_chats", list(blocked))
+    if pruned:
+        logging.info("%s: pruned %d blocked chats, %d subscriptions left", label, len(pruned), len(SUBSCRIPTIONS))
+    return len(pruned)
+
+
+async def broadcast_to_subscribers(bot, text, label: str) -> None:
+    """Рассылка по подпискам: блокировки отписываются, временные сбои уходят в очередь."""
+    started = asyncio.get_running_loop().time()
+    report = await send_batched(bot, SUBSCRIPTIONS.chat_ids(), text, label=label)
+    record_broadcast(label, report, asyncio.get_running_loop().time() - started)
+    pruned = await prune_blocked(report.blocked, label)
+    changes = OutboxChanges()
+    for chat_id, body, error in report.retry:
+        changes.enqueue(chat_id, body, label, error, retry_delay(1))
+    if changes:
+        await persist("apply_outbox", changes)
+    logging.info(
+        "%s: sent=%d queued=%d failed=%d pruned=%d",
+        label, report.sent, len(report.retry), report.failed, pruned,
+    )
+
+
 async def daily_quote_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Ежедневная мотивационная цитата в 19:00."""
+    """Ежедневная мотивационная цитата в 19:00 — каждому чату следующая из его ротации."""
     try:
-        chat_id = context.job.data["chat_id"]
-        quote = random.choice(QUOTES)
-        await send_safe_text(context, chat_id, f"💡 {quote}")
+        rotation = QUOTE_ROTATION or QuoteRotation(QUOTES)
+        await broadcast_to_subscribers(
+            context.bot,
+            lambda chat_id: f"💡 {html.escape(rotation.next_quote(chat_id))}",
+            "daily_quote_job",
+        )
+        await persist("save_quote_states", rotation.take_dirty())
     except Exception as e:
         logging.exception("daily_quote_job failed: %s", e)
 
@@ -412,12 +570,11 @@ async def daily_quote_job(context: ContextTypes.DEFAULT_TYPE) -> None:
 async def prep_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Вторник 18:50 — напоминание о подготовке к встрече."""
     try:
-        chat_id = context.job.data["chat_id"]
         text = (
             "📌 Время готовиться к встрече: обновите статус задач, соберите метрики и отметьте риски. "
             "Подготовьте демо/слайды, если требуется."
         )
-        await send_safe_text(context, chat_id, text)
+        await broadcast_to_subscribers(context.bot, text, "prep_reminder_job")
     except Exception as e:
         logging.exception("prep_reminder_job failed: %s", e)
 
@@ -425,19 +582,101 @@ async def prep_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
 async def meet_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Четверг 18:50 — напоминание о встрече."""
     try:
-        chat_id = context.job.data["chat_id"]
         text = (
             "⏰ Напоминание: сегодня встреча! Проверьте доступ к стендап- или созвону, "
             "подготовьте краткий апдейт по задачам и блокерам."
         )
-        await send_safe_text(context, chat_id, text)
+        await broadcast_to_subscribers(context.bot, text, "meet_reminder_job")
     except Exception as e:
         logging.exception("meet_reminder_job failed: %s", e)
 
 
-async def _post_init(app: Application) -> None:
+async def prefetch_news_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Фоново подгружает и рендерит новость по теме по умолчанию для каждого региона."""
+    for region in NEWS_REGIONS:
+        language, country = region_to_params(region)
+        try:
+            article = await find_article(DEFAULT_NEWS_TOPIC, language, country)
+        except Exception as e:
+            # Оставляем прошлый дайджест: устаревшая новость лучше ожидания API
+            logging.warning("prefetch_news_job failed for %s: %s", region, e)
+            continue
+        NEWS_CACHE.set(news_cache_key(DEFAULT_NEWS_TOPIC, language, country), article)
+        if article:
+            NEWS_DIGESTS[region] = render_article(article)
+        else:
+            NEWS_DIGESTS.pop(region, None)
+    logging.info("prefetch_news_job: digests ready for %s", ", ".join(sorted(NEWS_DIGESTS)) or "none")
+
+
+async def outbox_retry_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Повторяет отправку сообщений из очереди, время которых наступило."""
+    if STORE is None:
+        return
     try:
-        await app.bot.set_my_commands([
+        messages = await asyncio.to_thread(STORE.due)
+    except Exception as e:
+        logging.exception("outbox_retry_job: failed to read queue: %s", e)
+        return
+
+    blocked = []
+    # Исходы копятся в памяти и пишутся в базу одной транзакцией после прохода
+    changes = OutboxChanges()
+    log = SendLog("outbox_retry_job")
+    for message in messages:
+        outcome, error = await send_one(context.bot, message.chat_id, message.text, log=log)
+        attempts = message.attempts + 1
+        if outcome == SENT:
+            changes.delete(message.id)
+        elif outcome == BLOCKED:
+            blocked.append(message.chat_id)
+            changes.delete(message.id)
+        elif outcome == RETRY and attempts < MAX_ATTEMPTS:
+            changes.reschedule(message.id, attempts, retry_delay(attempts), error)
+        else:
+            changes.dead_letter(message, attempts, error)
+    if changes:
+        await persist("apply_outbox", changes)
+    log.summary()
+    if changes.dead:
+        logging.error("outbox_retry_job: gave up on %d messages after %d attempts", len(changes.dead), MAX_ATTEMPTS)
+    await prune_blocked(blocked, "outbox_retry_job")
+
+
+def schedule_group_jobs(jq) -> None:
+    """Регистрирует по одному заданию на событие (общие для всех подписанных чатов)."""
+    tz = get_tz()
+    jq.run_daily(
+        callback=daily_quote_job,
+        time=time(hour=19, minute=0, tzinfo=tz),
+        name="daily_quote",
+    )
+    jq.run_daily(
+        callback=prep_reminder_job,
+        time=time(hour=18, minute=50, tzinfo=tz),
+        days=(1,),
+        name="prep_reminder",
+    )
+    jq.run_daily(
+        callback=meet_reminder_job,
+        time=time(hour=18, minute=50, tzinfo=tz),
+        days=(3,),
+        name="meet_reminder",
+    )
+
+
+async def _post_shutdown(app: Application) -> None:
+    watchdog = app.bot_data.get("loop_watchdog")
+    if watchdog is not None:
+        await watchdog.stop()
+    if NEWS_CLIENT is not None:
+        await NEWS_CLIENT.aclose()
+
+
+async def set_commands(bot) -> None:
+    """Обновляет меню команд в Telegram (не нужно для ответа на первые обновления)."""
+    try:
+        await bot.set_my_commands([
             BotCommand("help", "помощь по командам"),
             BotCommand("about", "о платформе Commitly"),
             BotCommand("contacts", "контакты команды"),
@@ -450,42 +689,112 @@ async def _post_init(app: Application) -> None:
         logging.exception("set_my_commands failed: %s", e)
 
 
+async def set_commands_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await set_commands(context.bot)
+
+
+async def _post_init(app: Application) -> None:
+    if LOOP_WATCHDOG:
+        from loop_watchdog import LoopWatchdog
+        watchdog = LoopWatchdog(threshold=LOOP_WATCHDOG_THRESHOLD)
+        watchdog.start()
+        app.bot_data["loop_watchdog"] = watchdog
+    if app.job_queue is None:
+        await set_commands(app.bot)
+        return
+    watch_job_queue(app.job_queue)
+    schedule_group_jobs(app.job_queue)
+    if NEWS_CLIENT is not None:
+        app.job_queue.run_repeating(prefetch_news_job, interval=NEWS_PREFETCH_INTERVAL, first=0, name="prefetch_news")
+    app.job_queue.run_repeating(outbox_retry_job, interval=OUTBOX_POLL_INTERVAL, first=OUTBOX_POLL_INTERVAL, name="outbox_retry")
+    # post_init выполняется до первого getUpdates: сетевой запрос уходит в JobQueue
+    app.job_queue.run_once(set_commands_job, when=0, name="set_commands")
+
+
 # --------------------------
 # Точка входа
 # --------------------------
 
+def build_application() -> Application:
+    """Открывает хранилище, восстанавливает состояние и собирает приложение (без запуска)."""
+    # telegram.ext загружается здесь, а не при импорте модуля
+    from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler, Defaults
+    from update_processor import KeyedUpdateProcessor
+
+    global STORE, NEWS_CLIENT
+    STORE = ChatStore(BOT_DB_PATH)
+    load_state(STORE)
+    if NEWSAPI_KEY:
+        NEWS_CLIENT = NewsClient(NEWSAPI_KEY)
+
+    update_processor = KeyedUpdateProcessor(MAX_CONCURRENT_UPDATES)
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .defaults(Defaults(parse_mode=ParseMode.HTML))
+        .concurrent_updates(update_processor)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL)
+    application: Application = builder.build()
+
+    # Регистрируем команды; все, кроме служебной /loopstats, проходят контроль нагрузки
+    admission = AdmissionController(ADMISSION_CAPACITY, ADMISSION_QUEUE, ADMISSION_MAX_WAIT, costs=COMMAND_COSTS)
+
+    def guarded(name: str, handler):
+        return instrument_handler(name, admission.guard(name, handler, busy_reply))
+
+    application.add_handler(CommandHandler("start", guarded("start", start)))
+    application.add_handler(CommandHandler("about", guarded("about", about)))
+    application.add_handler(CommandHandler("contacts", guarded("contacts", contacts)))
+    application.add_handler(CommandHandler("news", guarded("news", news)))
+    application.add_handler(CommandHandler("help", guarded("help", help_command)))
+    application.add_handler(CommandHandler("region", guarded("region", set_region)))
+    application.add_handler(CallbackQueryHandler(
+        guarded("region_callback", region_callback), pattern=r"^region:(ru|us|eu)$"
+    ))
+    application.add_handler(CommandHandler("rate", guarded("rate", rate_command)))
+    application.add_handler(CommandHandler("loopstats", instrument_handler("loopstats", loop_stats)))
+
+    SUBSCRIBERS.set_function(lambda: len(SUBSCRIPTIONS))
+    UPDATES_ACTIVE_CHATS.set_function(lambda: update_processor.active_chats)
+    UPDATES_QUEUED.set_function(lambda: update_processor.queued_updates)
+    ADMISSION_IN_USE.set_function(lambda: admission.in_use)
+    ADMISSION_WAITING.set_function(lambda: admission.waiting)
+    return application
+
+
 def main() -> None:
     """Создание и запуск приложения бота."""
     if not BOT_TOKEN:
         raise SystemExit("BOT_TOKEN не задан. Укажите его в .env")
 
-    logging.basicConfig(
-        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-        level=logging.INFO,
-    )
-
-    application: Application = (
-    ApplicationBuilder()
-    .token(BOT_TOKEN)
-    .defaults(Defaults(parse_mode=ParseMode.HTML))
-    .post_init(_post_init)
-    .build()
-    )
-
-    # Регистрируем команды
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("about", about))
-    application.add_handler(CommandHandler("contacts", contacts))
-    application.add_handler(CommandHandler("news", news))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("region", set_region))
-    application.add_handler(CallbackQueryHandler(region_callback, pattern=r"^region:(ru|us|eu)$"))
-    application.add_handler(CommandHandler("rate", rate_command))
-
-
-
-    # Запускаем поллинг (для простоты; вебхуки можно настроить отдельно).
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Запись в stderr идёт из фонового потока, а не из event loop (logging_setup.py)
+    setup_logging()
+
+    application = build_application()
+
+    if METRICS_PORT:
+        # Prometheus забирает метрики с отдельного порта; вебхук их не отдаёт
+        from metrics import start_http_server
+        start_http_server(METRICS_PORT, METRICS_HOST)
+
+    if WEBHOOK_URL:
+        # Вебхук: aiohttp-сервер с проверкой секрета и /health
+        from webhook import run_webhook
+        run_webhook(
+            application,
+            WEBHOOK_URL,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        # Поллинг — режим по умолчанию
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+"""
+Пакетная рассылка
+=================
+Отправляет сообщение списку чатов пачками, укладываясь в лимит Telegram
+(~30 сообщений в секунду на бота). RetryAfter обрабатывается паузой и повтором;
+пауза общая (FloodGate): после 429 ждут все отправки бота, а не только та,
+что получила отказ.
+
+Каждая отправка классифицируется: чаты, заблокировавшие бота, возвращаются
+для отписки, временные ошибки (сеть, лимиты) — для постановки в очередь
+повторов (см. storage.OutboxChanges), остальные считаются неудачными.
+Исходы по получателям не логируются по одному: их считает SendLog
+(logging_setup.py), который в конце пишет одну сводку.
+"""
+
+import asyncio
+import logging
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from logging_setup import SendLog
+
+# Сколько сообщений отправлять за одну секунду (с запасом от лимита ~30/с)
+BATCH_SIZE = 25
+BATCH_INTERVAL = 1.0
+
+# Повторы из очереди: 30 с, 60 с, 120 с ... не дольше часа, всего до 8 попыток
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 3600
+MAX_ATTEMPTS = 8
+
+# Исходы отправки
+SENT = "sent"
+BLOCKED = "blocked"   # бот заблокирован / чат не найден — отписываем
+RETRY = "retry"       # сеть, таймаут, лимит — повторим позже
+FAILED = "failed"     # ошибка в самом сообщении — повтор не поможет
+
+TextSource = str | Callable[[int], str]
+
+
+@dataclass
+class BatchReport:
+    """Итоги рассылки."""
+    sent: int = 0
+    failed: int = 0
+    blocked: list[int] = field(default_factory=list)
+    retry: list[tuple[int, str, str]] = field(default_factory=list)   # (chat_id, text, error)
+
+
+def classify_error(error: Exception) -> str:
+    if isinstance(error, Forbidden):
+        return BLOCKED
+    # BadRequest — подкласс NetworkError, поэтому проверяется первым
+    if isinstance(error, BadRequest):
+        return BLOCKED if "chat not found" in error.message.lower() else FAILED
+    if isinstance(error, (RetryAfter, NetworkError)):
+        return RETRY
+    return FAILED
+
+
+def retry_delay(attempts: int) -> float:
+    """Задержка перед следующей попыткой после attempts неудачных."""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+
+
+class FloodGate:
+    """Общая пауза отправок после RetryAfter: flood wait Telegram действует на всего бота."""
+
+    def __init__(self) -> None:
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float) -> bool:
+        """Продлевает паузу; True, если она стала дольше (об этом стоит написать в лог)."""
+        until = asyncio.get_running_loop().time() + seconds
+        if until <= self._paused_until:
+            return False
+        self._paused_until = until
+        return True
+
+    async def wait(self) -> None:
+        """Дожидается конца паузы; пауза могла продлиться, пока мы спали."""
+        loop = asyncio.get_running_loop()
+        while (delay := self._paused_until - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+
+# Одна пауза на процесс: её соблюдают и рассылки, и повторы из очереди
+FLOOD_GATE = FloodGate()
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def send_one(bot, chat_id: int, body: str, parse_mode: ParseMode | None = ParseMode.HTML,
+                   log: SendLog | None = None, gate: FloodGate = FLOOD_GATE) -> tuple[str, str]:
+    """Отправляет одно сообщение. Возвращает (исход, текст ошибки); исход учитывается в log."""
+    error: Exception | None = None
+    for _ in range(2):
+        await gate.wait()
+        try:
+            await bot.send_message(chat_id=chat_id, text=body, parse_mode=parse_mode)
+            if log is not None:
+                log.record(SENT, chat_id)
+            return SENT, ""
+        except RetryAfter as e:
+            error = e
+            delay = _retry_after_seconds(e)
+            # Пачка отправляется параллельно: 429 придёт многим, в лог — только продление паузы
+            if gate.pause(delay):
+                logging.warning("Flood control (chat %s): pausing all sends for %.0fs", chat_id, delay)
+        except Exception as e:
+            error = e
+            break
+    outcome = RETRY if isinstance(error, RetryAfter) else classify_error(error)
+    if log is not None:
+        log.record(outcome, chat_id, error)
+    return outcome, str(error)
+
+
+async def send_batched(
+    bot,
+    chat_ids: Iterable[int],
+    text: TextSource,
+    parse_mode: ParseMode | None = ParseMode.HTML,
+    label: str = "broadcast",
+) -> BatchReport:
+    """Рассылает text (строку или функцию chat_id -> строка) всем чатам; в лог — одна сводка."""
+    ids = list(chat_ids)
+    loop = asyncio.get_running_loop()
+    report = BatchReport()
+    log = SendLog(label)
+    began = loop.time()
+    for start in range(0, len(ids), BATCH_SIZE):
+        started = loop.time()
+        batch = ids[start:start + BATCH_SIZE]
+        bodies = [text(chat_id) if callable(text) else text for chat_id in batch]
+        results = await asyncio.gather(
+            *(send_one(bot, chat_id, body, parse_mode, log) for chat_id, body in zip(batch, bodies))
+        )
+        for chat_id, body, (outcome, error) in zip(batch, bodies, results):
+            if outcome == SENT:
+                report.sent += 1
+            elif outcome == BLOCKED:
+                report.blocked.append(chat_id)
+            elif outcome == RETRY:
+                report.retry.append((chat_id, body, error))
+            else:
+                report.failed += 1
+
+        elapsed = loop.time() - started
+        if start + BATCH_SIZE < len(ids) and elapsed < BATCH_INTERVAL:
+            await asyncio.sleep(BATCH_INTERVAL - elapsed)
+    log.summary(loop.time() - began)
+    return report
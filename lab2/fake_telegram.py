@@ -0,0 +1,181 @@
+"""
+Фейковый Telegram Bot API
+=========================
+Локальный HTTP-сервер (aiohttp) для бенчмарков: отвечает на getMe,
+sendMessage, setMyCommands и прочие методы бота. Задержка ответа и доли
+ответов 429 (с retry_after), 403 (бот заблокирован) и 502 (сбой сети)
+настраиваются; ошибки внедряются только в sendMessage. Тот же сервер,
+что и в lab1/bot/fake_telegram.py.
+
+Сервер работает в отдельном процессе, чтобы не делить event loop и
+процессор с измеряемым ботом. Счётчики — GET /stats, сброс — POST /reset.
+
+    with FakeTelegramServer(FakeApiConfig(latency=0.05, flood_rate=0.01)) as server:
+        bot = Bot(token, base_url=server.base_url)
+"""
+
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+import urllib.request
+from collections import Counter
+from dataclasses import dataclass
+
+from aiohttp import web
+
+
+@dataclass(frozen=True)
+class FakeApiConfig:
+    """Поведение фейкового API."""
+    latency: float = 0.0        # задержка ответа, секунды
+    jitter: float = 0.0         # случайная добавка к задержке, 0..jitter секунд
+    flood_rate: float = 0.0     # доля sendMessage с ответом 429
+    retry_after: int = 1        # retry_after в ответе 429, секунды
+    blocked_rate: float = 0.0   # доля sendMessage с ответом 403 (бот заблокирован)
+    error_rate: float = 0.0     # доля sendMessage с ответом 502 (сбой сети)
+    seed: int = 0
+
+
+BOT_USER = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "Benchmark",
+    "username": "benchmark_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+def _error(status: int, description: str, retry_after: int | None = None) -> web.Response:
+    payload = {"ok": False, "error_code": status, "description": description}
+    if retry_after is not None:
+        payload["parameters"] = {"retry_after": retry_after}
+    return web.json_response(payload, status=status)
+
+
+def make_app(config: FakeApiConfig) -> web.Application:
+    rng = random.Random(config.seed)
+    stats: Counter[str] = Counter()
+    message_ids = iter(range(1, 1 << 62))
+
+    async def api(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        stats[f"method:{method}"] += 1
+
+        delay = config.latency + (rng.uniform(0, config.jitter) if config.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": BOT_USER})
+        if method != "sendMessage":
+            return web.json_response({"ok": True, "result": True})
+
+        roll = rng.random()
+        if roll < config.flood_rate:
+            stats["status:429"] += 1
+            return _error(429, f"Too Many Requests: retry after {config.retry_after}", config.retry_after)
+        roll -= config.flood_rate
+        if roll < config.blocked_rate:
+            stats["status:403"] += 1
+            return _error(403, "Forbidden: bot was blocked by the user")
+        roll -= config.blocked_rate
+        if roll < config.error_rate:
+            stats["status:502"] += 1
+            return web.Response(status=502, text="Bad Gateway")
+
+        stats["status:200"] += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }})
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(dict(stats))
+
+    async def reset(request: web.Request) -> web.Response:
+        stats.clear()
+        return web.json_response({"ok": True})
+
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_route("*", "/bot{token}/{method}", api)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_post("/reset", reset)
+    return app
+
+
+def _serve(config: FakeApiConfig, ready) -> None:
+    """Точка входа процесса сервера: сообщает порт и работает до завершения процесса."""
+    async def run() -> None:
+        runner = web.AppRunner(make_app(config), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+        await site.start()
+        ready.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def fetch_stats(root_url: str) -> dict[str, int]:
+    """Счётчики сервера: {"method:sendMessage": ..., "status:200": ...}."""
+    with urllib.request.urlopen(f"{root_url}/stats") as response:
+        return json.loads(response.read())
+
+
+def reset_stats(root_url: str) -> None:
+    urllib.request.urlopen(urllib.request.Request(f"{root_url}/reset", method="POST")).close()
+
+
+class FakeTelegramServer:
+    """Фейковый Bot API в дочернем процессе."""
+
+    def __init__(self, config: FakeApiConfig = FakeApiConfig()) -> None:
+        self.config = config
+        self.port: int | None = None
+        self._process: multiprocessing.Process | None = None
+
+    @property
+    def root_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def base_url(self) -> str:
+        """Значение для Bot(base_url=...) и TELEGRAM_API_URL."""
+        return f"{self.root_url}/bot"
+
+    def start(self, timeout: float = 30.0) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        ready = ctx.Queue()
+        self._process = ctx.Process(target=_serve, args=(self.config, ready), name="fake-telegram", daemon=True)
+        self._process.start()
+        self.port = ready.get(timeout=timeout)
+
+    def stats(self) -> dict[str, int]:
+        return fetch_stats(self.root_url)
+
+    def reset(self) -> None:
+        reset_stats(self.root_url)
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self) -> "FakeTelegramServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,152 @@
+"""
+Неблокирующее логирование
+=========================
+Обработчик корневого логгера только кладёт запись в очередь (QueueHandler),
+а форматирует и пишет в stderr отдельный поток (QueueListener): event loop
+не ждёт вывода, даже когда рассылка порождает тысячи записей.
+
+Циклы отправки не пишут строку на каждого получателя: SendLog считает исходы
+и виды ошибок и в конце пишет одну сводку. Первая ошибка каждого вида
+логируется сразу, остальные строки по получателям — выборочно, с долей
+LOG_SAMPLE_RATE.
+
+Переменные окружения: LOG_LEVEL (INFO), LOG_FORMAT (text или json — одна
+строка JSON на запись со всеми полями из extra), LOG_SAMPLE_RATE (0..1, по
+умолчанию 0).
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0"))
+
+# Стандартные атрибуты LogRecord; всё остальное пришло через extra
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; поля из extra попадают в неё как есть."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке: текст и traceback собирает QueueListener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Очередь не покидает процесс — args и exc_info сериализовать не нужно
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, text_format: str = TEXT_FORMAT) -> None:
+    """Направляет корневой логгер в очередь с выводом из фонового потока. Повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(text_format))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Дописывает накопленные записи и останавливает поток вывода."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class SendLog:
+    """
+    Сводка одного цикла отправок (рассылки или прохода по очереди повторов).
+
+    record() только считает; строка по получателю пишется для первой ошибки
+    каждого вида и выборочно с долей sample_rate. summary() пишет одну запись
+    с итогами, в extra — event, label, outcomes, errors и duration.
+    """
+
+    def __init__(self, label: str, sample_rate: float | None = None) -> None:
+        self.label = label
+        self.sample_rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.outcomes: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+
+    @property
+    def total(self) -> int:
+        return sum(self.outcomes.values())
+
+    def _sampled(self) -> bool:
+        return bool(self.sample_rate) and random.random() < self.sample_rate
+
+    def record(self, outcome: str, chat_id: int, error: BaseException | None = None) -> None:
+        """Учитывает исход отправки одному получателю."""
+        self.outcomes[outcome] += 1
+        if error is None:
+            if self._sampled():
+                logging.info("%s: %s for chat %s", self.label, outcome, chat_id,
+                             extra={"event": "send", "label": self.label, "outcome": outcome, "chat_id": chat_id})
+            return
+
+        kind = type(error).__name__
+        self.errors[kind] += 1
+        first = self.errors[kind] == 1
+        if first or self._sampled():
+            logging.warning("%s: %s for chat %s: %s [%s%s]", self.label, outcome, chat_id, error, kind,
+                            ", first of its kind" if first else "",
+                            extra={"event": "send", "label": self.label, "outcome": outcome,
+                                   "chat_id": chat_id, "error": kind})
+
+    def summary(self, duration: float | None = None, level: int = logging.INFO) -> None:
+        """Одна запись с итогами цикла; без отправок ничего не пишет."""
+        if not self.outcomes:
+            return
+        outcomes = ", ".join(f"{name}={count}" for name, count in self.outcomes.most_common())
+        message = f"{self.label}: {self.total} sends: {outcomes}"
+        if duration is not None:
+            message += f" in {duration:.2f}s"
+        if self.errors:
+            message += "; errors: " + ", ".join(f"{name}={count}" for name, count in self.errors.most_common())
+        logging.log(level, message, extra={
+            "event": "send_summary",
+            "label": self.label,
+            "outcomes": dict(self.outcomes),
+            "errors": dict(self.errors),
+            "duration": round(duration, 3) if duration is not None else None,
+        })
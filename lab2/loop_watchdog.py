@@ -0,0 +1,195 @@
+"""
+Сторож event loop
+=================
+Корутина-пульс просыпается каждые interval секунд и меряет, насколько позже
+срока её разбудили, — это задержка event loop. Отдельный поток следит за
+пульсом: если его нет дольше threshold, loop занят синхронным кодом, и поток
+снимает стек потока event loop. Самый глубокий кадр кода бота (обработчик,
+задание JobQueue) попадает в лог, в ответ команды /loopstats и в метрики.
+
+Включается переменной окружения LOOP_WATCHDOG=1 — для стенда и отладки.
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any
+
+from metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS
+
+DEFAULT_INTERVAL = 0.1     # период пульса, секунды
+DEFAULT_THRESHOLD = 0.25   # с какой задержки loop считается заблокированным, секунды
+STALL_HISTORY = 20         # сколько последних блокировок помнить для /loopstats
+LAG_WINDOW = 3000          # по скольким последним замерам считать процентили
+
+_THIS_FILE = os.path.abspath(__file__)
+_BOT_DIR = os.path.dirname(_THIS_FILE)
+_UNKNOWN = "не определено"
+
+
+@dataclass(frozen=True)
+class Stall:
+    """Одна блокировка event loop."""
+    started_at: datetime
+    duration: float
+    location: str
+    task: str
+    stack: str
+
+
+class LoopWatchdog:
+    """Замеряет задержку event loop и снимает стек, когда loop заблокирован дольше threshold."""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, interval: float = DEFAULT_INTERVAL,
+                 code_dir: str = _BOT_DIR) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.code_dir = code_dir
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self._lags: deque[float] = deque(maxlen=LAG_WINDOW)
+        self._stalls: deque[Stall] = deque(maxlen=STALL_HISTORY)
+        self._lock = threading.Lock()
+        self._beat = time.monotonic()
+        self._captured: Stall | None = None   # стек текущей блокировки, снятый потоком (duration ещё 0)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Запускает пульс в текущем event loop и поток наблюдения."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logging.info("Loop watchdog started: threshold %.0f ms, heartbeat every %.0f ms",
+                     self.threshold * 1000, self.interval * 1000)
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._beat = time.monotonic()
+            self._record_lag(lag)
+
+    def _record_lag(self, lag: float) -> None:
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        with self._lock:
+            self.samples += 1
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            captured, self._captured = self._captured, None
+            if lag < self.threshold:
+                return
+            self.stall_count += 1
+            if captured is None:
+                # Блокировка закончилась раньше, чем поток успел снять стек
+                captured = Stall(datetime.now() - timedelta(seconds=lag), 0.0, _UNKNOWN, _UNKNOWN, "")
+            stall = Stall(captured.started_at, lag, captured.location, captured.task, captured.stack)
+            self._stalls.append(stall)
+        EVENT_LOOP_STALLS.inc()
+        logging.warning("Event loop was blocked for %.0f ms: %s (task %s)", lag * 1000, stall.location, stall.task)
+
+    def _watch(self) -> None:
+        """Поток наблюдения: снимает стек, если пульс опаздывает дольше порога."""
+        while not self._stopped.wait(self.interval / 2):
+            blocked_for = time.monotonic() - self._beat - self.interval
+            if blocked_for < self.threshold:
+                continue
+            with self._lock:
+                if self._captured is not None:
+                    continue
+                self._captured = captured = self._capture(blocked_for)
+            logging.warning("Event loop blocked for %.0f ms so far: %s (task %s)\n%s",
+                            blocked_for * 1000, captured.location, captured.task, captured.stack)
+
+    def _capture(self, blocked_for: float) -> Stall:
+        started_at = datetime.now() - timedelta(seconds=blocked_for)
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return Stall(started_at, 0.0, _UNKNOWN, _UNKNOWN, "")
+        summary = traceback.extract_stack(frame)
+        del frame
+        task = _UNKNOWN
+        try:
+            current = asyncio.current_task(self._loop)
+        except RuntimeError:
+            current = None
+        if current is not None:
+            coro = current.get_coro()
+            task = f"{current.get_name()} / {getattr(coro, '__qualname__', coro)}"
+        return Stall(started_at, 0.0, self._locate(summary), task, "".join(summary.format()))
+
+    def _locate(self, summary: traceback.StackSummary) -> str:
+        """Самый глубокий кадр кода бота, иначе — самый глубокий кадр вообще."""
+        for entry in reversed(summary):
+            # .venv может лежать рядом с кодом — библиотеки кодом бота не считаем
+            if (entry.filename.startswith(self.code_dir) and entry.filename != _THIS_FILE
+                    and "site-packages" not in entry.filename):
+                return f"{os.path.basename(entry.filename)}:{entry.lineno} в {entry.name}"
+        if summary:
+            return f"{summary[-1].filename}:{summary[-1].lineno} в {summary[-1].name}"
+        return _UNKNOWN
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lags = list(self._lags)
+            stalls = list(self._stalls)
+            samples, max_lag, stall_count = self.samples, self.max_lag, self.stall_count
+        if len(lags) > 1:
+            p99 = statistics.quantiles(lags, n=100, method="inclusive")[98]
+        else:
+            p99 = lags[0] if lags else 0.0
+        return {
+            "samples": samples,
+            "p50": statistics.median(lags) if lags else 0.0,
+            "p99": p99,
+            "max": max_lag,
+            "stall_count": stall_count,
+            "stalls": stalls,
+        }
+
+    def format_stats(self, last: int = 5) -> str:
+        """Текст ответа /loopstats (без разметки)."""
+        stats = self.stats()
+        lines = [
+            "⏱ Event loop",
+            f"Замеров: {stats['samples']}, порог блокировки: {self.threshold * 1000:.0f} мс",
+            f"Задержка: p50 {stats['p50'] * 1000:.1f} мс, p99 {stats['p99'] * 1000:.1f} мс, "
+            f"максимум {stats['max'] * 1000:.0f} мс",
+            f"Блокировок: {stats['stall_count']}",
+        ]
+        for stall in reversed(stats["stalls"][-last:]):
+            lines.append(f"• {stall.started_at:%d.%m %H:%M:%S} — {stall.duration * 1000:.0f} мс, {stall.location}")
+        return "\n".join(lines)
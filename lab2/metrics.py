@@ -0,0 +1,343 @@
+"""
+Метрики Prometheus
+==================
+Счётчики, значения и гистограммы в памяти процесса и HTTP-сервер, который
+отдаёт их на /metrics в текстовом формате Prometheus (0.0.4). Без внешних
+зависимостей: сервер работает в отдельном потоке и не занимает event loop.
+Включается переменной окружения METRICS_PORT; по умолчанию слушает 127.0.0.1.
+
+    bot_command_duration_seconds{command}                    время обработки команды
+    bot_broadcast_duration_seconds{broadcast}                длительность рассылки
+    bot_broadcast_messages_total{broadcast,outcome}          sent / blocked / retry / failed
+    bot_broadcast_throughput_messages_per_second{broadcast}  скорость последней рассылки
+    bot_scheduler_lag_seconds{task}                          опоздание запуска задания JobQueue
+    bot_storage_operation_duration_seconds{operation}        время операций с SQLite
+    bot_event_loop_lag_seconds, bot_event_loop_stalls_total  задержка и блокировки event loop (loop_watchdog.py)
+    bot_updates_active_chats, bot_updates_queued             чаты в обработке и ждущие своей очереди обновления
+    bot_admission_wait_seconds{command}                      ожидание места под команду (admission.py)
+    bot_admission_rejected_total{command,reason}             команды, отклонённые из-за перегрузки
+    bot_admission_in_use, bot_admission_waiting              занятая ёмкость и очередь команд
+    bot_subscribers                                          активных подписок
+"""
+
+import functools
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator, Sequence
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_PATH = "/metrics"
+
+# Границы гистограмм (секунды): от миллисекунды до десятков секунд
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Для рассылок: от долей секунды до часа
+LONG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+Sample = tuple[str, Sequence[str], tuple[str, ...], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Registry:
+    """Метрики, которые отдаются одним ответом /metrics."""
+
+    def __init__(self) -> None:
+        self._metrics: list[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, names, values, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Registry | None = REGISTRY) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict[str, object]) -> tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[Sample]:
+        """Сэмплы метрики: (суффикс имени, имена меток, значения меток, значение)."""
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "_total", self.labelnames, key, value
+
+
+class Gauge(_Metric):
+    """Текущее значение; у метрики без меток его может вычислять функция в момент опроса."""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        if self.labelnames:
+            raise ValueError("set_function() is only supported for gauges without labels")
+        self._function = function
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Sample]:
+        if self._function is not None:
+            try:
+                yield "", (), (), float(self._function())
+            except Exception as e:
+                logging.warning("Failed to collect %s: %s", self.name, e)
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", self.labelnames, key, value
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (в выводе — накопительно, как в Prometheus)."""
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = (*sorted(buckets), math.inf)
+        # На набор меток: [попадания в каждую корзину..., сумма]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 1)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-1] += value
+
+    def timed(self, **labels) -> Callable:
+        """Декоратор синхронной функции: замеряет время каждого вызова."""
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return int(sum(state[:-1])) if state else 0
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        names = (*self.labelnames, "le")
+        for key, state in items:
+            cumulative = 0.0
+            for bound, hits in zip(self.buckets, state):
+                cumulative += hits
+                yield "_bucket", names, (*key, _format_value(bound)), cumulative
+            yield "_sum", self.labelnames, key, state[-1]
+            yield "_count", self.labelnames, key, cumulative
+
+
+# --------------------------
+# Метрики бота
+# --------------------------
+
+COMMAND_SECONDS = Histogram(
+    "bot_command_duration_seconds", "Время обработки команды.", ("command",)
+)
+BROADCAST_SECONDS = Histogram(
+    "bot_broadcast_duration_seconds", "Длительность рассылки.", ("broadcast",), buckets=LONG_BUCKETS
+)
+BROADCAST_MESSAGES = Counter(
+    "bot_broadcast_messages", "Исходы отправок в рассылках.", ("broadcast", "outcome")
+)
+BROADCAST_THROUGHPUT = Gauge(
+    "bot_broadcast_throughput_messages_per_second", "Скорость последней рассылки.", ("broadcast",)
+)
+SCHEDULER_LAG_SECONDS = Histogram(
+    "bot_scheduler_lag_seconds", "Опоздание запуска задания относительно расписания.", ("task",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 3600.0),
+)
+STORAGE_SECONDS = Histogram(
+    "bot_storage_operation_duration_seconds", "Время операций с базой SQLite.", ("operation",)
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds", "Задержка пробуждения пульса event loop.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+EVENT_LOOP_STALLS = Counter("bot_event_loop_stalls", "Блокировок event loop дольше порога сторожа.")
+UPDATES_ACTIVE_CHATS = Gauge("bot_updates_active_chats", "Чатов, обновления которых обрабатываются сейчас.")
+UPDATES_QUEUED = Gauge("bot_updates_queued", "Обновлений, ждущих окончания предыдущих в своём чате.")
+ADMISSION_WAIT_SECONDS = Histogram(
+    "bot_admission_wait_seconds", "Ожидание места под команду.", ("command",)
+)
+ADMISSION_REJECTED = Counter(
+    "bot_admission_rejected", "Команд, отклонённых из-за перегрузки.", ("command", "reason")
+)
+ADMISSION_IN_USE = Gauge("bot_admission_in_use", "Занятая стоимость выполняющихся команд.")
+ADMISSION_WAITING = Gauge("bot_admission_waiting", "Команд, ждущих места.")
+SUBSCRIBERS = Gauge("bot_subscribers", "Активных подписок.")
+
+
+def instrument_handler(command: str, handler: Callable) -> Callable:
+    """Оборачивает асинхронный обработчик: время каждого вызова попадает в COMMAND_SECONDS."""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            COMMAND_SECONDS.observe(time.perf_counter() - started, command=command)
+    return wrapper
+
+
+def record_broadcast(label: str, report, seconds: float) -> None:
+    """Учитывает итоги рассылки (broadcast.BatchReport) и её длительность."""
+    outcomes = {"sent": report.sent, "blocked": len(report.blocked), "retry": len(report.retry), "failed": report.failed}
+    for outcome, count in outcomes.items():
+        if count:
+            BROADCAST_MESSAGES.inc(count, broadcast=label, outcome=outcome)
+    BROADCAST_SECONDS.observe(seconds, broadcast=label)
+    if seconds > 0:
+        BROADCAST_THROUGHPUT.set(sum(outcomes.values()) / seconds, broadcast=label)
+
+
+def watch_job_queue(job_queue) -> None:
+    """Пишет в SCHEDULER_LAG_SECONDS, насколько позже расписания APScheduler запускает задания.
+
+    Вызывать до добавления заданий: имя задания запоминается при его добавлении,
+    а разовые задания удаляются из планировщика раньше, чем приходит событие запуска.
+    """
+    from apscheduler.events import EVENT_JOB_ADDED, EVENT_JOB_SUBMITTED
+
+    scheduler = job_queue.scheduler
+    names: dict[str, str] = {}
+
+    def listener(event) -> None:
+        if event.code == EVENT_JOB_ADDED:
+            job = scheduler.get_job(event.job_id)
+            names[event.job_id] = job.name if job is not None else event.job_id
+            return
+        name = names.get(event.job_id, event.job_id)
+        if scheduler.get_job(event.job_id) is None:
+            names.pop(event.job_id, None)
+        now = datetime.now(timezone.utc)
+        for run_time in event.scheduled_run_times:
+            SCHEDULER_LAG_SECONDS.observe(max((now - run_time).total_seconds(), 0.0), task=name)
+
+    scheduler.add_listener(listener, EVENT_JOB_ADDED | EVENT_JOB_SUBMITTED)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # Опросы Prometheus в лог не пишем
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Поднимает /metrics в фоновом потоке."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info("Metrics available at http://%s:%d%s", host, server.server_address[1], METRICS_PATH)
+    return server
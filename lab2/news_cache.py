@@ -0,0 +1,95 @@
+"""
+Кэш результатов NewsAPI
+=======================
+LRU-кэш ограниченного размера с TTL и объединением одинаковых запросов
+(single-flight): пока запрос за ключом выполняется, остальные вызовы
+с тем же ключом ждут его результат, а не идут в NewsAPI повторно.
+Популярная тема стоит одного обращения к API за окно TTL.
+
+Запрос к источнику выполняется отдельной задачей: отмена вызвавшего его
+обработчика не отменяет запрос для остальных ожидающих. Пустой результат
+(None — «новостей не нашлось») хранится только negative_ttl секунд.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+
+def normalize_topic(topic: str) -> str:
+    """Приводит тему к каноничному виду: регистр и лишние пробелы не влияют на ключ."""
+    return " ".join(topic.lower().split())
+
+
+def news_cache_key(topic: str, language: str, country: str | None) -> tuple[str, str, str | None]:
+    return normalize_topic(topic), language.lower(), country.lower() if country else None
+
+
+class TTLCache:
+    """Асинхронный LRU-кэш с TTL и single-flight."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600.0, negative_ttl: float = 60.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """Возвращает (найдено, значение) без обращения к источнику."""
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        ttl = self.negative_ttl if value is None else self.ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Значение из кэша либо результат fetch() (один вызов на ключ одновременно)."""
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key, fetch))
+            # Ошибку забираем, даже если все ожидающие отменены — без "exception was never retrieved"
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # Отмена ожидающего (в том числе первого) не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()   # ошибки не кэшируем, но отдаём всем ожидающим
+            self.set(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,61 @@
+"""
+Асинхронный клиент NewsAPI
+==========================
+Замена синхронного newsapi-python: запросы идут через общий httpx.AsyncClient
+с пулом keep-alive соединений и таймаутами, поэтому ожидание ответа NewsAPI
+не блокирует event loop и обработку остальных чатов.
+
+Документация API: https://newsapi.org/docs/endpoints
+"""
+
+import httpx
+
+NEWSAPI_URL = "https://newsapi.org/v2"
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+DEFAULT_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0)
+
+
+class NewsApiError(Exception):
+    """Ответ NewsAPI со статусом error (неверный ключ, исчерпана квота и т.п.)."""
+
+
+class NewsClient:
+    """Клиент NewsAPI поверх одного httpx.AsyncClient на всё приложение."""
+
+    def __init__(
+        self,
+        api_key: str,
+        timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+        limits: httpx.Limits = DEFAULT_LIMITS,
+    ) -> None:
+        self._client = httpx.AsyncClient(
+            base_url=NEWSAPI_URL,
+            headers={"X-Api-Key": api_key},
+            timeout=timeout,
+            limits=limits,
+        )
+
+    async def _get(self, endpoint: str, params: dict) -> list[dict]:
+        resp = await self._client.get(endpoint, params={k: v for k, v in params.items() if v is not None})
+        try:
+            payload = resp.json()
+        except ValueError:
+            resp.raise_for_status()
+            raise NewsApiError(f"Unexpected response from NewsAPI ({resp.status_code})")
+        if payload.get("status") != "ok":
+            raise NewsApiError(f"{payload.get('code')}: {payload.get('message')}")
+        return payload.get("articles", [])
+
+    async def top_headlines(self, q: str, country: str, page_size: int = 10) -> list[dict]:
+        """/v2/top-headlines — главные новости страны по запросу."""
+        return await self._get("/top-headlines", {"q": q, "country": country, "pageSize": page_size})
+
+    async def everything(self, q: str, language: str, sort_by: str = "publishedAt", page_size: int = 10) -> list[dict]:
+        """/v2/everything — поиск по всем источникам."""
+        return await self._get(
+            "/everything",
+            {"q": q, "language": language, "sortBy": sort_by, "pageSize": page_size},
+        )
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
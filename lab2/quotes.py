@@ -0,0 +1,96 @@
+"""
+Ротация цитат
+=============
+Каждый чат получает цитаты в порядке собственной перетасованной «колоды»
+без повторов, пока не пройдёт все. Порядок задаётся перестановкой по
+формуле, поэтому состояние чата — пара (seed, cursor), а выбор следующей
+цитаты — O(1). Тот же движок, что и в lab1/bot/quotes.py.
+
+Цитаты можно загрузить из файла (QUOTES_FILE): текстового, по одной на
+строку, или собранного корпуса (quote_corpus.py).
+"""
+
+import random
+import threading
+from collections.abc import Sequence
+
+from quote_corpus import parse_source
+
+_MASK64 = (1 << 64) - 1
+_FEISTEL_ROUNDS = 4
+
+
+def load_quotes(path: str) -> list[str]:
+    """Читает цитаты из текстового файла (формат строк — см. quote_corpus.parse_source)."""
+    return [text for text, _, _ in parse_source(path)]
+
+
+def _mix64(value: int) -> int:
+    """splitmix64: детерминированное перемешивание битов (не зависит от PYTHONHASHSEED)."""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+class QuoteRotation:
+    """Ротация цитат по чатам без повторов; состояние чата — (seed, cursor)."""
+
+    def __init__(self, quotes: Sequence[str], states: dict[int, tuple[int, int]] | None = None) -> None:
+        if not quotes:
+            raise ValueError("quotes must not be empty")
+        self.quotes = quotes
+        self._states: dict[int, tuple[int, int]] = dict(states or {})
+        self._dirty: dict[int, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.quotes)
+
+    def next_index(self, chat_id: int) -> int:
+        """Номер следующей цитаты чата; сдвигает его курсор."""
+        n = len(self.quotes)
+        with self._lock:
+            seed, cursor = self._states.get(chat_id) or (random.getrandbits(32), 0)
+            state = (seed, cursor + 1)
+            self._states[chat_id] = state
+            self._dirty[chat_id] = state
+        return self._index(seed, cursor, n)
+
+    def next_quote(self, chat_id: int) -> str:
+        return self.quotes[self.next_index(chat_id)]
+
+    def take_dirty(self) -> list[tuple[int, int, int]]:
+        """Забирает изменённые состояния для сохранения: [(chat_id, seed, cursor)]."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return [(chat_id, seed, cursor) for chat_id, (seed, cursor) in dirty.items()]
+
+    @classmethod
+    def _index(cls, seed: int, cursor: int, n: int) -> int:
+        if n == 2:
+            # Из двух цитат без повторов подряд — только чередование
+            return (seed + cursor) % 2
+        round_, position = divmod(cursor, n)
+        # На стыке кругов первая цитата не должна совпасть с последней цитатой
+        # прошлого круга — тогда меняем местами позиции 0 и 1
+        if round_ > 0 and n > 2 and position < 2:
+            if cls._permute(seed, round_, 0, n) == cls._permute(seed, round_ - 1, n - 1, n):
+                position = 1 - position
+        return cls._permute(seed, round_, position, n)
+
+    @staticmethod
+    def _permute(seed: int, round_: int, position: int, n: int) -> int:
+        # Сеть Фейстеля на 2^(2*half) >= n элементах; значения вне [0, n)
+        # пропускаются повторным применением (cycle walking)
+        half = (max(1, (n - 1).bit_length()) + 1) // 2
+        mask = (1 << half) - 1
+        key = _mix64((seed << 32) ^ round_)
+        value = position
+        while True:
+            left, right = value >> half, value & mask
+            for step in range(_FEISTEL_ROUNDS):
+                left, right = right, left ^ (_mix64(key ^ (step << 56) ^ right) & mask)
+            value = (left << half) | right
+            if value < n:
+                return value
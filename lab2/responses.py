@@ -0,0 +1,85 @@
+"""
+Готовые ответы на команды
+=========================
+Статические ответы (/help, /about, /contacts, /rate) разбираются из HTML
+один раз при старте в текст и entities. При отправке Telegram не парсит
+разметку (parse_mode=None), а ошибка в разметке обнаруживается сразу
+при запуске бота, а не у пользователя.
+"""
+
+from dataclasses import dataclass
+from html.parser import HTMLParser
+
+from telegram import Message, MessageEntity
+from telegram.constants import MessageLimit
+
+# Поддерживаемые теги — подмножество HTML-разметки Telegram
+_TAG_ENTITIES = {
+    "b": MessageEntity.BOLD,
+    "strong": MessageEntity.BOLD,
+    "i": MessageEntity.ITALIC,
+    "em": MessageEntity.ITALIC,
+    "u": MessageEntity.UNDERLINE,
+    "s": MessageEntity.STRIKETHROUGH,
+    "code": MessageEntity.CODE,
+    "pre": MessageEntity.PRE,
+    "a": MessageEntity.TEXT_LINK,
+}
+
+
+@dataclass(frozen=True)
+class StaticReply:
+    """Готовый ответ: текст и entities со смещениями в UTF-16."""
+    text: str
+    entities: tuple[MessageEntity, ...] = ()
+
+
+def _utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+class _EntityParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.entities: list[MessageEntity] = []
+        self.offset = 0
+        self._open: list[tuple[str, int, str | None]] = []   # (тег, начало, url)
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag not in _TAG_ENTITIES:
+            raise ValueError(f"unsupported tag <{tag}>")
+        url = dict(attrs).get("href") if tag == "a" else None
+        if tag == "a" and not url:
+            raise ValueError("<a> without href")
+        self._open.append((tag, self.offset, url))
+
+    def handle_endtag(self, tag: str) -> None:
+        if not self._open or self._open[-1][0] != tag:
+            raise ValueError(f"unexpected </{tag}>")
+        _, start, url = self._open.pop()
+        if self.offset > start:
+            self.entities.append(MessageEntity(_TAG_ENTITIES[tag], start, self.offset - start, url=url))
+
+    def handle_data(self, data: str) -> None:
+        self.parts.append(data)
+        self.offset += _utf16_len(data)
+
+
+def prerender_html(markup: str) -> StaticReply:
+    """Разбирает HTML-разметку Telegram в текст и entities; ValueError, если разметка некорректна."""
+    parser = _EntityParser()
+    parser.feed(markup)
+    parser.close()
+    if parser._open:
+        raise ValueError(f"unclosed <{parser._open[-1][0]}>")
+    if parser.offset > MessageLimit.MAX_TEXT_LENGTH:
+        raise ValueError(f"reply is longer than {MessageLimit.MAX_TEXT_LENGTH} characters")
+    # Telegram ждёт entities в порядке начала
+    entities = sorted(parser.entities, key=lambda entity: (entity.offset, -entity.length))
+    return StaticReply("".join(parser.parts), tuple(entities))
+
+
+async def reply_static(message: Message, reply: StaticReply) -> None:
+    """Отвечает готовым текстом; parse_mode=None перекрывает HTML из Defaults."""
+    await message.reply_text(reply.text, entities=reply.entities, parse_mode=None)
@@ -0,0 +1,248 @@
+"""
+Хранилище состояния бота
+========================
+SQLite-файл с подписками и регионами чатов. При старте всё читается одним
+запросом на таблицу, дальше каждое изменение пишется точечным upsert/delete —
+без пересохранения всего состояния.
+
+Там же лежит очередь повторных отправок (outbox) и «мёртвые» сообщения
+(dead_letters), которые не удалось доставить за все попытки. Изменения очереди
+за рассылку или проход повторов копятся в OutboxChanges и пишутся одной
+транзакцией (ChatStore.apply_outbox), а не коммитом на каждого получателя.
+
+Путь к файлу задаётся переменной окружения BOT_DB_PATH (по умолчанию bot_state.db).
+На PaaS с эфемерным диском укажите путь на подключённом томе.
+"""
+
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import NamedTuple
+
+from metrics import STORAGE_SECONDS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id INTEGER PRIMARY KEY,
+    inactive_since REAL          -- не NULL: чат заблокировал бота, в рассылки не попадает
+);
+CREATE TABLE IF NOT EXISTS regions (
+    chat_id INTEGER PRIMARY KEY,
+    region TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quote_rotation (
+    chat_id INTEGER PRIMARY KEY,
+    seed INTEGER NOT NULL,
+    cursor INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    label TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    label TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+class OutboxMessage(NamedTuple):
+    id: int
+    chat_id: int
+    text: str
+    label: str
+    attempts: int
+
+
+@dataclass(repr=False)
+class OutboxChanges:
+    """Изменения очереди, накопленные в памяти; записываются через ChatStore.apply_outbox()."""
+    enqueued: list[tuple] = field(default_factory=list)
+    rescheduled: list[tuple] = field(default_factory=list)
+    deleted: list[int] = field(default_factory=list)
+    dead: list[tuple] = field(default_factory=list)
+
+    def enqueue(self, chat_id: int, text: str, label: str, error: str, delay: float, attempts: int = 1) -> None:
+        """Поставить сообщение в очередь повторной отправки через delay секунд."""
+        self.enqueued.append((chat_id, text, label, attempts, time.time() + delay, error))
+
+    def reschedule(self, message_id: int, attempts: int, delay: float, error: str) -> None:
+        self.rescheduled.append((attempts, time.time() + delay, error, message_id))
+
+    def delete(self, message_id: int) -> None:
+        self.deleted.append(message_id)
+
+    def dead_letter(self, message: OutboxMessage, attempts: int, error: str) -> None:
+        """Перенести сообщение из очереди в dead_letters."""
+        self.dead.append((message.chat_id, message.text, message.label, attempts, error, time.time()))
+        self.deleted.append(message.id)
+
+    def __len__(self) -> int:
+        return len(self.enqueued) + len(self.rescheduled) + len(self.deleted) + len(self.dead)
+
+    def __repr__(self) -> str:
+        # В логах ошибок записи — счётчики, а не тысячи строк
+        return (f"OutboxChanges(enqueued={len(self.enqueued)}, rescheduled={len(self.rescheduled)}, "
+                f"deleted={len(self.deleted)}, dead={len(self.dead)})")
+
+
+class ChatStore:
+    """Подписки и регионы чатов в SQLite (режим WAL)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        # Запись идёт из пула потоков (asyncio.to_thread), поэтому соединение общее под локом
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self) -> None:
+        """Доводит базы, созданные ранними версиями, до текущей схемы."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(subscriptions)")}
+        if "inactive_since" not in columns:
+            self._conn.execute("ALTER TABLE subscriptions ADD COLUMN inactive_since REAL")
+
+    @STORAGE_SECONDS.timed(operation="load_subscriptions")
+    def load_subscriptions(self) -> list[int]:
+        """Активные подписанные чаты (для заполнения реестра при старте)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT chat_id FROM subscriptions WHERE inactive_since IS NULL").fetchall()
+        return [chat_id for (chat_id,) in rows]
+
+    @STORAGE_SECONDS.timed(operation="load_regions")
+    def load_regions(self) -> dict[int, str]:
+        """Регионы новостей по чатам."""
+        with self._lock:
+            rows = self._conn.execute("SELECT chat_id, region FROM regions").fetchall()
+        return dict(rows)
+
+    @STORAGE_SECONDS.timed(operation="add_subscription")
+    def add_subscription(self, chat_id: int) -> None:
+        # Повторный /start возвращает в рассылку ранее отключённый чат
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO subscriptions (chat_id) VALUES (?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET inactive_since = NULL",
+                (chat_id,),
+            )
+
+    @STORAGE_SECONDS.timed(operation="remove_subscription")
+    def remove_subscription(self, chat_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+
+    @STORAGE_SECONDS.timed(operation="deactivate_chats")
+    def deactivate_chats(self, chat_ids: list[int]) -> int:
+        """Помечает чаты неактивными одной транзакцией и чистит их очередь. Возвращает число отключённых."""
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "UPDATE subscriptions SET inactive_since = ? WHERE chat_id = ? AND inactive_since IS NULL",
+                    ((now, chat_id) for chat_id in chat_ids),
+                )
+                deactivated = self._conn.total_changes - before
+                self._conn.executemany("DELETE FROM outbox WHERE chat_id = ?", ((chat_id,) for chat_id in chat_ids))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deactivated
+
+    def count_inactive(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM subscriptions WHERE inactive_since IS NOT NULL"
+            ).fetchone()[0]
+
+    @STORAGE_SECONDS.timed(operation="set_region")
+    def set_region(self, chat_id: int, region: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO regions (chat_id, region) VALUES (?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET region = excluded.region",
+                (chat_id, region),
+            )
+
+    @STORAGE_SECONDS.timed(operation="load_quote_states")
+    def load_quote_states(self) -> dict[int, tuple[int, int]]:
+        """Состояния ротации цитат: chat_id -> (seed, cursor)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT chat_id, seed, cursor FROM quote_rotation").fetchall()
+        return {chat_id: (seed, cursor) for chat_id, seed, cursor in rows}
+
+    @STORAGE_SECONDS.timed(operation="save_quote_states")
+    def save_quote_states(self, rows: list[tuple[int, int, int]]) -> None:
+        """Сохраняет пачку (chat_id, seed, cursor) одной транзакцией."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO quote_rotation (chat_id, seed, cursor) VALUES (?, ?, ?) "
+                    "ON CONFLICT(chat_id) DO UPDATE SET seed = excluded.seed, cursor = excluded.cursor",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @STORAGE_SECONDS.timed(operation="due")
+    def due(self, limit: int = 100) -> list[OutboxMessage]:
+        """Сообщения, время повторной попытки которых наступило."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, chat_id, text, label, attempts FROM outbox "
+                "WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        return [OutboxMessage(*row) for row in rows]
+
+    @STORAGE_SECONDS.timed(operation="apply_outbox")
+    def apply_outbox(self, changes: OutboxChanges) -> None:
+        """Записывает накопленные изменения очереди одной транзакцией."""
+        if not changes:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO outbox (chat_id, text, label, attempts, next_attempt_at, last_error) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    changes.enqueued,
+                )
+                self._conn.executemany(
+                    "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    changes.rescheduled,
+                )
+                self._conn.executemany("DELETE FROM outbox WHERE id = ?", ((message_id,) for message_id in changes.deleted))
+                self._conn.executemany(
+                    "INSERT INTO dead_letters (chat_id, text, label, attempts, error, failed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    changes.dead,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,42 @@
+"""
+Реестр подписанных чатов
+========================
+Вместо трёх заданий JobQueue на каждый чат храним множество подписчиков:
+по одному заданию на событие, которое рассылает сообщение всем чатам из реестра.
+"""
+
+from collections.abc import Iterable, Iterator
+
+
+class SubscriptionRegistry:
+    """Множество подписанных chat_id с проверкой и добавлением за O(1)."""
+
+    def __init__(self, chat_ids: Iterable[int] = ()) -> None:
+        self._chat_ids: set[int] = set(chat_ids)
+
+    def add(self, chat_id: int) -> bool:
+        """Подписывает чат. Возвращает True, если он не был подписан."""
+        if chat_id in self._chat_ids:
+            return False
+        self._chat_ids.add(chat_id)
+        return True
+
+    def remove(self, chat_id: int) -> bool:
+        """Отписывает чат. Возвращает True, если он был подписан."""
+        if chat_id not in self._chat_ids:
+            return False
+        self._chat_ids.discard(chat_id)
+        return True
+
+    def chat_ids(self) -> list[int]:
+        """Снимок подписчиков для рассылки (реестр можно менять во время отправки)."""
+        return list(self._chat_ids)
+
+    def __contains__(self, chat_id: object) -> bool:
+        return chat_id in self._chat_ids
+
+    def __len__(self) -> int:
+        return len(self._chat_ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.chat_ids())
@@ -0,0 +1,85 @@
+"""
+Обработка обновлений по чатам
+=============================
+По умолчанию Application обрабатывает обновления строго по одному: пока
+/news одного чата ждёт NewsAPI, остальные чаты стоят в очереди. KeyedUpdateProcessor
+заводит очередь на каждый чат: обновления одного чата выполняются по порядку
+одной задачей, разные чаты — параллельно, но не больше max_concurrent_updates
+одновременно. Обновления, ждущие своей очереди в чате, слот лимита не занимают.
+"""
+
+import logging
+from collections import deque
+from collections.abc import Awaitable, Hashable
+from typing import Any
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+DEFAULT_MAX_CONCURRENT_UPDATES = 32
+
+
+def update_key(update: object) -> Hashable | None:
+    """Ключ очереди: id чата, иначе id пользователя; None — обновление не привязано к чату."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    return None
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Последовательно внутри чата, параллельно между чатами, с общим лимитом."""
+
+    __slots__ = ("_queues",)
+
+    def __init__(self, max_concurrent_updates: int = DEFAULT_MAX_CONCURRENT_UPDATES) -> None:
+        super().__init__(max_concurrent_updates)
+        self._queues: dict[Hashable, deque[Awaitable[Any]]] = {}   # только чаты в обработке
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._queues)
+
+    @property
+    def queued_updates(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = update_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # Чат уже занят: обновление выполнит его задача, слот лимита освобождается
+            queue.append(coroutine)
+            return
+
+        self._queues[key] = queue = deque()
+        try:
+            await _run(coroutine)
+            while queue:
+                await _run(queue.popleft())
+        finally:
+            del self._queues[key]
+            while queue:   # задачу отменили — не оставляем неожиданных корутин
+                queue.popleft().close()
+
+    async def initialize(self) -> None:
+        """Ресурсов нет."""
+
+    async def shutdown(self) -> None:
+        """Ресурсов нет: Application.stop() сам дожидается задач, разбирающих очереди."""
+
+
+async def _run(coroutine: Awaitable[Any]) -> None:
+    # Ошибки хендлеров уходят в обработчики ошибок Application; здесь — всё остальное,
+    # чтобы сбой одного обновления не терял следующие обновления того же чата
+    try:
+        await coroutine
+    except Exception as e:
+        logging.exception("Update processing failed: %s", e)
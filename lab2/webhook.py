@@ -0,0 +1,99 @@
+"""
+Режим вебхука
+=============
+Локальный aiohttp-сервер вместо run_polling: принимает обновления от Telegram,
+сверяет заголовок X-Telegram-Bot-Api-Secret-Token и отдаёт /health для балансировщика.
+Несколько экземпляров бота можно поставить за один балансировщик.
+"""
+
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+DEFAULT_PATH = "/telegram"
+HEALTH_PATH = "/health"
+
+
+def build_webhook_app(application: Application, path: str = DEFAULT_PATH, secret_token: str | None = None) -> web.Application:
+    """aiohttp-приложение, которое кладёт входящие обновления в application.update_queue."""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            logging.warning("Rejected webhook request with bad secret from %s", request.remote)
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception as e:
+            logging.warning("Malformed webhook update: %s", e)
+            return web.Response(status=400)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(request: web.Request) -> web.Response:
+        if application.running:
+            return web.json_response({"status": "ok"})
+        return web.json_response({"status": "starting"}, status=503)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get(HEALTH_PATH, handle_health)
+    return app
+
+
+async def serve_webhook(
+    application: Application,
+    webhook_url: str,
+    listen: str = "0.0.0.0",
+    port: int = 8080,
+    path: str = DEFAULT_PATH,
+    secret_token: str | None = None,
+) -> None:
+    """Жизненный цикл как у run_polling (post_init/post_shutdown), но с вебхуком. Работает до SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # pragma: no cover - Windows
+            pass
+
+    runner = web.AppRunner(build_webhook_app(application, path, secret_token))
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url=webhook_url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        logging.info("Webhook listening on %s:%d%s", listen, port, path)
+
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application: Application, webhook_url: str, **kwargs) -> None:
+    """Блокирующий запуск (аналог application.run_polling)."""
+    try:
+        asyncio.run(serve_webhook(application, webhook_url, **kwargs))
+    except KeyboardInterrupt:
+        pass
@@ -12,7 +12,9 @@ echo "[start.sh] Working dir: $(pwd)"
 # Необязательные (имеют дефолты в коде), экспортируем на всякий случай
 : "${BOT_TIMEZONE:=Europe/Moscow}"
 : "${DEFAULT_REGION:=ru}"
-export BOT_TIMEZONE DEFAULT_REGION
+: "${BOT_DB_PATH:=bot_state.db}"  # на Railway укажите путь на подключённом томе
+export BOT_TIMEZONE DEFAULT_REGION BOT_DB_PATH
+# WEBHOOK_URL (и WEBHOOK_SECRET) включают режим вебхука; порт берётся из PORT
 
 # Определяем python
 if command -v python3 >/dev/null 2>&1; then
@@ -21,9 +23,24 @@ else
   PY=python
 fi
 
-# Устанавливаем зависимости
-$PY -m pip install --upgrade pip setuptools wheel
-$PY -m pip install --no-cache-dir -r requirements.txt
+# Устанавливаем зависимости, только если requirements.txt изменился с прошлой
+# установки: при перезапуске контейнера бот стартует без обращения к pip.
+# SKIP_PIP_INSTALL=1 — зависимости уже есть в образе, pip не вызывается вовсе
+DEPS_STAMP=.requirements.sha256
+REQ_HASH=$(sha256sum requirements.txt 2>/dev/null | cut -d' ' -f1 || true)
+if [ "${SKIP_PIP_INSTALL:-0}" = "1" ]; then
+  echo "[start.sh] SKIP_PIP_INSTALL=1, pip install skipped"
+elif [ -n "$REQ_HASH" ] && [ "$(cat "$DEPS_STAMP" 2>/dev/null)" = "$REQ_HASH" ]; then
+  echo "[start.sh] requirements.txt unchanged, pip install skipped"
+else
+  $PY -m pip install --upgrade pip setuptools wheel
+  $PY -m pip install --no-cache-dir -r requirements.txt
+  # Байткод собирается сейчас, а не при первом импорте после старта
+  $PY -m compileall -q . || true
+  if [ -n "$REQ_HASH" ]; then
+    echo "$REQ_HASH" > "$DEPS_STAMP"
+  fi
+fi
 
 # Запускаем бота
 exec $PY bot.py
\ No newline at end of file